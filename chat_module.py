@@ -7,6 +7,8 @@ chat_module.py — واجهة محادثة بين المدير والموظف
   - كل رسالة بصيغة: 📅 YYYY-MM-DD HH:MM [ROLE]: النص
   - يُعرض الحوار كفقاعات محادثة مرتّبة زمنياً
   - لا حاجة لعمود جديد في الشيت
+  - الإرسال يُلحق الرسالة بخلية صفها وحده (العمود _row) على قيمتها الحالية في الشيت،
+    فلا تُعاد كتابة الورقة ولا تضيع رسالة متزامنة
 
 الاستخدام في dashboard.py:
     from chat_module import show_activity_chat, show_kpi_chat
@@ -16,6 +18,8 @@ import re
 import streamlit as st
 import pandas as pd
 from datetime import datetime
+from data_store import key_mask
+from sheet_writes import update_row_cells, stamp_updated, Append
 
 # ──────────────────────────────────────────────
 # CSS فقاعات المحادثة
@@ -133,12 +137,6 @@ def _format_new_comment(text: str, role: str) -> str:
     return f"📅 {ts} [{role}]: {text.strip()}"
 
 
-def _append_comment(original: str, new_entry: str) -> str:
-    """يُلحق الرسالة الجديدة بالنص الأصلي."""
-    original = str(original).strip()
-    return f"{original}\n{new_entry}" if original else new_entry
-
-
 # ──────────────────────────────────────────────
 # عرض فقاعات المحادثة
 # ──────────────────────────────────────────────
@@ -202,10 +200,8 @@ def show_activity_chat(
         show_activity_chat(ws_acts, df_acts, sel_init, sel_act,
                            current_role="Admin", current_user=user_name)
     """
-    mask = (
-        (df_acts["Mabadara"].astype(str).str.strip() == mabadara.strip()) &
-        (df_acts["Activity"].astype(str).str.strip() == activity.strip())
-    )
+    # المطابقة بالمفتاح المطبّع: لا تفشل بسبب اختلاف الهمزات أو التطويل أو المسافات
+    mask = key_mask(df_acts, "Mabadara", mabadara) & key_mask(df_acts, "Activity", activity)
     if not mask.any():
         st.warning("لم يُعثر على النشاط.")
         return
@@ -260,27 +256,24 @@ def show_activity_chat(
         st.caption(f"الوقت: {datetime.now().strftime('%H:%M')}")
 
 
-def _send_activity_message(ws, df_acts, mask, text, role):
-    """يحفظ الرسالة في العمود المناسب ويُحدّث الشيت."""
+def _send_message(ws, df, mask, text, role, key_cols):
+    """يُلحق الرسالة بخلية العمود المناسب في صف المحادثة وحده، مشروطاً بمفاتيح الصف."""
     import time
     entry = _format_new_comment(text, role)
     col   = "Admin_Comment" if role == "Admin" else "Owner_Comment"
-
-    if col not in df_acts.columns:
-        df_acts[col] = ""
-
-    old = str(df_acts.loc[mask, col].values[0]).strip()
-    df_acts.loc[mask, col] = _append_comment(old, entry)
+    row   = df[mask].iloc[0]
 
     try:
-        # تنظيف وحفظ
-        df_clean = df_acts.fillna("").astype(object).where(
-            pd.notnull(df_acts.fillna("")), ""
-        )
-        ws.update(
-            values=[df_clean.columns.tolist()] + df_clean.values.tolist(),
-            range_name="A1",
+        updates = {col: Append(entry, "\n")}
+        if col == "Owner_Comment":
+            updates = stamp_updated(updates)   # رسالة الموظف تحديث منه (Last_Updated)
+        ok = update_row_cells(
+            ws, int(row["_row"]), updates,
+            expect={c: row[c] for c in key_cols},
         )
+        if not ok:
+            st.warning("تغيّر ترتيب الصفوف في الشيت — حدّث الصفحة وأعد الإرسال.")
+            return
         st.success("✅ تم إرسال الرسالة!")
         time.sleep(0.8)
         st.rerun()
@@ -288,6 +281,11 @@ def _send_activity_message(ws, df_acts, mask, text, role):
         st.error(f"خطأ في الحفظ: {e}")
 
 
+def _send_activity_message(ws, df_acts, mask, text, role):
+    """يحفظ الرسالة في العمود المناسب لصف النشاط."""
+    _send_message(ws, df_acts, mask, text, role, ("Mabadara", "Activity"))
+
+
 # ──────────────────────────────────────────────
 # الواجهة الرئيسية — مؤشر KPI
 # ──────────────────────────────────────────────
@@ -303,7 +301,7 @@ def show_kpi_chat(
     الاستخدام:
         show_kpi_chat(ws_kpi, df_kpi, sel_kpi_name, "Admin", user_name)
     """
-    mask = df_kpi["KPI_Name"].astype(str).str.strip() == kpi_name.strip()
+    mask = key_mask(df_kpi, "KPI_Name", kpi_name)
     if not mask.any():
         st.warning("لم يُعثر على المؤشر.")
         return
@@ -349,21 +347,4 @@ def show_kpi_chat(
 
 
 def _send_kpi_message(ws_kpi, df_kpi, mask, text, role):
-    import time
-    entry = _format_new_comment(text, role)
-    col   = "Admin_Comment" if role == "Admin" else "Owner_Comment"
-    if col not in df_kpi.columns:
-        df_kpi[col] = ""
-    old = str(df_kpi.loc[mask, col].values[0]).strip()
-    df_kpi.loc[mask, col] = _append_comment(old, entry)
-    try:
-        df_clean = df_kpi.fillna("").astype(object).where(pd.notnull(df_kpi.fillna("")), "")
-        ws_kpi.update(
-            values=[df_clean.columns.tolist()] + df_clean.values.tolist(),
-            range_name="A1",
-        )
-        st.success("✅ تم إرسال الرسالة!")
-        time.sleep(0.8)
-        st.rerun()
-    except Exception as e:
-        st.error(f"خطأ في الحفظ: {e}")
+    _send_message(ws_kpi, df_kpi, mask, text, role, ("KPI_Name",))
@@ -1,12 +1,36 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 import os
 import re
+import json
 import time
-from datetime import datetime, date
+import threading
+from datetime import datetime, date, timedelta
+from data_store import (
+    SHEET_SCHEMAS, coerce_frame, as_category, to_float_series, to_int_series,
+    to_date_series, data_version, bump_version, warm_value, start_refresher, single_flight,
+    single_flight_stats, refresher_status, fetch_all, stamp_frame, derive_token,
+    versioned_result, result_cache_stats, publish, subscribe, structure_version, scope_version,
+    poll_bus, frame_view, frame_memory, normalize_key, key_column, key_mask, lookup_rows,
+    schema_categories, tenant_stats, TENANT_IDLE_SECONDS, TENANT_MEMORY_MB, ROW_VERSION_COL, LAST_UPDATED_COL,
+)
+from kpi_catalog import (
+    KPI_GROUPS, Direction, kpi_catalog, parse_unit, is_percentage_kpi, fmt_kpi_value,
+)
+from sheet_writes import (
+    RowEdit, Append, write_cell_diffs, update_row_cells, stamp_updated, last_comment_stamp,
+    backfill_last_updated,
+)
+import replica
+import data_service
+import tenants
+import user_directory
+import sheet_metrics
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # ---------------------------------------------------------
 # 1. إعدادات الصفحة
@@ -98,31 +122,7 @@ st.markdown("""
 # ---------------------------------------------------------
 # 2. تعريف المجموعات
 # ---------------------------------------------------------
-KPI_GROUPS = {
-    "QI4SD": [
-        "QI4SD - Metrology", "CMC", "B of CMC", "ILC", "CC",
-        "OIML project groups", "OIML-CS - number of services offered",
-    ],
-    "البحث والتطوير": [
-        "عدد الابحاث العلمية المنشورة في مجلات مصنفة دولياً Q1, Q2",
-        "عدد المشاركات العلمية الدولية", "عدد الطلاب الملتحقين",
-        "عدد فعاليات الاستقطاب الجامعي", "عدد المشاريع الوطنية",
-        "عدد المشاركين سنوياً في برامج التبادل الفني",
-    ],
-    "الكفاءة التشغيلية": [
-        "نسبة نضج الحوكمة المؤسسية KAQA", "مؤشر التميز المؤسسي",
-        "نسبة الإجراءات المؤتمتة", "مستوى رضا المستفيدين", "التحول الرقمي DGA",
-        "نسبة الدوران الوظيفي", "نسبة الإيرادات الى إجمالي ميزانية",
-        "نسبة النمو في إيرادات",
-    ],
-}
-
-def get_kpi_category(kpi_name):
-    kpi_name = str(kpi_name).strip()
-    for group, items in KPI_GROUPS.items():
-        if kpi_name in [str(i).strip() for i in items]:
-            return group
-    return "مؤشرات أخرى"
+# المجموعات وبيانات المؤشرات التعريفية (الوحدة، التكرار، الاتجاه، التنسيق) في kpi_catalog.py
 
 # ---------------------------------------------------------
 # 2.1 أدوات الهدف المزدوج (السنوي + التراكمي)
@@ -130,11 +130,6 @@ def get_kpi_category(kpi_name):
 # عمود الهدف السنوي يبقى باسم Target، ويُضاف عمود Target_Cumulative للهدف النهائي.
 KPI_CUM_COL = "Target_Cumulative"
 
-def is_percentage_kpi(unit):
-    """يحدد إن كان المؤشر من نوع نسبة (لا يُجمع تراكمياً) اعتماداً على وحدة القياس."""
-    u = str(unit).strip().lower()
-    return ("نسبة" in u) or ("%" in u) or ("percent" in u)
-
 def prepare_kpi_df(df_kpi):
     """يضمن وجود الأعمدة المطلوبة، يحوّل الأهداف والمتحقق إلى أرقام، ويرتّب الأعمدة.
     يُستخدم في كل الواجهات. الهدف التراكمي يوضع مباشرة بعد اسم المؤشر."""
@@ -154,9 +149,7 @@ def prepare_kpi_df(df_kpi):
     if KPI_CUM_COL not in df_kpi.columns:
         # الهدف التراكمي غير موجود بعد → يُهيّأ فارغاً (يدخله المدير لاحقاً)
         df_kpi[KPI_CUM_COL] = 0.0
-    df_kpi["Target"]      = df_kpi["Target"].apply(safe_float)
-    df_kpi[KPI_CUM_COL]   = df_kpi[KPI_CUM_COL].apply(safe_float)
-    df_kpi["Actual"]      = df_kpi["Actual"].apply(safe_float)
+    df_kpi = coerce_frame(df_kpi, SHEET_SCHEMAS["KPIs"])
     # ترتيب الأعمدة: اسم المؤشر ثم الهدف التراكمي ثم بقية الأعمدة كما هي
     front = [c for c in ["KPI_Name", KPI_CUM_COL] if c in df_kpi.columns]
     rest  = [c for c in df_kpi.columns if c not in front]
@@ -176,18 +169,16 @@ def compute_cumulative_actual(kpi_name, unit, current_actual, df_history):
             return cur
         if df_history is None or df_history.empty:
             return cur
-        h = df_history[
-            df_history["KPI_Name"].astype(str).str.strip() == str(kpi_name).strip()
-        ].copy()
+        h = lookup_rows(df_history, "KPI_Name", kpi_name)
         if h.empty:
             return cur
-        h["_d"] = pd.to_datetime(h["Date"], errors="coerce")
+        h["_d"] = to_date_series(h["Date"])
         h = h.dropna(subset=["_d"])
         if h.empty:
             return cur
         h["_year"]   = h["_d"].dt.year
-        yearly       = h.sort_values("_d").groupby("_year").tail(1).copy()
-        yearly["_v"] = yearly["Actual"].apply(safe_float)
+        yearly       = h.sort_values("_d").groupby("_year").tail(1)
+        yearly["_v"] = to_float_series(yearly["Actual"])
         cur_year     = datetime.now().year
         total        = float(yearly["_v"].sum())
         if cur_year in list(yearly["_year"].values):
@@ -199,61 +190,61 @@ def compute_cumulative_actual(kpi_name, unit, current_actual, df_history):
     except Exception:
         return cur
 
-def parse_unit(unit):
-    """يفصل وحدة القياس عن التكرار في حقل Unit بصيغة '<النوع> - <التكرار>'."""
-    u = str(unit).strip()
-    if " - " in u:
-        a, b = u.split(" - ", 1)
-        return a.strip(), b.strip()
-    return u, ""
-
-def fmt_kpi_value(val, unit):
-    """تنسيق موحّد: النسب تُعرض مع علامة %، والأعداد كما هي.
-    ملاحظة: ورقة KPIs تخزّن النسب كأرقام كاملة (85 = 85%) لا ككسور، فلا ضرب ×100."""
-    v = safe_float(val)
-    if is_percentage_kpi(unit):
-        disp = int(v) if v == int(v) else round(v, 1)
-        return str(disp) + "%"
-    return str(int(v) if v == int(v) else round(v, 2))
-
-def update_kpi_cells(ws, kpi_name, updates):
+def editor_frame(key, df, context=None):
     """
-    تحديث خلايا محددة فقط لصف مؤشر واحد (بدل إعادة كتابة الورقة كاملة) — يمنع
-    ضياع تعديلات الملاك عند الحفظ المتزامن. يتطلب وجود الأعمدة في رأس الورقة.
-    updates: قاموس {اسم_العمود: القيمة}
+    الإطار الذي يُعرض في st.data_editor ذي المفتاح key. edited_rows مفهرسة بموضع الصف، فما دام في
+    المحرر تعديلات غير محفوظة يُعرض ويُحفظ الإطار كما كان عند بدء التعديل (محفوظاً في الحالة)
+    لا إطار أعيد بناؤه بعد تحديث الورقة — وإلا وقعت الملاحظة على صف آخر. context (المبادرة أو
+    الفلتر) إن تغيّر يُسقط التعديلات المعلّقة لأنها تخص صفوفاً أخرى.
     """
-    all_vals = ws.get_all_values()
-    if not all_vals:
-        return False
-    header = all_vals[0]
-    if "KPI_Name" not in header:
-        return False
-    name_idx = header.index("KPI_Name")
-    target_row = None
-    for i, row in enumerate(all_vals[1:], start=2):
-        if len(row) > name_idx and str(row[name_idx]).strip() == str(kpi_name).strip():
-            target_row = i
-            break
-    if target_row is None:
-        return False
-    cells = []
-    for col_name, val in updates.items():
-        if col_name in header:
-            cells.append(gspread.Cell(target_row, header.index(col_name) + 1, val))
-    if cells:
-        ws.update_cells(cells)
-    return True
-
-def plot_dual_target_bars(row, cum_actual, ctx=""):
+    pin   = st.session_state.get(key + "__rows")
+    state = st.session_state.get(key) or {}
+    if pin is not None and pin[0] == context and state.get("edited_rows"):
+        if list(pin[1].get("_row", [])) != list(df.get("_row", [])):
+            st.warning("تغيّرت صفوف الورقة منذ بدء التعديل — يُعرض الجدول كما كان عنده، "
+                       "والحفظ يتحقق من كل صف قبل الكتابة.")
+        return pin[1]
+    if pin is not None and pin[0] != context:
+        st.session_state.pop(key, None)
+    st.session_state[key + "__rows"] = (context, df)
+    return df
+
+def editor_changes(key):
+    """
+    ما عدّله المستخدم فعلاً في st.data_editor ذي المفتاح key: [(صف، {عمود: القيمة الجديدة})] —
+    المواضع تُحل على الإطار الذي عُدّل فعلاً (editor_frame).
+    """
+    pin   = st.session_state.get(key + "__rows")
+    state = st.session_state.get(key) or {}
+    if pin is None:
+        return []
+    df  = pin[1]
+    out = []
+    for pos, cols in sorted((int(p), c) for p, c in state.get("edited_rows", {}).items()):
+        if cols and 0 <= pos < len(df):
+            out.append((df.iloc[pos], dict(cols)))
+    return out
+
+def reset_editor(key):
+    """بعد الحفظ: تُسقط تعديلات المحرر والإطار المثبّت معها."""
+    st.session_state.pop(key, None)
+    st.session_state.pop(key + "__rows", None)
+
+def hidden_private_cols(df):
+    """column_config يخفي الأعمدة الخاصة والآلية (_row، المفاتيح، التواريخ المحوّلة، النسخة، آخر تحديث) في المحررات."""
+    return {c: None for c in df.columns
+            if str(c).startswith("_") or c in (ROW_VERSION_COL, LAST_UPDATED_COL)}
+
+def plot_dual_target_bars(row, cum_actual, ctx="", meta=None):
     """رسم الأعمدة الأربعة لمؤشر واحد: المتحقق/المستهدف السنوي + المتحقق/الهدف النهائي."""
-    unit = str(row.get("Unit", "")).strip()
+    fmt = meta.fmt if meta is not None else (lambda v: fmt_kpi_value(v, row.get("Unit", "")))
     a_act = safe_float(row.get("Actual", 0))
     a_tgt = safe_float(row.get("Target", 0))
     c_tgt = safe_float(row.get(KPI_CUM_COL, 0))
     c_act = safe_float(cum_actual)
     labels = ["المتحقق السنوي", "المستهدف السنوي", "المتحقق التراكمي", "الهدف النهائي"]
     vals   = [a_act, a_tgt, c_act, c_tgt]
-    texts  = [fmt_kpi_value(v, unit) for v in vals]
+    texts  = [fmt(v) for v in vals]
     colors = ["#1f77b4", "#adc7e8", "#16a085", "#d4ac0d"]
     fig = go.Figure(go.Bar(
         x=labels, y=vals, marker_color=colors,
@@ -268,46 +259,54 @@ def plot_dual_target_bars(row, cum_actual, ctx=""):
     sk = (str(row.get("KPI_Name", "")) + ctx).replace(" ", "_").replace("/", "_")[:80]
     st.plotly_chart(fig, use_container_width=True, key="dual_" + sk)
 
-def kpi_meta_caption(row, df_history=None):
-    """سطر بيانات تعريفية: المالك، تكرار القياس، تاريخ آخر تحديث."""
+def kpi_meta_caption(row, df_history=None, meta=None):
+    """سطر بيانات تعريفية: المالك، تكرار القياس، تاريخ آخر تحديث.
+    meta: بيانات المؤشر من kpi_catalog إن توفرت (وإلا يُستخرج التكرار من الصف)."""
     owner = str(row.get("Owner", "")).strip() or "غير محدد"
-    freq  = str(row.get("Frequency", "")).strip()
-    if not freq:
-        # لا يوجد عمود Frequency منفصل — التكرار مدمج في Unit بصيغة 'النوع - التكرار'
-        _, freq = parse_unit(row.get("Unit", ""))
+    if meta is not None:
+        freq = meta.frequency
+    else:
+        # لا يوجد عمود Frequency منفصل غالباً — التكرار مدمج في Unit بصيغة 'النوع - التكرار'
+        freq = str(row.get("Frequency", "")).strip() or parse_unit(row.get("Unit", ""))[1]
     freq = freq or "غير محدد"
     last  = "—"
     try:
         if df_history is not None and not df_history.empty:
-            h = df_history[
-                df_history["KPI_Name"].astype(str).str.strip()
-                == str(row.get("KPI_Name", "")).strip()
-            ]
+            h = lookup_rows(df_history, "KPI_Name", row.get("KPI_Name", ""))
             if not h.empty:
                 last = str(h["Date"].iloc[-1])
     except Exception:
         pass
     return "👤 المالك: " + owner + "  •  🔁 التكرار: " + freq + "  •  🕓 آخر تحديث: " + last
 
-def show_kpi_scorecard(df_kpi, title="ملخّص المؤشرات"):
-    """لوحة ملخّص مختصرة أعلى الواجهة: على المسار / متعثّر / حرج (حسب الاتجاه)."""
+def kpi_status_counts(df_kpi):
+    """عدد المؤشرات على المسار / المتعثّرة / الحرجة (حسب الاتجاه) — أساس لوحة الملخّص."""
+    down = kpi_catalog(df_kpi).columns["direction"] == Direction.DOWN
+    t    = to_float_series(df_kpi["Target"]).to_numpy()
+    a    = to_float_series(df_kpi["Actual"]).to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(down, np.where(a != 0, t / a * 100, 0.0), a / t * 100)
+    pct = pct[t != 0]
+    return {"total": len(df_kpi), "on_track": int((pct >= 100).sum()),
+            "at_risk": int(((pct >= 60) & (pct < 100)).sum()), "off_track": int((pct < 60).sum())}
+
+def kpi_bar_colors(df):
+    """لون عمود كل مؤشر حسب اتجاهه: تنازلي أخضر إن لم يتجاوز المستهدف؛ تصاعدي أزرق فوقه،
+    أخضر عنده، أحمر دونه."""
+    down = kpi_catalog(df).columns["direction"] == Direction.DOWN
+    t    = to_float_series(df["Target"]).to_numpy()
+    a    = to_float_series(df["Actual"]).to_numpy()
+    return np.where(down, np.where(a <= t, "#2ca02c", "#d62728"),
+                    np.where(a > t, "#1f77b4", np.where(a == t, "#2ca02c", "#d62728")))
+
+def show_kpi_scorecard(df_kpi, title="ملخّص المؤشرات", counts=None):
+    """لوحة ملخّص مختصرة أعلى الواجهة: على المسار / متعثّر / حرج (حسب الاتجاه).
+    counts: نتيجة kpi_status_counts محسوبة مسبقاً (من خيط الخلفية) إن توفرت."""
     if df_kpi is None or df_kpi.empty:
         return
-    on_track = at_risk = off_track = 0
-    for _, r in df_kpi.iterrows():
-        t = safe_float(r.get("Target", 0))
-        a = safe_float(r.get("Actual", 0))
-        d = str(r.get("Direction", "تصاعدي")).strip()
-        if t == 0:
-            continue
-        pct = (a / t) * 100 if d != "تنازلي" else (t / a) * 100 if a else 0
-        if pct >= 100:
-            on_track += 1
-        elif pct >= 60:
-            at_risk += 1
-        else:
-            off_track += 1
-    total = len(df_kpi)
+    c = counts or versioned_result("kpi_status_counts", df_kpi, (),
+                                   lambda: kpi_status_counts(df_kpi))
+    total, on_track, at_risk, off_track = c["total"], c["on_track"], c["at_risk"], c["off_track"]
     st.markdown(
         "<div class='alert-summary-grid'>"
         "<div class='alert-summary-card s-blue'><div class='num'>"   + str(total)     + "</div><div class='lbl'>إجمالي المؤشرات</div></div>"
@@ -321,8 +320,25 @@ def show_kpi_scorecard(df_kpi, title="ملخّص المؤشرات"):
 # ---------------------------------------------------------
 # 3. اتصال Google Sheets
 # ---------------------------------------------------------
+# المصنّف الافتراضي؛ مصنّفات إضافية (إدارات أو سنوات مالية) تُعرَّف في NMCC_TENANTS وتُختار عند
+# الدخول — وكل ما يلي (الاتصال، الإصدارات، المخازن، النسخة المحلية) يتبع مستأجر الجلسة
 SHEET_ID          = "11tKfYa-Sqa96wDwQvMvChgRWaxgMRAWAIvul7p27ayY"
+tenants.configure(SHEET_ID)
 KPI_HISTORY_SHEET = "KPI_History"
+OPS_HISTORY_SHEET = "Ops_KPI_History"
+# السجل التاريخي مقسّم إلى ورقة لكل سنة (مثل KPI_History_2026)؛ الكتابة تذهب لورقة سنة القيد
+# والقراءة تجلب فقط أوراق السنوات المطلوبة — بالتوازي عند الحاجة لأكثر من ورقة.
+HISTORY_COLS          = ["KPI_Name", "Date", "Actual", "Target", "Recorded_By", "Note"]
+HISTORY_FETCH_WORKERS = 4
+# مرآة محلية (Parquet) لكل ورقة سجل بأنواعها الجاهزة — تُغني عن التنزيل الكامل بعد إعادة التشغيل
+HISTORY_CACHE_DIR     = os.environ.get("NMCC_CACHE_DIR", ".nmcc_cache")
+# كل قارئ مخزّن مفتاحه إصدار بياناته، وناقل الإبطال (data_store.publish) يرفع الإصدار عند أي
+# كتابة من أي جلسة أو عملية — فالمهلة حدّ أمان للذاكرة فقط وليست آلية الحداثة.
+CACHE_TTL         = int(os.environ.get("NMCC_CACHE_TTL", "3600"))
+CACHE_MAX_ENTRIES = 256
+# محمّلات الإطارات مخزّنة كموارد (st.cache_resource): لقطة واحدة لكل إصدار تتشاركها كل الجلسات
+# بدل نسخة مفكوكة لكل استدعاء (st.cache_data)؛ الواجهات تأخذ منها frame_view فقط، فتبقى ذاكرة
+# الجلسة ثابتة مهما زاد عدد المستخدمين.
 
 def get_creds():
     scope = ["https://spreadsheets.google.com/feeds",
@@ -342,8 +358,302 @@ def get_creds():
 
 def get_sheet_connection():
     creds  = get_creds()
-    client = gspread.authorize(creds)
-    return client.open_by_key(SHEET_ID)
+    # العميل يخصم طلباته من ميزانية مستأجر الجلسة ويسجّل كل طلب في sheet_metrics
+    client = gspread.authorize(creds, http_client=sheet_metrics.MeteredHTTPClient)
+    return client.open_by_key(tenants.sheet_id())
+
+@st.cache_resource(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_sheet_frame(sheet_name, version):
+    """
+    تحميل ورقة كاملة وتحويل أعمدتها حسب مخططها في SHEET_SCHEMAS — مرة واحدة لكل إصدار
+    بيانات (version = data_version(sheet_name)) بدل كل إعادة تشغيل. ترفع الاستثناء للمستدعي.
+    """
+    sheet_metrics.cache_miss()
+    return _fetch_sheet_frame(get_sheet_connection(), sheet_name)
+
+def _fetch_sheet_frame(sh, sheet_name, sync=False):
+    """
+    الإطار من خدمة البيانات المشتركة إن كانت مشغّلة، ثم النسخة المحلية (replica) إن كانت صالحة،
+    وإلا من الورقة مع تحديث النسخة. sync=True (خيط التحديث) يتجاوز النسخة المحلية — هذه هي
+    المزامنة الدورية (والخدمة تجدّد إطاراتها بنفسها فتُقرأ منها دائماً).
+    """
+    df = data_service.query(sheet_name)
+    if df is None and not sync:
+        df = replica.read(sheet_name)
+    if df is None:
+        started = time.time()   # كتابة تُنشر أثناء الجلب تُبقي النسخة متسخة (replica.store)
+        # كل قراءات الأوراق تمر عبر single_flight: الجلسات التي تفقد التخزين في اللحظة نفسها
+        # (بعد كتابة أو مع بداية اجتماع) تنتظر جلباً واحداً لنفس الورقة والإصدار وتتشارك نتيجته
+        recs = single_flight(("get_all_records", sheet_name, data_version(sheet_name)),
+                             lambda: sh.worksheet(sheet_name).get_all_records())
+        df = pd.DataFrame(recs)
+        if not df.empty:
+            df["_row"] = range(2, len(df) + 2)   # رقم الصف في الورقة — للكتابة على مستوى الخلية
+        replica.store(sheet_name, df, SHEET_SCHEMAS.get(sheet_name, {}).get("key", []), started)
+    return stamp_frame(_finish_frame(sheet_name, df), sheet_name)
+
+def fetch_parallel(jobs):
+    """
+    fetch_all لمسار الطلب: خيوط التنفيذ تُربط بسياق الجلسة الحالية فتعمل st.cache_data
+    ورسائل st داخل المحمّلات كما لو استُدعيت مباشرة.
+    """
+    ctx  = get_script_run_ctx()
+    init = (lambda: add_script_run_ctx(threading.current_thread(), ctx)) if ctx else None
+    return fetch_all(jobs, initializer=init)
+
+def sheet_frame(sheet_name):
+    """
+    الإطار الحالي للورقة لمسار الطلب: من المخزن الدافئ (خيط الخلفية) إن كان مطابقاً لإصدارها،
+    وإلا التحميل المخزّن المباشر. مرجع خاص بالمستدعي (frame_view) يمكنه تعديله دون نسخ اللقطة.
+    """
+    df = warm_value(sheet_name, [sheet_name])
+    if df is None:
+        with sheet_metrics.cached_lookup("st.cache", sheet_name):
+            df = load_sheet_frame(sheet_name, data_version(sheet_name))
+    return frame_view(df)
+
+# الأعمدة التي تحتاجها واجهة الاطلاع ولوحة الملخّص — بدون أعمدة التعليقات الطويلة
+KPI_VIEW_COLS = ["KPI_Name", "Target", "Actual", "Direction", "Unit", KPI_CUM_COL]
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_sheet_header(sheet_name, version):
+    """رأس الورقة فقط (الصف الأول) — لتحديد مواضع الأعمدة دون تنزيل البيانات."""
+    return single_flight(("header", sheet_name, version),
+                         lambda: get_sheet_connection().worksheet(sheet_name).row_values(1))
+
+@st.cache_resource(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_sheet_columns(sheet_name, columns, version):
+    """
+    تحميل أعمدة محددة فقط من الورقة (إسقاط أعمدة): يُحدَّد موضع كل عمود من الرأس ثم تُجلب
+    نطاقاتها في طلب واحد مجمّع. الأعمدة غير الموجودة في الورقة تُهمل، والنتيجة تمر بنفس
+    تحويل load_sheet_frame ومع العمود _row.
+    """
+    sheet_metrics.cache_miss()
+    local = read_local(sheet_name, columns=columns)
+    if local is not None:
+        return stamp_frame(_finish_frame(sheet_name, local), sheet_name, "columns", tuple(columns))
+    header = load_sheet_header(sheet_name, version)
+    cols   = [c for c in columns if c in header]
+    data   = {}
+    if cols:
+        ranges = []
+        for c in cols:
+            letter = _col_letter(header.index(c) + 1)
+            ranges.append(gspread.utils.absolute_range_name(sheet_name, letter + "2:" + letter))
+        resp = single_flight(("columns", sheet_name, tuple(ranges), version),
+                             lambda: get_sheet_connection().values_batch_get(
+                                 ranges, params={"majorDimension": "COLUMNS"}))
+        for c, vr in zip(cols, resp.get("valueRanges", [])):
+            data[c] = (vr.get("values") or [[]])[0]
+    n  = max((len(v) for v in data.values()), default=0)
+    df = pd.DataFrame({c: list(v) + [""] * (n - len(v)) for c, v in data.items()})
+    if not df.empty:
+        df = df[df.astype(str).apply(lambda s: s.str.strip()).ne("").any(axis=1)]
+        df["_row"] = df.index + 2
+        df = df.reset_index(drop=True)
+    return stamp_frame(_finish_frame(sheet_name, df), sheet_name, "columns", tuple(cols))
+
+def sheet_columns(sheet_name, columns):
+    """نظير sheet_frame للقراءة المسقطة: يُقتطع من الإطار الدافئ إن وُجد بدل طلب جديد."""
+    df = warm_value(sheet_name, [sheet_name])
+    if df is not None:
+        keep = list(columns) + ["_row"] + [key_column(c) for c in columns]
+        return df[[c for c in keep if c in df.columns]]
+    with sheet_metrics.cached_lookup("st.cache", sheet_name + "[cols]"):
+        return frame_view(load_sheet_columns(sheet_name, tuple(columns), data_version(sheet_name)))
+
+def _finish_frame(sheet_name, df):
+    df = coerce_frame(df, SHEET_SCHEMAS.get(sheet_name, {}))
+    if sheet_name == "KPIs":
+        df = prepare_kpi_df(df)
+    return df
+
+def _col_letter(n):
+    return gspread.utils.rowcol_to_a1(1, n)[:-1]
+
+def _row_ranges(rows):
+    """يدمج أرقام الصفوف المتتالية في مقاطع (بداية، نهاية) لتقليل عدد النطاقات المطلوبة."""
+    runs = []
+    for r in sorted(set(rows)):
+        if runs and r == runs[-1][1] + 1:
+            runs[-1][1] = r
+        else:
+            runs.append([r, r])
+    return runs
+
+# فهرس المالك: أي صفوف من Activities تخص كل مبادرة، وأي صفوف من KPIs تخص كل مالك.
+OWNER_INDEX_KEYS = {"Activities": "Mabadara", "KPIs": "Owner"}
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_owner_index(acts_version, kpi_version):
+    """
+    يقرأ رؤوس الورقتين ثم عمود المفتاح فقط من كل منهما (طلبان مجمّعان بدل الورقتين كاملتين)
+    ويرجع {ورقة: {"header": [...], "rows": {مفتاح: [أرقام الصفوف]}}}.
+    """
+    sh     = get_sheet_connection()
+    names  = list(OWNER_INDEX_KEYS)
+    heads  = single_flight(("owner_index", "headers", acts_version, kpi_version),
+                           lambda: sh.values_batch_get(
+                               [gspread.utils.absolute_range_name(n, "1:1") for n in names]))
+    index, ranges = {}, []
+    for name, vr in zip(names, heads.get("valueRanges", [])):
+        header = (vr.get("values") or [[]])[0]
+        index[name] = {"header": header, "rows": {}}
+        if OWNER_INDEX_KEYS[name] in header:
+            col = _col_letter(header.index(OWNER_INDEX_KEYS[name]) + 1)
+            ranges.append((name, gspread.utils.absolute_range_name(name, col + "2:" + col)))
+    if ranges:
+        cols = single_flight(("owner_index", tuple(ranges), acts_version, kpi_version),
+                             lambda: sh.values_batch_get([r for _, r in ranges],
+                                                         params={"majorDimension": "COLUMNS"}))
+        for (name, _), vr in zip(ranges, cols.get("valueRanges", [])):
+            values = (vr.get("values") or [[]])[0]
+            rows   = index[name]["rows"]
+            for i, v in enumerate(values, start=2):
+                key = normalize_key(v)
+                if key:
+                    rows.setdefault(key, []).append(i)
+    return index
+
+@st.cache_resource(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_owner_scope(act_rows, kpi_rows, acts_version, kpi_version, scope):
+    """
+    يجلب صفوف المالك فقط من Activities و KPIs في طلب واحد مجمّع (نطاق لكل مقطع صفوف متتالية)
+    ويرجع (my_data, my_kpis) بنفس أنواع load_sheet_frame ومع العمود _row.
+    scope: إصدارات مفاتيح المالك — تكفي لإبطال النسخة عند تعديل صفوفه.
+    """
+    sheet_metrics.cache_miss()
+    index  = load_owner_index(acts_version, kpi_version)
+    wanted = {"Activities": act_rows, "KPIs": kpi_rows}
+    plan   = []
+    for name, rows in wanted.items():
+        last = _col_letter(max(len(index[name]["header"]), 1))
+        for a, b in _row_ranges(rows):
+            plan.append((name, a, b, gspread.utils.absolute_range_name(
+                name, "A" + str(a) + ":" + last + str(b))))
+    got = {name: ([], []) for name in wanted}
+    if plan:
+        resp = single_flight(("owner_scope", tuple(p[3] for p in plan), acts_version, kpi_version,
+                              scope),
+                             lambda: get_sheet_connection().values_batch_get([p[3] for p in plan]))
+        for (name, a, b, _), vr in zip(plan, resp.get("valueRanges", [])):
+            values = vr.get("values") or []
+            for i in range(b - a + 1):
+                got[name][0].append(values[i] if i < len(values) else [])
+                got[name][1].append(a + i)
+    frames = []
+    for name in wanted:
+        header     = index[name]["header"]
+        vals, nums = got[name]
+        records    = [(list(v) + [""] * len(header))[:len(header)] for v in vals]
+        df = pd.DataFrame(records, columns=header)
+        if not df.empty:
+            df["_row"] = nums
+        frames.append(stamp_frame(_finish_frame(name, df), name, "rows", wanted[name]))
+    return frames[0], frames[1]
+
+def owner_scope(my_list, owners):
+    """
+    (my_data, my_kpis) للمالك: اقتطاع من الإطارات الدافئة إن وُجدت، وإلا فهرس المالك المخزّن
+    يحدد صفوفه ثم تُجلب وحدها في طلب واحد (المالك يلمس نسبة صغيرة من الصفوف).
+    """
+    acts = warm_value("Activities", ["Activities"])
+    kpis = warm_value("KPIs", ["KPIs"])
+    if acts is not None and kpis is not None:
+        my_data = acts[key_mask(acts, "Mabadara", my_list)].reset_index(drop=True)
+        my_kpis = kpis[key_mask(kpis, "Owner", owners)].reset_index(drop=True)
+        # الاقتطاع يرث رمز الإطار الكامل؛ يُميَّز بالمالك كي لا تتشارك نتائج مالكين مختلفين
+        return (derive_token(my_data, "owner", tuple(my_list)),
+                derive_token(my_kpis, "owner", tuple(sorted(owners))))
+    scope = (scope_version("Activities", my_list), scope_version("KPIs", owners))
+    if data_service.enabled() or (replica.is_fresh("Activities") and replica.is_fresh("KPIs")):
+        with sheet_metrics.cached_lookup("st.cache", "owner_scope[local]"):
+            my_data, my_kpis = load_local_scope(tuple(my_list), tuple(sorted(owners)), scope)
+        if my_data is not None and my_kpis is not None:
+            return frame_view(my_data), frame_view(my_kpis)
+    # الفهرس يتبع إصدار البنية فقط (إضافة/حذف/إعادة تسمية)، وصفوف المالك تتبع إصدارات مفاتيحه
+    # — فتحديث مالك آخر لصفوفه لا يُسقط تخزين هذا المالك.
+    v_acts, v_kpi = structure_version("Activities"), structure_version("KPIs")
+    o_index  = load_owner_index(v_acts, v_kpi)
+    act_idx  = o_index["Activities"]["rows"]
+    kpi_idx  = o_index["KPIs"]["rows"]
+    act_rows = tuple(sorted({r for m in my_list for r in act_idx.get(normalize_key(m), [])}))
+    kpi_rows = tuple(sorted({r for o in owners for r in kpi_idx.get(normalize_key(o), [])}))
+    with sheet_metrics.cached_lookup("st.cache", "owner_scope"):
+        my_data, my_kpis = load_owner_scope(act_rows, kpi_rows, v_acts, v_kpi, scope)
+    return frame_view(my_data), frame_view(my_kpis)
+
+@st.cache_resource(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_local_scope(my_list, owners, scope):
+    """صفوف المالك من الخدمة أو النسخة المحلية باستعلام على فهرس المفتاح المطبّع (None إن تعذّر)."""
+    sheet_metrics.cache_miss()
+    acts = read_local("Activities", where=("Mabadara", my_list))
+    kpis = read_local("KPIs", where=("Owner", owners))
+    if acts is None or kpis is None:
+        return None, None
+    return (stamp_frame(_finish_frame("Activities", acts), "Activities", "local", my_list),
+            stamp_frame(_finish_frame("KPIs", kpis), "KPIs", "local", owners))
+
+def read_local(name, columns=None, where=None):
+    """قراءة دون طلب للورقة: خدمة البيانات المشتركة ثم النسخة المحلية، أو None."""
+    df = data_service.query(name, columns=columns, where=where)
+    return df if df is not None else replica.read(name, columns=columns, where=where)
+
+# التحديث في الخلفية: خيط واحد لكل مستأجر في العملية (data_store.start_refresher) يجلب الجداول والسجل
+# ويعيد حساب التحليلات المشتقة، فتقرأ إعادة التشغيل التفاعلية النتائج دون انتظار الشبكة.
+# كل دورة هي أيضاً مزامنة النسخة المحلية (replica) من الورقة.
+WARM_TABLES = ["Activities", "KPIs", "Operational_KPIs"]
+
+def _sync_users(sh):
+    """
+    Users تُجدِّد دليل المستخدمين (user_directory) والنسخة المحلية (دون كلمات المرور) ولا تدخل
+    المخزن الدافئ — فالدخول لا يقرأ الورقة.
+    """
+    started = time.time()
+    recs    = sh.worksheet("Users").get_all_records()
+    user_directory.refresh(recs)
+    replica.store("Users", pd.DataFrame(recs), ["username"], started)
+
+def _refresh_history(base):
+    """السجل الكامل لخيط التحديث: من الخدمة المشتركة إن كانت مشغّلة، وإلا من أوراق السنوات."""
+    df = local_history(base) if data_service.enabled() else None
+    return df if df is not None else load_history_range(base)
+
+def _warm_refresh():
+    """مهمة خيط الخلفية — كل ما ترجعه يُنشر دفعة واحدة في المخزن الدافئ."""
+    sh      = get_sheet_connection()
+    started = time.time()
+    jobs    = {name: (lambda n=name: _fetch_sheet_frame(sh, n, sync=True)) for name in WARM_TABLES}
+    for base in (KPI_HISTORY_SHEET, OPS_HISTORY_SHEET):
+        jobs[base] = lambda b=base: _refresh_history(b)
+    jobs["Users"] = lambda: _sync_users(sh)
+    out, errors = fetch_all(jobs)
+    out.pop("Users", None)
+    for base in (KPI_HISTORY_SHEET, OPS_HISTORY_SHEET):
+        if base in out:
+            replica.store(base, out[base], ["KPI_Name"], started)
+    for name, e in errors.items():
+        # ورقة غير موجودة بعد (مثل Operational_KPIs) تُترك للمسار المباشر؛ غير ذلك فشل حقيقي
+        if not isinstance(e, gspread.exceptions.WorksheetNotFound):
+            raise e
+    # التحليلات تعتمد على تاريخ اليوم — تُخزَّن معه
+    day  = date.today().isoformat()
+    acts = out.get("Activities")
+    kpis = out.get("KPIs")
+    if acts is not None:
+        out["health"] = (day, initiative_health_map(acts))
+        out["alerts"] = (day, (analyze_activities(acts),
+                               analyze_kpis_alerts(kpis) if kpis is not None else None))
+    if kpis is not None:
+        out["kpi_status"] = (day, kpi_status_counts(kpis))
+    return out
+
+def warm_derived(name, tables):
+    """تحليل محسوب في الخلفية إن كان لليوم الحالي ومطابقاً لإصدارات جداوله؛ وإلا None."""
+    v = warm_value(name, tables)
+    if v is None or v[0] != date.today().isoformat():
+        return None
+    return v[1]
 
 # ---------------------------------------------------------
 # 4. دوال مساعدة
@@ -364,10 +674,6 @@ def safe_float(val):
     except:
         return 0.0
 
-def clean_df_for_gspread(df):
-    df_clean = df.fillna("")
-    return df_clean.astype(object).where(pd.notnull(df_clean), "")
-
 def parse_date(date_str):
     try:
         return pd.to_datetime(date_str).date()
@@ -383,16 +689,27 @@ def append_timestamped_comment(original_text, new_comment):
         return str(original_text) + "\n----------------\n" + new_entry
     return new_entry
 
-def _last_update_date(comment_text):
-    if not comment_text or str(comment_text).strip() == "":
-        return None
-    dates = re.findall(r"(\d{4}-\d{2}-\d{2})", str(comment_text))
-    if not dates:
-        return None
-    try:
-        return datetime.strptime(dates[-1], "%Y-%m-%d").date()
-    except:
-        return None
+def timestamped_append(new_comment):
+    """نظير append_timestamped_comment للكتابة على الخلية: يُلحق بقيمتها الحالية وقت الكتابة."""
+    nn = str(new_comment or "").strip()
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M")
+    return Append(("📅 " + ts + ": " + nn) if nn else "", "\n----------------\n")
+
+def last_update_series(df):
+    """
+    وقت آخر تحديث من المالك لكل صف (datetime64، المجهول NaT): من عمود Last_Updated المحوّل
+    عند التحميل (_updated). الإطار المحمّل قبل إضافة العمود يُشتق من طوابع رسائل Owner_Comment.
+    """
+    if "_updated" in df.columns:
+        return df["_updated"]
+    if "Owner_Comment" not in df.columns:
+        return pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    return to_date_series(df["Owner_Comment"].map(last_comment_stamp))
+
+def days_since_update(df, today):
+    """عدد الأيام منذ آخر تحديث لكل صف (NaN إن لم يُعرف) — مقارنة عمود واحد بتاريخ اليوم."""
+    last = last_update_series(df)
+    return (pd.Timestamp(today) - last.dt.normalize()).dt.days
 
 def _parse_end_date(val):
     try:
@@ -400,6 +717,13 @@ def _parse_end_date(val):
     except:
         return None
 
+def _row_end_date(r):
+    """تاريخ النهاية لصف نشاط: من العمود _end المحسوب عند التحميل إن وُجد."""
+    v = r.get("_end")
+    if v is not None and not pd.isna(v):
+        return v.date()
+    return _parse_end_date(r.get("End_Date", ""))
+
 # ---------------------------------------------------------
 # 5. صحة المبادرة (Health Score)
 # ---------------------------------------------------------
@@ -411,27 +735,21 @@ def calc_initiative_health(df_acts_group):
                 "details": {"progress": 0, "timeliness": 0, "updates": 0}}
     total = len(rows)
 
-    avg_progress   = rows["Progress"].apply(safe_int).mean()
+    avg_progress   = to_int_series(rows["Progress"]).mean()
     score_progress = avg_progress
 
     on_time = 0
     for _, r in rows.iterrows():
         prog = safe_int(r.get("Progress", 0))
-        end  = _parse_end_date(r.get("End_Date", ""))
+        end  = _row_end_date(r)
         if prog >= 100:
             on_time += 1
         elif end and end >= today:
             on_time += 1
     score_timeliness = (on_time / total) * 100
 
-    updated_recently = 0
-    for _, r in rows.iterrows():
-        oc = str(r.get("Owner_Comment", "")).strip()
-        lu = _last_update_date(oc)
-        if lu and (today - lu).days <= 21:
-            updated_recently += 1
-        elif safe_int(r.get("Progress", 0)) >= 100:
-            updated_recently += 1
+    updated_recently = ((days_since_update(rows, today) <= 21) |
+                        (to_int_series(rows["Progress"]) >= 100)).sum()
     score_updates = (updated_recently / total) * 100
 
     final_score = round(score_progress * 0.40 +
@@ -476,17 +794,24 @@ def _render_health_card(init_name, h):
         unsafe_allow_html=True,
     )
 
-def show_health_dashboard(df_acts):
+def initiative_health_map(df_acts):
+    """صحة كل مبادرة: {المبادرة: نتيجة calc_initiative_health} بترتيب ظهورها."""
+    # تجميع واحد بدل قناع ونسخة لكل مبادرة؛ المجموعات للقراءة فقط
+    return {
+        init: calc_initiative_health(group)
+        for init, group in df_acts.groupby("Mabadara", sort=False, observed=True)
+    }
+
+def show_health_dashboard(df_acts, health=None):
+    """health: نتيجة initiative_health_map محسوبة مسبقاً (من خيط الخلفية) إن توفرت."""
     st.markdown("### 🏥 صحة المبادرات")
-    all_initiatives = df_acts["Mabadara"].unique().tolist()
-    if not all_initiatives:
+    if health is None:
+        health = versioned_result("initiative_health_map", df_acts, (date.today().isoformat(),),
+                                  lambda: initiative_health_map(df_acts))
+    if not health:
         st.info("لا توجد مبادرات.")
         return
-    health_data = []
-    for init in all_initiatives:
-        group  = df_acts[df_acts["Mabadara"] == init].copy()
-        result = calc_initiative_health(group)
-        health_data.append({"initiative": init, **result})
+    health_data = [{"initiative": init, **result} for init, result in health.items()]
     health_data.sort(key=lambda x: x["score"], reverse=True)
 
     green  = sum(1 for h in health_data if h["color_class"] == "health-green")
@@ -548,12 +873,16 @@ def show_health_dashboard(df_acts):
     st.plotly_chart(fig, use_container_width=True, key="health_bar_chart")
 
 def show_owner_health(df_acts, my_list):
-    my_df = df_acts[df_acts["Mabadara"].isin(my_list)].copy()
+    my_df = df_acts[key_mask(df_acts, "Mabadara", my_list)]
     if my_df.empty:
         return
+    warm = warm_derived("health", ["Activities"]) or {}
     for init in my_list:
-        group  = my_df[my_df["Mabadara"] == init].copy()
-        result = calc_initiative_health(group)
+        result = warm.get(init)
+        if result is None:
+            result = versioned_result(
+                "calc_initiative_health", df_acts, (init, date.today().isoformat()),
+                lambda: calc_initiative_health(lookup_rows(my_df, "Mabadara", init)))
         _render_health_card(init, result)
 
 # ---------------------------------------------------------
@@ -591,10 +920,6 @@ def _format_new_comment(text, role):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M")
     return "📅 " + ts + " [" + role + "]: " + text.strip()
 
-def _append_comment(original, new_entry):
-    original = str(original).strip()
-    return (original + "\n" + new_entry) if original else new_entry
-
 def _render_chat(messages):
     if not messages:
         st.markdown(
@@ -625,14 +950,156 @@ def _render_chat(messages):
     html += "</div>"
     st.markdown(html, unsafe_allow_html=True)
 
-def _save_chat_msg(ws, df, mask, col_name, new_entry):
-    if col_name not in df.columns:
-        df[col_name] = ""
-    old = str(df.loc[mask, col_name].values[0]).strip()
-    df.loc[mask, col_name] = _append_comment(old, new_entry)
+# ── أرشفة التعليقات: الرسائل الأقدم من COMMENT_ARCHIVE_DAYS تُنقل إلى ورقة أرشيف مفهرسة
+#    بالمحادثة (Thread) ويبقى في الخلية الحية ذيل حديث فقط؛ المحادثة والسجل يعرضان المؤرشف عند الطلب.
+COMMENT_ARCHIVE_SHEET = "Comment_Archive"
+COMMENT_ARCHIVE_COLS  = ["Thread", "Column", "Date", "Message", "Archived_At"]
+COMMENT_ARCHIVE_DAYS  = int(os.environ.get("NMCC_COMMENT_ARCHIVE_DAYS", "90"))
+COMMENT_TAIL_MIN      = 5   # أقل عدد رسائل يبقى في الخلية الحية مهما كان قِدمها
+COMMENT_COLS          = ["Owner_Comment", "Admin_Comment"]
+COMMENT_THREAD_KEYS   = {"Activities": ["Mabadara", "Activity"], "KPIs": ["KPI_Name"]}
+_ENTRY_START = re.compile(r"📅\s*(\d{4}-\d{2}-\d{2})")
+
+def comment_thread_id(sheet_name, row):
+    """مفتاح المحادثة في الأرشيف، مثل Activities|<المبادرة>|<النشاط>."""
+    return sheet_name + "|" + "|".join(
+        str(row.get(c, "")).strip() for c in COMMENT_THREAD_KEYS[sheet_name])
+
+def split_comment_for_archive(text, cutoff, keep_min=COMMENT_TAIL_MIN):
+    """
+    يقسم نص الخلية عند بداية كل رسالة (📅) ويرجع (المؤرشف [(تاريخ، نص)], الذيل الحي).
+    يؤرشف من أول الخلية فقط ما هو أقدم من cutoff مع إبقاء آخر keep_min رسائل؛ الذيل يبقى
+    بصيغته الأصلية كما هو. نص بلا تاريخ في أول الخلية يتبع الرسالة التي تليه.
+    """
+    text   = str(text or "")
+    starts = [(m.start(), m.group(1)) for m in _ENTRY_START.finditer(text)]
+    if len(starts) <= keep_min:
+        return [], text
+    n_old = 0
+    while n_old < len(starts) - keep_min:
+        try:
+            dt = datetime.strptime(starts[n_old][1], "%Y-%m-%d")
+        except ValueError:
+            break
+        if dt >= cutoff:
+            break
+        n_old += 1
+    if n_old == 0:
+        return [], text
+    archived = []
+    for i in range(n_old):
+        a   = 0 if i == 0 else starts[i][0]
+        seg = text[a:starts[i + 1][0]].replace("----------------", "").strip()
+        if seg:
+            archived.append((starts[i][1], seg))
+    return archived, text[starts[n_old][0]:]
+
+def _get_or_create_archive_ws(sh):
+    try:
+        return sh.worksheet(COMMENT_ARCHIVE_SHEET)
+    except gspread.exceptions.WorksheetNotFound:
+        ws = sh.add_worksheet(title=COMMENT_ARCHIVE_SHEET, rows=2000, cols=len(COMMENT_ARCHIVE_COLS))
+        ws.append_row(COMMENT_ARCHIVE_COLS)
+        return ws
+
+def rollover_comments(sh, max_age_days=COMMENT_ARCHIVE_DAYS, sheets=("Activities", "KPIs")):
+    """
+    مهمة الأرشفة: تنقل الرسائل القديمة من خلايا التعليقات إلى ورقة الأرشيف وتترك الذيل الحديث.
+    قبل الكتابة تُعاد قراءة الخلايا المعنية فقط، والخلية التي تغيّرت في الأثناء تُترك للجولة التالية.
+    يرجع عدد الرسائل المؤرشفة.
+    """
+    cutoff = datetime.now() - timedelta(days=int(max_age_days))
+    stamp  = datetime.now().strftime("%Y-%m-%d %H:%M")
+    ws_arc = None
+    total  = 0
+    for name in sheets:
+        ws   = sh.worksheet(name)
+        vals = ws.get_all_values()
+        if not vals:
+            continue
+        header = vals[0]
+        plan   = []   # (صف، عمود، النص الحالي، الذيل، صفوف الأرشيف)
+        for i, row in enumerate(vals[1:], start=2):
+            rec    = {h: (row[j] if j < len(row) else "") for j, h in enumerate(header)}
+            thread = comment_thread_id(name, rec)
+            for c in COMMENT_COLS:
+                if c not in header:
+                    continue
+                old, tail = split_comment_for_archive(rec[c], cutoff)
+                if old:
+                    plan.append((i, header.index(c) + 1, rec[c], tail,
+                                 [[thread, c, d, msg, stamp] for d, msg in old]))
+        if not plan:
+            continue
+        fresh = ws.batch_get([gspread.utils.rowcol_to_a1(p[0], p[1]) for p in plan])
+        plan  = [p for p, vr in zip(plan, fresh)
+                 if (vr[0][0] if vr and vr[0] else "") == p[2]]
+        if not plan:
+            continue
+        if ws_arc is None:
+            ws_arc = _get_or_create_archive_ws(sh)
+        # الأرشيف أولاً ثم تقليص الخلايا — فلا تضيع رسالة إن انقطع التنفيذ بين الخطوتين
+        ws_arc.append_rows([r for p in plan for r in p[4]], value_input_option="RAW")
+        ws.update_cells([gspread.Cell(p[0], p[1], p[3]) for p in plan])
+        bump_version(name)
+        total += sum(len(p[4]) for p in plan)
+    if total:
+        bump_version(COMMENT_ARCHIVE_SHEET)
+    return total
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_comment_archive(version):
+    """الأرشيف مفهرساً بالمحادثة: {Thread: [(العمود، نص الرسالة)]} — يُحمّل عند أول طلب فقط."""
+    try:
+        recs = single_flight(
+            ("get_all_records", COMMENT_ARCHIVE_SHEET, version),
+            lambda: get_sheet_connection().worksheet(COMMENT_ARCHIVE_SHEET).get_all_records())
+    except gspread.exceptions.WorksheetNotFound:
+        return {}
+    index = {}
+    for r in recs:
+        index.setdefault(str(r.get("Thread", "")).strip(), []).append(
+            (str(r.get("Column", "")).strip(), str(r.get("Message", ""))))
+    return index
+
+def archived_comment_text(thread, col_name):
+    """النص المؤرشف لعمود تعليق واحد من المحادثة (بترتيبه الأصلي)."""
+    rows = load_comment_archive(data_version(COMMENT_ARCHIVE_SHEET)).get(thread, [])
+    return "\n".join(msg for c, msg in rows if c == col_name)
+
+def _with_archived(messages, thread, key):
+    """يضيف الرسائل المؤرشفة للمحادثة إن طلبها المستخدم."""
+    if not st.checkbox("📦 عرض الرسائل المؤرشفة", key=key):
+        return messages
+    try:
+        old = _merge_and_sort(archived_comment_text(thread, "Owner_Comment"),
+                              archived_comment_text(thread, "Admin_Comment"))
+    except Exception as e:
+        st.warning("تعذّر تحميل الأرشيف: " + str(e))
+        return messages
+    return sorted(old + messages, key=lambda x: x["dt"])
+
+def _save_chat_msg(ws, df, mask, col_name, new_entry, key_cols):
+    """
+    يُلحق الرسالة بخلية التعليق لصف المحادثة وحده (بدل إعادة كتابة الورقة)؛ الإلحاق يتم على
+    القيمة الحالية في الورقة فلا تضيع رسالة متزامنة، ويُتحقق من مفاتيح الصف قبل الكتابة.
+    """
+    row     = df[mask].iloc[0]
+    updates = {col_name: Append(new_entry, "\n")}
+    if col_name == "Owner_Comment":
+        # رسالة المالك تحديث منه فتختم Last_Updated؛ رد المدير لا يغيّر حداثة الصف
+        updates = stamp_updated(updates)
     try:
-        df_c = clean_df_for_gspread(df)
-        ws.update(values=[df_c.columns.tolist()] + df_c.values.tolist(), range_name="A1")
+        ok = update_row_cells(
+            ws, int(row["_row"]), updates,
+            expect={c: row[c] for c in key_cols},
+        )
+        if not ok:
+            st.warning("تغيّر ترتيب الصفوف في الورقة — أعد المحاولة بعد التحديث.")
+            bump_version(ws.title)
+            return
+        # الرسالة تمس صف مالك واحد: يُبطَل تخزين ذلك المالك فقط
+        publish(ws.title, row.get(OWNER_INDEX_KEYS.get(ws.title, ""), None))
         st.success("✅ تم الإرسال!")
         time.sleep(0.8)
         st.rerun()
@@ -640,16 +1107,15 @@ def _save_chat_msg(ws, df, mask, col_name, new_entry):
         st.error("خطأ: " + str(e))
 
 def show_activity_chat(ws, df_acts, mabadara, activity, current_role, current_user):
-    mask = (
-        (df_acts["Mabadara"].astype(str).str.strip() == mabadara.strip()) &
-        (df_acts["Activity"].astype(str).str.strip()  == activity.strip())
-    )
+    mask = key_mask(df_acts, "Mabadara", mabadara) & key_mask(df_acts, "Activity", activity)
     if not mask.any():
         st.warning("لم يُعثر على النشاط.")
         return
     row      = df_acts[mask].iloc[0]
     messages = _merge_and_sort(str(row.get("Owner_Comment", "")),
                                 str(row.get("Admin_Comment", "")))
+    messages = _with_archived(messages, comment_thread_id("Activities", row),
+                              "chat_arc_" + mabadara[:12] + "_" + activity[:12])
     short_act = (activity[:55] + "…") if len(activity) > 55 else activity
     st.markdown("#### 💬 محادثة: " + short_act)
     st.caption("المبادرة: " + mabadara[:60])
@@ -677,19 +1143,22 @@ def show_activity_chat(ws, df_acts, mabadara, activity, current_role, current_us
             else:
                 col_name = "Admin_Comment" if current_role == "Admin" else "Owner_Comment"
                 _save_chat_msg(ws, df_acts, mask, col_name,
-                               _format_new_comment(new_msg, current_role))
+                               _format_new_comment(new_msg, current_role),
+                               ["Mabadara", "Activity"])
     with col_t:
         now_str = datetime.now().strftime("%H:%M")
         st.caption("الوقت: " + now_str)
 
 def show_kpi_chat(ws_kpi, df_kpi, kpi_name, current_role, current_user):
-    mask = df_kpi["KPI_Name"].astype(str).str.strip() == kpi_name.strip()
+    mask = key_mask(df_kpi, "KPI_Name", kpi_name)
     if not mask.any():
         st.warning("لم يُعثر على المؤشر.")
         return
     row      = df_kpi[mask].iloc[0]
     messages = _merge_and_sort(str(row.get("Owner_Comment", "")),
                                 str(row.get("Admin_Comment", "")))
+    messages = _with_archived(messages, comment_thread_id("KPIs", row),
+                              "kpi_chat_arc_" + kpi_name[:24])
     short_k  = (kpi_name[:55] + "…") if len(kpi_name) > 55 else kpi_name
     st.markdown("#### 💬 محادثة المؤشر: " + short_k)
     c1, c2, c3 = st.columns(3)
@@ -714,43 +1183,235 @@ def show_kpi_chat(ws_kpi, df_kpi, kpi_name, current_role, current_user):
         else:
             col_name = "Admin_Comment" if current_role == "Admin" else "Owner_Comment"
             _save_chat_msg(ws_kpi, df_kpi, mask, col_name,
-                           _format_new_comment(new_msg, current_role))
+                           _format_new_comment(new_msg, current_role),
+                           ["KPI_Name"])
 
 # ---------------------------------------------------------
 # 7. نظام التتبع التاريخي
 # ---------------------------------------------------------
-@st.cache_data(ttl=120, show_spinner=False)
-def load_kpi_history(_cache_key):
-    COLS  = ["KPI_Name", "Date", "Actual", "Target", "Recorded_By", "Note"]
-    empty = pd.DataFrame(columns=COLS)
+def history_partition_title(base, year):
+    """اسم ورقة التقسيم السنوي، مثل KPI_History_2026."""
+    return base + "_" + str(int(year))
+
+def recent_history_years(n=2):
+    """آخر n سنوات (تشمل الحالية) — تكفي لعروض الاتجاه عادةً."""
+    cur = date.today().year
+    return tuple(range(cur - n + 1, cur + 1))
+
+def _history_partitions(sh, base, years=None):
+    """
+    أوراق السجل التي يمسّها نطاق السنوات: الورقة القديمة غير المقسّمة (إن بقيت) أولاً
+    ثم أوراق السنوات تصاعدياً. years=None تعني كل السنوات.
+    """
+    legacy, parts = [], []
+    for ws in sh.worksheets():
+        title = ws.title
+        if title == base:
+            legacy.append(ws)
+            continue
+        suffix = title[len(base) + 1:] if title.startswith(base + "_") else ""
+        if suffix.isdigit() and (years is None or int(suffix) in years):
+            parts.append((int(suffix), ws))
+    return legacy + [ws for _, ws in sorted(parts, key=lambda x: x[0])]
+
+def _history_mirror_path(title):
+    return os.path.join(HISTORY_CACHE_DIR, tenants.sheet_id(), title)
+
+def _history_signature(ws):
+    """بصمة رخيصة لحداثة الورقة: عدد الصفوف ومحتوى آخر صف (عمود واحد + صف واحد بدل الورقة كاملة)."""
+    names = ws.col_values(1)
+    last  = ws.row_values(len(names)) if names else []
+    return {"rows": len(names), "last": [str(v) for v in last]}
+
+def _read_history_mirror(title, sig):
+    base = _history_mirror_path(title)
+    try:
+        with open(base + ".json", encoding="utf-8") as f:
+            if json.load(f) != sig:
+                return None
+        # إعادة التحويل رخيصة على أعمدة محوّلة، وتُحدّث أنواع مرآة كُتبت بمخطط أقدم
+        return _coerce_history(pd.read_parquet(base + ".parquet"))
+    except Exception:
+        return None
+
+def _write_history_mirror(title, sig, df):
+    base = _history_mirror_path(title)
     try:
-        sh = get_sheet_connection()
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        df.to_parquet(base + ".parquet.tmp", index=False)
+        os.replace(base + ".parquet.tmp", base + ".parquet")
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(sig, f, ensure_ascii=False)
+        os.replace(base + ".json.tmp", base + ".json")
+    except Exception:
+        pass  # المرآة تسريع اختياري (تتطلب pyarrow) — الفشل لا يوقف التحميل
+
+def drop_history_mirror(title):
+    """يُستدعى بعد كل كتابة على ورقة سجل (التعديل داخل الصف لا يغيّر البصمة دائماً)."""
+    for ext in (".json", ".parquet"):
         try:
-            ws = sh.worksheet(KPI_HISTORY_SHEET)
-        except gspread.exceptions.WorksheetNotFound:
-            ws = sh.add_worksheet(title=KPI_HISTORY_SHEET, rows=2000, cols=6)
-            ws.append_row(COLS)
-            return empty
-        records = ws.get_all_records()
-        if not records:
-            return empty
-        df = pd.DataFrame(records)
-        df["Date"]   = pd.to_datetime(df["Date"], errors="coerce")
-        df["Actual"] = df["Actual"].apply(safe_float)
-        df["Target"] = df["Target"].apply(safe_float)
-        return df.dropna(subset=["Date"])
+            os.remove(_history_mirror_path(title) + ext)
+        except OSError:
+            pass
+
+def _on_history_publish(table, key):
+    # الإبطال قد يصل من عملية أخرى عبر الناقل — مرآة الورقة المكتوبة تُحذف هنا أيضاً
+    if table in (KPI_HISTORY_SHEET, OPS_HISTORY_SHEET) and key:
+        drop_history_mirror(key)
+
+subscribe("history_mirror", _on_history_publish)
+
+def _on_replica_publish(table, key):
+    # كل كتابة (محلية أو من عملية أخرى) تعلّم نسخة الجدول متسخة. استثناء: ما ينشره خيط التحديث
+    # نفسه هو تعديل خارجي التقطه في الجلب الذي خزّنه للتو في النسخة
+    if not threading.current_thread().name.startswith("nmcc-refresher"):
+        replica.mark_dirty(table)
+
+subscribe("replica", _on_replica_publish)
+
+def _on_service_publish(table, key):
+    # الكتابات التي لا تمر عبر data_service.mutate (إلحاق صف، حذف، إعادة تسمية، لقطات السجل،
+    # الأرشفة والترحيل) تسقط إطار الخدمة قبل إعادة التحميل، وإلا قُرئ إطارها القديم بالإصدار الجديد.
+    # ما ينشره خيط التحديث قرأه من الخدمة نفسها فلا يُبلَّغ
+    if not threading.current_thread().name.startswith("nmcc-refresher"):
+        data_service.invalidate(table, key)
+
+subscribe("data_service", _on_service_publish)
+
+def _coerce_history(df):
+    df = coerce_frame(df, SHEET_SCHEMAS["History"])
+    # أعمدة النص المختلطة (أرقام ونصوص) تُوحَّد كنص ليطابق المقروء من المرآة المحمّل من الورقة
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].astype(str)
+    return df.dropna(subset=["Date"])
+
+def _read_history_ws(ws):
+    sig = _history_signature(ws)
+    df  = _read_history_mirror(ws.title, sig)
+    if df is not None:
+        return df
+    # التوقيع يؤدي دور الإصدار: قراءتان متزامنتان لنفس محتوى الورقة تُدمجان
+    df = pd.DataFrame(single_flight(("get_all_records", ws.title, sig["rows"], tuple(sig["last"])),
+                                    ws.get_all_records))
+    if df.empty:
+        return df
+    df = _coerce_history(df)
+    _write_history_mirror(ws.title, sig, df)
+    return df
+
+def load_history_range(base, years=None):
+    """
+    القارئ الموحّد للسجل التاريخي: يجلب أوراق السنوات المطلوبة فقط (بالتوازي إن تعددت)
+    ويدمجها في DataFrame واحد بالأنواع الصحيحة. يرفع الاستثناء للمستدعي.
+    """
+    empty = pd.DataFrame(columns=HISTORY_COLS)
+    parts = _history_partitions(get_sheet_connection(), base, years)
+    if not parts:
+        return empty
+    if len(parts) == 1:
+        frames = [_read_history_ws(parts[0])]
+    else:
+        got, errors = fetch_all({i: (lambda ws=ws: _read_history_ws(ws)) for i, ws in enumerate(parts)},
+                                HISTORY_FETCH_WORKERS)
+        if errors:
+            # كل الأوراق تُقرأ حتى النهاية، لكن سجل ناقص يفسد المتحقق التراكمي فيُرفع الخطأ
+            raise next(iter(errors.values()))
+        frames = [got[i] for i in range(len(parts))]
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return empty
+    # الدمج يُسقط الفئات حين تختلف بين الأوراق — تُستعاد على الإطار المدمج
+    df = as_category(pd.concat(frames, ignore_index=True), schema_categories(SHEET_SCHEMAS["History"]))
+    if years is not None:
+        # الورقة القديمة قد تحوي سنوات خارج النطاق
+        df = df[df["Date"].dt.year.isin(list(years))]
+    return stamp_frame(df.reset_index(drop=True), base, years)
+
+def load_kpi_history(_cache_key, years=None):
+    """years=None لكل السنوات (مطلوب للمتحقق التراكمي)، أو tuple سنوات لعروض الاتجاه."""
+    warm = _warm_history(KPI_HISTORY_SHEET, years)
+    if warm is not None:
+        return warm
+    with sheet_metrics.cached_lookup("st.cache", KPI_HISTORY_SHEET):
+        return frame_view(_load_kpi_history(_cache_key, years, history_version(KPI_HISTORY_SHEET, years)))
+
+@st.cache_resource(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def _load_kpi_history(_cache_key, years=None, version=0):
+    sheet_metrics.cache_miss()
+    try:
+        local = local_history(KPI_HISTORY_SHEET, years)
+        return local if local is not None else load_history_range(KPI_HISTORY_SHEET, years)
     except Exception as e:
         st.warning("تحذير: تعذّر تحميل السجل التاريخي — " + str(e))
-        return empty
+        return pd.DataFrame(columns=HISTORY_COLS)
+
+def local_history(base, years=None):
+    """السجل من الخدمة أو النسخة المحلية (تُزامَن كاملاً مع خيط التحديث) مقتطعاً لسنوات الطلب، أو None."""
+    df = read_local(base, columns=HISTORY_COLS)
+    if df is None:
+        return None
+    df = _coerce_history(df.drop(columns=["_row"], errors="ignore"))
+    if years is not None:
+        df = df[df["Date"].dt.year.isin(list(years))]
+    return stamp_frame(df.reset_index(drop=True), base, years)
+
+def _warm_history(base, years=None):
+    """السجل الكامل من المخزن الدافئ مقتطعاً لسنوات الطلب، أو None إن لم يكن صالحاً."""
+    df = warm_value(base, [base])
+    if df is None:
+        return None
+    if years is not None and not df.empty:
+        df = derive_token(df[df["Date"].dt.year.isin(list(years))], years)
+    return df.reset_index(drop=True)
 
-def _get_or_create_history_ws(sh):
+def history_version(base, years=None):
+    """إصدار السجل لطلب: كل السنوات → إصدار الجدول، وإلا إصدارات أوراق السنوات المطلوبة فقط."""
+    if years is None:
+        return data_version(base)
+    return scope_version(base, [history_partition_title(base, y) for y in years])
+
+def invalidate_history(base, title=None):
+    """
+    بعد أي كتابة على السجل: نشر الإبطال لورقة السنة المكتوبة (title) أو للسجل كله (None) —
+    يُسقط النسخة الدافئة ومرآة الورقة ويصل الجلسات والعمليات الأخرى عبر الناقل.
+    """
+    publish(base, title)
+
+def _get_or_create_history_ws(sh, base=KPI_HISTORY_SHEET, year=None):
+    """ورقة سنة القيد (الحالية افتراضياً)؛ تُنشأ عند أول كتابة في السنة."""
+    title = history_partition_title(base, year or date.today().year)
     try:
-        return sh.worksheet(KPI_HISTORY_SHEET)
+        return sh.worksheet(title)
     except gspread.exceptions.WorksheetNotFound:
-        ws = sh.add_worksheet(title=KPI_HISTORY_SHEET, rows=2000, cols=6)
-        ws.append_row(["KPI_Name", "Date", "Actual", "Target", "Recorded_By", "Note"])
+        ws = sh.add_worksheet(title=title, rows=2000, cols=6)
+        ws.append_row(HISTORY_COLS)
         return ws
 
+def split_legacy_history(sh, base):
+    """
+    ترحيل لمرة واحدة: ينسخ صفوف الورقة القديمة غير المقسّمة إلى أوراق السنوات ثم يعيد تسميتها
+    إلى <base>_legacy فتخرج من القراءة. يرجع عدد الصفوف المنقولة.
+    """
+    try:
+        legacy = sh.worksheet(base)
+    except gspread.exceptions.WorksheetNotFound:
+        return 0
+    recs = legacy.get_all_records()
+    by_year = {}
+    for r in recs:
+        d = pd.to_datetime(str(r.get("Date", "")), errors="coerce")
+        if pd.isna(d):
+            continue
+        by_year.setdefault(d.year, []).append([r.get(c, "") for c in HISTORY_COLS])
+    for year, rows in sorted(by_year.items()):
+        ws = _get_or_create_history_ws(sh, base, year)
+        ws.append_rows(rows, value_input_option="USER_ENTERED")
+        drop_history_mirror(ws.title)
+    drop_history_mirror(base)
+    legacy.update_title(base + "_legacy")
+    return sum(len(v) for v in by_year.values())
+
 def save_kpi_snapshot(kpi_name, actual, target, recorded_by, note=""):
     today_str = date.today().isoformat()
     try:
@@ -758,14 +1419,14 @@ def save_kpi_snapshot(kpi_name, actual, target, recorded_by, note=""):
         ws   = _get_or_create_history_ws(sh)
         recs = ws.get_all_records()
         for i, r in enumerate(recs):
-            if (str(r.get("KPI_Name", "")).strip() == kpi_name.strip()
+            if (normalize_key(r.get("KPI_Name", "")) == normalize_key(kpi_name)
                     and str(r.get("Date", "")).strip() == today_str):
                 row_ref = "A" + str(i + 2) + ":F" + str(i + 2)
                 ws.update(row_ref, [[kpi_name, today_str, actual, target, recorded_by, note]])
-                load_kpi_history.clear()
+                invalidate_history(KPI_HISTORY_SHEET, ws.title)
                 return True
         ws.append_row([kpi_name, today_str, actual, target, recorded_by, note])
-        load_kpi_history.clear()
+        invalidate_history(KPI_HISTORY_SHEET, ws.title)
         return True
     except Exception as e:
         st.error("خطأ في حفظ السجل التاريخي: " + str(e))
@@ -778,7 +1439,7 @@ def save_all_kpis_snapshot(df_kpi, recorded_by):
         ws        = _get_or_create_history_ws(sh)
         existing  = ws.get_all_records()
         exist_map = {
-            (str(r["KPI_Name"]).strip(), str(r["Date"]).strip()): i + 2
+            (normalize_key(r["KPI_Name"]), str(r["Date"]).strip()): i + 2
             for i, r in enumerate(existing)
         }
         new_rows   = []
@@ -787,7 +1448,7 @@ def save_all_kpis_snapshot(df_kpi, recorded_by):
             kpi    = str(row.get("KPI_Name", "")).strip()
             actual = safe_float(row.get("Actual", 0))
             target = safe_float(row.get("Target", 0))
-            key    = (kpi, today_str)
+            key    = (normalize_key(kpi), today_str)
             if key in exist_map:
                 update_ops.append((exist_map[key],
                                    [kpi, today_str, actual, target, recorded_by, "لقطة شاملة"]))
@@ -798,12 +1459,27 @@ def save_all_kpis_snapshot(df_kpi, recorded_by):
             ws.update(ref, [data])
         if new_rows:
             ws.append_rows(new_rows, value_input_option="USER_ENTERED")
-        load_kpi_history.clear()
+        invalidate_history(KPI_HISTORY_SHEET, ws.title)
         return len(new_rows) + len(update_ops)
     except Exception as e:
         st.error("خطأ في اللقطة الشاملة: " + str(e))
         return 0
 
+def _trend_map(df_history):
+    d    = df_history.sort_values("Date", kind="stable")
+    keys = d[key_column("KPI_Name")] if key_column("KPI_Name") in d.columns else d["KPI_Name"].map(normalize_key)
+    return {k: (compute_trend(g["Actual"]), float(g["Actual"].iloc[-1]))
+            for k, g in d.groupby(keys, sort=False, observed=True)}
+
+def history_trends(df_history, cached_only=False):
+    """{المؤشر: (الاتجاه، آخر قيمة)} لكل مؤشرات السجل — يُحسب مرة لكل إصدار من السجل.
+    cached_only: لا يحسب الخريطة كاملة لإطار بلا رمز بيانات (حين يكفي اتجاه مؤشر واحد)."""
+    if df_history is None or df_history.empty:
+        return {}
+    if cached_only and "data_token" not in df_history.attrs:
+        return {}
+    return versioned_result("history_trends", df_history, (), lambda: _trend_map(df_history))
+
 def compute_trend(series):
     vals = series.dropna().tolist()
     if len(vals) < 2:
@@ -822,14 +1498,12 @@ def compute_trend(series):
                 "label": "مستقر ➖", "css": "trend-flat", "icon": "➖"}
 
 def plot_kpi_trend(df_history, kpi_name, direction="تصاعدي", unit="", ctx=""):
-    df = df_history[
-        df_history["KPI_Name"].astype(str).str.strip() == kpi_name.strip()
-    ].copy().sort_values("Date")
+    df = lookup_rows(df_history, "KPI_Name", kpi_name).sort_values("Date")
     if df.empty:
         st.info("لا توجد بيانات تاريخية بعد.")
         return
-    trend = compute_trend(df["Actual"])
-    if direction == "تنازلي":
+    trend = history_trends(df_history, True).get(normalize_key(kpi_name), (None,))[0] or compute_trend(df["Actual"])
+    if Direction.parse(direction) is Direction.DOWN:
         lc = "#27ae60" if trend["direction"] == "down" else (
              "#e74c3c" if trend["direction"] == "up" else "#3498db")
     else:
@@ -870,7 +1544,7 @@ def plot_kpi_trend(df_history, kpi_name, direction="تصاعدي", unit="", ctx=
     safe_key = (kpi_name + ctx).replace(" ", "_").replace("/", "_").replace("-", "_")[:80]
     st.plotly_chart(fig, use_container_width=True, key="trend_" + safe_key)
     with st.expander("📋 جدول البيانات التاريخية"):
-        show = df[["Date", "Actual", "Target", "Recorded_By", "Note"]].copy()
+        show = df[["Date", "Actual", "Target", "Recorded_By", "Note"]]
         show["Date"] = show["Date"].dt.strftime("%Y-%m-%d")
         show.columns = ["التاريخ", "الفعلي", "المستهدف", "سجّل بواسطة", "ملاحظة"]
         st.dataframe(show.sort_values("التاريخ", ascending=False),
@@ -886,23 +1560,20 @@ def show_history_overview(df_history, df_kpi):
         return
     cats = ["الكل"] + list(KPI_GROUPS.keys())
     sel  = st.selectbox("عرض مجموعة:", cats, key="ov_cat")
+    trends   = history_trends(df_history)
     recorded = df_history["KPI_Name"].astype(str).str.strip().unique().tolist()
     kpis = recorded if sel == "الكل" else [
-        k for k in KPI_GROUPS.get(sel, []) if k in recorded
+        k for k in KPI_GROUPS.get(sel, []) if normalize_key(k) in trends
     ]
     if not kpis:
         st.info("لا توجد بيانات تاريخية للمجموعة المختارة بعد.")
         return
+    catalog = kpi_catalog(df_kpi)
     cols = st.columns(2)
     for i, kpi in enumerate(kpis):
-        ki   = df_kpi[df_kpi["KPI_Name"].astype(str).str.strip() == kpi.strip()]
-        unit = ki["Unit"].values[0]      if not ki.empty and "Unit"      in ki.columns else ""
-        drx  = ki["Direction"].values[0] if not ki.empty and "Direction" in ki.columns else "تصاعدي"
-        kh   = df_history[
-            df_history["KPI_Name"].astype(str).str.strip() == kpi.strip()
-        ].sort_values("Date")
-        trend    = compute_trend(kh["Actual"])
-        last_val = str(round(float(kh["Actual"].iloc[-1]), 1))
+        meta = catalog.get(kpi)
+        trend, last = trends[normalize_key(kpi)]
+        last_val = str(round(last, 1))
         with cols[i % 2]:
             st.markdown(
                 "<div class='trend-card'>"
@@ -912,71 +1583,80 @@ def show_history_overview(df_history, df_kpi):
                 "</div>",
                 unsafe_allow_html=True,
             )
-            plot_kpi_trend(df_history, kpi, drx, unit, ctx="_ov")
+            plot_kpi_trend(df_history, kpi, meta.direction, meta.unit, ctx="_ov")
 
 
 # ---------------------------------------------------------
 # دوال التتبع التاريخي للمؤشرات التشغيلية
 # ---------------------------------------------------------
-OPS_HISTORY_SHEET = "Ops_KPI_History"
+def ops_pct_series(df_ops):
+    """نسبة الإنجاز لكل المؤشرات التشغيلية دفعة واحدة (المستهدف صفر → 0)."""
+    t = to_float_series(df_ops["المستهدف 2026"])
+    a = to_float_series(df_ops["المتحقق"])
+    return (a / t.where(t != 0) * 100).round(1).fillna(0.0)
 
-@st.cache_data(ttl=120, show_spinner=False)
-def load_ops_history(_key):
-    COLS = ["KPI_Name", "Date", "Actual", "Target", "Recorded_By", "Note"]
-    empty = pd.DataFrame(columns=COLS)
+def save_ops_actual(ws, row, actual, note):
+    """
+    كتابة المتحقق والملاحظة والنسبة لمؤشر تشغيلي في خلايا صفه فقط. الكتابة مشروطة برقم نسخة
+    الصف (تُدمج إن لم يلمس الطرف الآخر نفس الخلايا)، والمستهدف يجب أن يبقى كما حُمّل لأن
+    النسبة تُحسب منه. ترجع (نجح؟، النسبة الجديدة).
+    """
+    t_val = safe_float(row["المستهدف 2026"])
+    pct   = round((actual / t_val) * 100, 1) if t_val else 0
+    rejected = write_cell_diffs(ws, [RowEdit(
+        row["_row"],
+        {"المتحقق": actual, "ملاحظات": note, "النسبة": pct},
+        {c: row[c] for c in ("المؤشر", "المستهدف 2026")},
+        base=row,
+    )])
+    if rejected:
+        return False, pct
+    publish("Operational_KPIs", row["المؤشر"])
+    return True, pct
+
+def load_ops_history(_key, years=None):
+    warm = _warm_history(OPS_HISTORY_SHEET, years)
+    if warm is not None:
+        return warm
+    with sheet_metrics.cached_lookup("st.cache", OPS_HISTORY_SHEET):
+        return frame_view(_load_ops_history(_key, years, history_version(OPS_HISTORY_SHEET, years)))
+
+@st.cache_resource(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def _load_ops_history(_key, years=None, version=0):
+    sheet_metrics.cache_miss()
     try:
-        sh2 = get_sheet_connection()
-        try:
-            ws = sh2.worksheet(OPS_HISTORY_SHEET)
-        except gspread.exceptions.WorksheetNotFound:
-            ws = sh2.add_worksheet(title=OPS_HISTORY_SHEET, rows=2000, cols=6)
-            ws.append_row(COLS)
-            return empty
-        recs = ws.get_all_records()
-        if not recs:
-            return empty
-        df = pd.DataFrame(recs)
-        df["Date"]   = pd.to_datetime(df["Date"], errors="coerce")
-        df["Actual"] = df["Actual"].apply(safe_float)
-        df["Target"] = df["Target"].apply(safe_float)
-        return df.dropna(subset=["Date"])
+        local = local_history(OPS_HISTORY_SHEET, years)
+        return local if local is not None else load_history_range(OPS_HISTORY_SHEET, years)
     except Exception as e:
         st.warning("تحذير تاريخ تشغيلي: " + str(e))
-        return empty
+        return pd.DataFrame(columns=HISTORY_COLS)
 
 def save_ops_snapshot(kpi_name, actual, target, recorded_by, note=""):
     today_str = date.today().isoformat()
     try:
-        sh2 = get_sheet_connection()
-        try:
-            ws = sh2.worksheet(OPS_HISTORY_SHEET)
-        except gspread.exceptions.WorksheetNotFound:
-            ws = sh2.add_worksheet(title=OPS_HISTORY_SHEET, rows=2000, cols=6)
-            ws.append_row(["KPI_Name","Date","Actual","Target","Recorded_By","Note"])
+        ws   = _get_or_create_history_ws(get_sheet_connection(), OPS_HISTORY_SHEET)
         recs = ws.get_all_records()
         for i, r in enumerate(recs):
-            if (str(r.get("KPI_Name","")).strip() == kpi_name.strip()
+            if (normalize_key(r.get("KPI_Name","")) == normalize_key(kpi_name)
                     and str(r.get("Date","")).strip() == today_str):
                 ws.update("A" + str(i+2) + ":F" + str(i+2),
                           [[kpi_name, today_str, actual, target, recorded_by, note]])
-                load_ops_history.clear()
+                invalidate_history(OPS_HISTORY_SHEET, ws.title)
                 return True
         ws.append_row([kpi_name, today_str, actual, target, recorded_by, note])
-        load_ops_history.clear()
+        invalidate_history(OPS_HISTORY_SHEET, ws.title)
         return True
     except Exception as e:
         st.error("خطأ في حفظ التاريخ التشغيلي: " + str(e))
         return False
 
 def plot_ops_trend(df_hist, kpi_name, direction="تصاعدي", ctx=""):
-    df = df_hist[
-        df_hist["KPI_Name"].astype(str).str.strip() == kpi_name.strip()
-    ].copy().sort_values("Date")
+    df = lookup_rows(df_hist, "KPI_Name", kpi_name).sort_values("Date")
     if df.empty:
         st.info("لا توجد بيانات تاريخية بعد لهذا المؤشر.")
         return
-    trend = compute_trend(df["Actual"])
-    if direction == "تنازلي":
+    trend = history_trends(df_hist, True).get(normalize_key(kpi_name), (None,))[0] or compute_trend(df["Actual"])
+    if Direction.parse(direction) is Direction.DOWN:
         lc = "#27ae60" if trend["direction"] == "down" else (
              "#e74c3c" if trend["direction"] == "up" else "#3498db")
     else:
@@ -1017,7 +1697,7 @@ def plot_ops_trend(df_hist, kpi_name, direction="تصاعدي", ctx=""):
     safe_key = (kpi_name + ctx).replace(" ","_").replace("/","_").replace("-","_")[:80]
     st.plotly_chart(fig, use_container_width=True, key="ops_trend_" + safe_key)
     with st.expander("📋 جدول البيانات التاريخية"):
-        show = df[["Date","Actual","Target","Recorded_By","Note"]].copy()
+        show = df[["Date","Actual","Target","Recorded_By","Note"]]
         show["Date"] = show["Date"].dt.strftime("%Y-%m-%d")
         show.columns = ["التاريخ","الفعلي","المستهدف","سجّل بواسطة","ملاحظة"]
         st.dataframe(show.sort_values("التاريخ", ascending=False),
@@ -1029,13 +1709,15 @@ def plot_ops_trend(df_hist, kpi_name, direction="تصاعدي", ctx=""):
 def analyze_activities(df):
     today  = date.today()
     result = {"overdue": [], "at_risk": [], "stale": [], "no_comment": []}
-    for _, row in df.iterrows():
+    last   = last_update_series(df)
+    ages   = days_since_update(df, today)
+    for i, (_, row) in enumerate(df.iterrows()):
         mab  = str(row.get("Mabadara", "")).strip()
         act  = str(row.get("Activity",  "")).strip()
         smab = (mab[:30] + "…") if len(mab) > 30 else mab
         sact = (act[:45] + "…") if len(act) > 45 else act
         prog = safe_int(row.get("Progress", 0))
-        end  = _parse_end_date(row.get("End_Date", ""))
+        end  = _row_end_date(row)
         oc   = str(row.get("Owner_Comment", "")).strip()
         dl   = (end - today).days if end else None
         do_  = (today - end).days  if end else None
@@ -1044,10 +1726,9 @@ def analyze_activities(df):
             result["overdue"].append({**base, "تاريخ الانتهاء": str(end), "أيام التأخير": do_})
         elif end and dl is not None and 0 <= dl <= 14 and prog < 80:
             result["at_risk"].append({**base, "تاريخ الانتهاء": str(end), "أيام متبقية": dl})
-        lu = _last_update_date(oc)
-        if lu and (today - lu).days > 21:
-            result["stale"].append({**base, "آخر تحديث": str(lu),
-                                    "أيام منذ التحديث": (today - lu).days})
+        if ages.iat[i] > 21:
+            result["stale"].append({**base, "آخر تحديث": last.iat[i].strftime("%Y-%m-%d"),
+                                    "أيام منذ التحديث": int(ages.iat[i])})
         if not oc and prog < 100:
             result["no_comment"].append({**base})
     return result
@@ -1055,15 +1736,16 @@ def analyze_activities(df):
 def analyze_kpis_alerts(df_kpi):
     alerts = []
     today  = date.today()
-    for _, row in df_kpi.iterrows():
+    dirs   = kpi_catalog(df_kpi).columns["direction"]
+    ages   = days_since_update(df_kpi, today)
+    for i, (_, row) in enumerate(df_kpi.iterrows()):
         kpi  = str(row.get("KPI_Name", "")).strip()
         own  = str(row.get("Owner", "")).strip()
         tgt  = safe_float(row.get("Target", 0))
         act  = safe_float(row.get("Actual", 0))
         cmt  = str(row.get("Owner_Comment", "")).strip()
-        drx  = str(row.get("Direction", "تصاعدي")).strip()
         reas = []
-        if drx == "تصاعدي":
+        if dirs[i] is Direction.UP:
             if tgt > 0 and act == 0:
                 reas.append("المتحقق = 0")
             elif tgt > 0 and (act / tgt) < 0.5:
@@ -1071,9 +1753,8 @@ def analyze_kpis_alerts(df_kpi):
         else:
             if act > tgt * 1.5 and tgt > 0:
                 reas.append("تجاوز الحد الأعلى")
-        lu = _last_update_date(cmt)
-        if lu and (today - lu).days > 30:
-            reas.append("لم يُحدَّث منذ " + str((today - lu).days) + " يوماً")
+        if ages.iat[i] > 30:
+            reas.append("لم يُحدَّث منذ " + str(int(ages.iat[i])) + " يوماً")
         elif not cmt:
             reas.append("لا يوجد تعليق")
         if reas:
@@ -1082,10 +1763,23 @@ def analyze_kpis_alerts(df_kpi):
                            "المستهدف": tgt, "المتحقق": act, "السبب": " | ".join(reas)})
     return alerts
 
-def show_alerts_panel(df_acts, df_kpi=None):
-    alerts     = analyze_activities(df_acts)
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_admin_alerts(acts_version, kpi_version, day):
+    """
+    نتائج مركز التنبيهات مخزّنة حسب إصدارَي البيانات واليوم (الحسابات تعتمد على تاريخ اليوم)،
+    فلا يُعاد تحليل الأنشطة عند كل إعادة تشغيل. kpi_alerts = None إن تعذّر تحميل المؤشرات.
+    """
+    alerts = analyze_activities(load_sheet_frame("Activities", acts_version))
+    try:
+        kpi_alerts = analyze_kpis_alerts(load_sheet_frame("KPIs", kpi_version))
+    except Exception:
+        kpi_alerts = None
+    return alerts, kpi_alerts
+
+def show_alerts_panel(alerts, kpi_alerts=None):
     total_acts = sum(len(v) for v in alerts.values())
-    kpi_alerts = analyze_kpis_alerts(df_kpi) if df_kpi is not None else []
+    has_kpi    = kpi_alerts is not None
+    kpi_alerts = kpi_alerts or []
     st.markdown("## 🔔 مركز التنبيهات")
     if total_acts == 0 and not kpi_alerts:
         st.markdown(
@@ -1148,7 +1842,7 @@ def show_alerts_panel(df_acts, df_kpi=None):
             st.dataframe(pd.DataFrame(alerts["no_comment"]), hide_index=True, use_container_width=True)
         else:
             st.markdown("<div class='all-good'>✅ جميع الأنشطة لديها تعليقات</div>", unsafe_allow_html=True)
-    if df_kpi is not None:
+    if has_kpi:
         kpi_n = len(kpi_alerts)
         with st.expander("📊 تنبيهات مؤشرات الأداء (" + str(kpi_n) + ")"):
             if kpi_alerts:
@@ -1157,11 +1851,155 @@ def show_alerts_panel(df_acts, df_kpi=None):
                 st.markdown("<div class='all-good'>✅ جميع المؤشرات ضمن النطاق</div>", unsafe_allow_html=True)
     st.markdown("---")
 
+def show_admin_overview():
+    """
+    مركز التنبيهات وملخّص المؤشرات كمكوّن قابل للطي: لا يُحمَّل ولا يُحسب شيء ما لم يفتحه
+    المدير، وعند فتحه تُستخدم النتائج المخزّنة لإصدار البيانات الحالي.
+    """
+    if not st.toggle("🔔 مركز التنبيهات وملخّص المؤشرات", key="admin_overview_on"):
+        return
+    try:
+        res = warm_derived("alerts", ["Activities", "KPIs"]) or load_admin_alerts(
+            data_version("Activities"), data_version("KPIs"), date.today().isoformat())
+    except Exception as e:
+        st.error("خطأ في تحميل التنبيهات: " + str(e))
+        return
+    show_alerts_panel(*res)
+    try:
+        df_sc = sheet_columns("KPIs", KPI_VIEW_COLS)
+    except Exception:
+        df_sc = None
+    if df_sc is not None and not df_sc.empty:
+        st.markdown("#### 📊 ملخّص المؤشرات")
+        show_kpi_scorecard(df_sc, counts=warm_derived("kpi_status", ["KPIs"]))
+
+def show_load_status():
+    """حالة التحميل للمدير: آخر تحديث في الخلفية وعدد الطلبات المدمجة لكل نوع قراءة."""
+    with st.expander("🛰️ حالة التحميل"):
+        rs = refresher_status()
+        if rs["at"]:
+            st.caption("آخر تحديث في الخلفية: " + datetime.fromtimestamp(rs["at"]).strftime("%H:%M:%S")
+                       + ("" if rs["alive"] else "  •  ⚠️ خيط التحديث متوقف"))
+        if rs["error"]:
+            st.caption("آخر خطأ في التحديث: " + rs["error"])
+        ud = user_directory.directory_stats()
+        if ud["age"] is not None:
+            st.caption("دليل المستخدمين: " + str(ud["users"]) + " مستخدم • منذ " + str(int(ud["age"]))
+                       + " ث • مقفل مؤقتاً: " + str(ud["locked"]))
+        ts, budgets = tenant_stats(), tenants.budget_stats()
+        if len(tenants.tenant_ids()) > 1 and ts:
+            now = time.time()
+            st.caption("المصنّفات في هذه العملية (الخامل يُخلى بعد " + str(TENANT_IDLE_SECONDS // 60)
+                       + " دقيقة أو عند تجاوز " + str(TENANT_MEMORY_MB) + " MB)")
+            st.dataframe(
+                pd.DataFrame([{"المصنّف": tenants.tenant_title(t),
+                               "الذاكرة (MB)": round(v["bytes"] / 2**20, 2),
+                               "آخر استخدام (ث)": int(now - v["seen"]) if v["seen"] else None,
+                               "نشط": "✅" if v["alive"] else "💤",
+                               "قراءات": budgets.get(t, {}).get("read", {}).get("calls", 0),
+                               "انتظار الحصة (ث)": budgets.get(t, {}).get("read", {}).get("waited", 0)}
+                              for t, v in sorted(ts.items())]),
+                hide_index=True, use_container_width=True,
+            )
+        stats = single_flight_stats()
+        if stats:
+            st.dataframe(
+                pd.DataFrame([{"نوع القراءة": k, "الطلبات": v["calls"], "المدمجة": v["coalesced"]}
+                              for k, v in sorted(stats.items())]),
+                hide_index=True, use_container_width=True,
+            )
+        else:
+            st.caption("لا توجد قراءات بعد.")
+        rc = result_cache_stats()
+        st.caption("نتائج التحليلات المخزّنة: " + str(rc["entries"]) + " (" + str(rc["bytes"] // 1024)
+                   + " KB) • إصابة: " + str(rc["hits"]) + " • حساب: " + str(rc["misses"])
+                   + " • مُزال: " + str(rc["evicted"]))
+        mem = []
+        for name in WARM_TABLES + [KPI_HISTORY_SHEET, OPS_HISTORY_SHEET]:
+            df = warm_value(name, [name])
+            if df is not None:
+                # القياس العميق مكلف على السجل — يُحسب مرة لكل إصدار
+                m = versioned_result("frame_memory", df, (), lambda df=df: frame_memory(df))
+                mem.append({"الجدول": name, "الصفوف": m["rows"],
+                            "قبل (MB)": round(m["before"] / 2**20, 2),
+                            "بعد (MB)": round(m["after"] / 2**20, 2)})
+        if mem:
+            st.caption("ذاكرة الإطارات الدافئة: كنصوص كما تُقرأ من الورقة مقابل الأنواع المضغوطة")
+            st.dataframe(pd.DataFrame(mem), hide_index=True, use_container_width=True)
+        svc = data_service.stats()
+        if svc:
+            st.caption("خدمة البيانات (" + data_service.SERVICE_ADDR + ") • طلبات: " + str(svc["requests"])
+                       + " • قراءات الورقة: " + str(svc["sheet_reads"]) + " • كتابات: " + str(svc["writes"])
+                       + " • إبطالات: " + str(svc.get("invalidations", 0)))
+            st.dataframe(
+                pd.DataFrame([{"الجدول": n, "الصفوف": t["rows"], "منذ (ث)": int(t["age"]),
+                               "الإصدار": t["version"]} for n, t in sorted(svc["tables"].items())]),
+                hide_index=True, use_container_width=True,
+            )
+        elif data_service.enabled():
+            st.caption("⚠️ خدمة البيانات (" + data_service.SERVICE_ADDR + ") غير متاحة — القراءة من الورقة مباشرة")
+        rep = replica.status()
+        if rep:
+            rs2 = replica.stats()
+            st.caption("النسخة المحلية (" + replica.replica_path() + ") • قراءات: " + str(rs2["reads"])
+                       + " • من الورقة: " + str(rs2["misses"]) + " • مزامنات: " + str(rs2["stores"])
+                       + " • أخطاء: " + str(rs2["errors"]))
+            st.dataframe(
+                pd.DataFrame([{"الجدول": r["name"], "الصفوف": r["rows"],
+                               "منذ (ث)": int(r["age"]), "صالحة": "✅" if r["fresh"] else "⏳"}
+                              for r in rep]),
+                hide_index=True, use_container_width=True,
+            )
+
+def _calls_table(events):
+    rows = sheet_metrics.summarize_calls(events)
+    return pd.DataFrame([{"المستدعي": r["caller"], "دالة gspread": r["method"], "العملية": r["api"],
+                          "الورقة": r["sheet"], "الطلبات": r["calls"], "KB": round(r["bytes"] / 1024, 1),
+                          "الزمن (ms)": int(r["ms"]), "الأبطأ (ms)": int(r["max_ms"]),
+                          "انتظار الحصة (ms)": int(r["wait_ms"]), "أخطاء": r["errors"]} for r in rows])
+
+def _calls_line(events):
+    calls = [e for e in events if e["kind"] == "call"]
+    cache = [e for e in events if e["kind"] == "cache"]
+    return (str(len(calls)) + " طلب • " + str(round(sum(e["bytes"] for e in calls) / 1024, 1)) + " KB • "
+            + str(int(sum(e["ms"] for e in calls))) + " ms • إصابات المخازن: "
+            + str(sum(1 for e in cache if e["hit"])) + "/" + str(len(cache)))
+
+def show_sheet_metrics():
+    """
+    لوحة تشخيص طلبات Sheets للمدير: طلبات إعادة التشغيل الحالية (تُعرض آخر الصفحة فتشمل كل
+    ما سبقها) وإصابات المخازن فيها، ثم المجاميع المتدحرجة للمصنّف الحالي.
+    """
+    with st.expander("🧪 طلبات Google Sheets"):
+        events = sheet_metrics.scope_events()
+        st.markdown("**إعادة التشغيل الحالية:** " + _calls_line(events))
+        if any(e["kind"] == "call" for e in events):
+            st.dataframe(_calls_table(events), hide_index=True, use_container_width=True)
+        cache = sheet_metrics.summarize_cache(events)
+        if cache:
+            st.dataframe(pd.DataFrame([{"الطبقة": r["layer"], "الاسم": r["name"], "إصابة": r["hits"],
+                                        "فقد": r["misses"]} for r in cache]),
+                         hide_index=True, use_container_width=True)
+        st.markdown("---")
+        window = st.radio("المدة:", [5, 60], format_func=lambda m: "آخر " + str(m) + " دقيقة",
+                          horizontal=True, key="metrics_window")
+        rolling = sheet_metrics.rolling_events(window * 60)
+        st.markdown("**كل الجلسات والخلفية:** " + _calls_line(rolling))
+        if any(e["kind"] == "call" for e in rolling):
+            st.dataframe(_calls_table(rolling), hide_index=True, use_container_width=True)
+        tot = sheet_metrics.totals()
+        call = tot.get("call", {"calls": 0, "bytes": 0, "ms": 0.0})
+        st.caption("منذ " + datetime.fromtimestamp(tot["since"]).strftime("%Y-%m-%d %H:%M") + ": "
+                   + str(call["calls"]) + " طلب • " + str(round(call["bytes"] / 2**20, 1)) + " MB • "
+                   + str(int(call["ms"] / 1000)) + " ث")
+
 def show_owner_alerts(df_acts, my_list):
-    my_df  = df_acts[df_acts["Mabadara"].isin(my_list)].copy()
+    my_df  = df_acts[key_mask(df_acts, "Mabadara", my_list)]
     if my_df.empty:
         return
-    alerts = analyze_activities(my_df)
+    alerts = versioned_result("analyze_activities", df_acts,
+                              (tuple(my_list), date.today().isoformat()),
+                              lambda: analyze_activities(my_df))
     if alerts["overdue"]:
         n = len(alerts["overdue"])
         st.markdown(
@@ -1183,26 +2021,44 @@ def show_owner_alerts(df_acts, my_list):
 if "logged_in" not in st.session_state:
     st.session_state["logged_in"] = False
     st.session_state["user_info"] = {}
+if "tenant" not in st.session_state:
+    # رابط مباشر لمصنّف: ?tenant=<المعرّف>
+    st.session_state["tenant"] = (st.query_params.get("tenant")
+                                  if st.query_params.get("tenant") in tenants.tenant_ids()
+                                  else tenants.DEFAULT_TENANT)
+# كل قراءة وكتابة في إعادة التشغيل هذه تخص مصنّف الجلسة
+tenants.set_tenant(st.session_state["tenant"])
+tenants.touch()
+sheet_metrics.begin_rerun()   # كل طلبات Sheets وإصابات المخازن في هذه الإعادة تُنسب لنطاقها
+
+def _pick_tenant():
+    st.session_state["tenant"] = st.session_state["login_tenant"]
 
 def login():
     c1, c2, c3 = st.columns([1, 2, 1])
     with c2:
         st.markdown("<h2 style='text-align:center;'>🔐 تسجيل الدخول</h2>", unsafe_allow_html=True)
         st.markdown("<br>", unsafe_allow_html=True)
+        ids = tenants.tenant_ids()
+        if len(ids) > 1:
+            # المستخدمون معرّفون في ورقة Users لكل مصنّف
+            st.selectbox("المصنّف", ids, index=ids.index(st.session_state["tenant"]),
+                         format_func=tenants.tenant_title, key="login_tenant", on_change=_pick_tenant)
         username = st.text_input("اسم المستخدم")
         password = st.text_input("كلمة المرور", type="password")
         if st.button("دخول", use_container_width=True):
             try:
-                sh       = get_sheet_connection()
-                users_df = pd.DataFrame(sh.worksheet("Users").get_all_records())
-                users_df["username"] = users_df["username"].astype(str).str.strip()
-                user = users_df[users_df["username"] == username.strip()]
-                if not user.empty and str(user.iloc[0]["password"]) == str(password):
+                # الدليل مخزّن ومُجدَّد في الخلفية؛ الورقة تُقرأ فقط إن لم يُحمَّل بعد أو قَدُم
+                ok, profile, msg = user_directory.authenticate(
+                    username, password,
+                    lambda: single_flight(("get_all_records", "Users", data_version("Users")),
+                                          lambda: get_sheet_connection().worksheet("Users").get_all_records()))
+                if ok:
                     st.session_state["logged_in"] = True
-                    st.session_state["user_info"] = user.iloc[0].to_dict()
+                    st.session_state["user_info"] = profile
                     st.rerun()
                 else:
-                    st.error("بيانات الدخول غير صحيحة")
+                    st.error(msg)
             except Exception as e:
                 st.error("خطأ اتصال: " + str(e))
 
@@ -1214,20 +2070,11 @@ def plot_group_barchart(df, group_title, ctx=""):
         st.info("لا توجد مؤشرات في: " + group_title)
         return
 
-    def get_color(row):
-        t = row["Target"]
-        a = row["Actual"]
-        d = str(row.get("Direction", "تصاعدي")).strip()
-        if d == "تنازلي":
-            return "#2ca02c" if a <= t else "#d62728"
-        return "#1f77b4" if a > t else ("#2ca02c" if a == t else "#d62728")
-
-    df = df.copy()
-    df["Color"] = df.apply(get_color, axis=1)
+    colors = kpi_bar_colors(df)
     fig = go.Figure()
     fig.add_trace(go.Bar(
         x=df["KPI_Name"], y=df["Actual"], name="الفعلي",
-        marker_color=df["Color"], text=df["Actual"], textposition="auto", width=0.6,
+        marker_color=colors, text=df["Actual"], textposition="auto", width=0.6,
     ))
     fig.add_trace(go.Scatter(
         x=df["KPI_Name"], y=df["Target"], mode="markers", name="المستهدف",
@@ -1244,63 +2091,71 @@ def plot_group_barchart(df, group_title, ctx=""):
     st.plotly_chart(fig, use_container_width=True, key="bar_" + sk)
 
 def display_kpi_layout(df_all, ctx=""):
-    df_all = df_all.copy()
-    df_all["Category"] = df_all["KPI_Name"].apply(get_kpi_category)
+    cats = kpi_catalog(df_all).columns["category"]
     c1, c2 = st.columns(2)
     with c1:
-        plot_group_barchart(df_all[df_all["Category"] == "QI4SD"],
-                            "مجموعة QI4SD", ctx)
+        plot_group_barchart(df_all[cats == "QI4SD"], "مجموعة QI4SD", ctx)
     with c2:
-        plot_group_barchart(df_all[df_all["Category"] == "البحث والتطوير"],
-                            "مجموعة البحث والتطوير", ctx)
+        plot_group_barchart(df_all[cats == "البحث والتطوير"], "مجموعة البحث والتطوير", ctx)
     st.markdown("---")
-    plot_group_barchart(df_all[df_all["Category"] == "الكفاءة التشغيلية"],
-                        "مجموعة الكفاءة التشغيلية", ctx)
+    plot_group_barchart(df_all[cats == "الكفاءة التشغيلية"], "مجموعة الكفاءة التشغيلية", ctx)
 
 # ---------------------------------------------------------
 # 11. واجهة المدير
 # ---------------------------------------------------------
+# أقسام واجهة المدير وما يحتاجه كل قسم من بيانات؛ كلها تُجلب بالتوازي قبل رسم القسم.
+# "…:recent" تعني آخر سنتين من السجل فقط. السجل والمؤشرات التشغيلية تُجلب لتسخين التخزين
+# فقط، والقسم يقرؤها بنفسه (مع معالجة أخطائه الخاصة).
+ADMIN_VIEW_DATA = {
+    "📋 تفاصيل المبادرات":   {"Activities"},
+    "📊 مؤشرات الأداء":       {"KPIs"},
+    "⚙️ المؤشرات التشغيلية": {"Operational_KPIs", OPS_HISTORY_SHEET + ":recent"},
+    "🏥 صحة المبادرات":       {"Activities"},
+    "📈 التتبع التاريخي":     {"KPIs", KPI_HISTORY_SHEET},
+    "📷 تسجيل لقطة شاملة":   {"KPIs", KPI_HISTORY_SHEET},
+    "📄 تصدير PDF":           {"Activities", "KPIs", KPI_HISTORY_SHEET + ":recent"},
+    "💬 المحادثات":           {"Activities", "KPIs"},
+}
+
+def _admin_fetch_jobs(sh, needs):
+    """القراءات المستقلة لقسم المدير {اسم: دالة} حسب ما يعلنه في ADMIN_VIEW_DATA."""
+    jobs = {}
+    for name in ("Activities", "KPIs", "Operational_KPIs"):
+        if name in needs:
+            jobs[name] = lambda n=name: sheet_frame(n)
+            if name != "Operational_KPIs":
+                jobs["ws_" + name] = lambda n=name: sh.worksheet(n)
+    if KPI_HISTORY_SHEET in needs:
+        jobs[KPI_HISTORY_SHEET] = lambda: load_kpi_history(tenants.sheet_id())
+    if KPI_HISTORY_SHEET + ":recent" in needs:
+        jobs[KPI_HISTORY_SHEET] = lambda: load_kpi_history(tenants.sheet_id(), recent_history_years())
+    if OPS_HISTORY_SHEET + ":recent" in needs:
+        jobs[OPS_HISTORY_SHEET] = lambda: load_ops_history(tenants.sheet_id() + "_ops", recent_history_years())
+    return jobs
+
 def admin_view(sh, user_name):
     st.markdown("### 📊 لوحة القيادة التنفيذية")
 
-    try:
-        ws_acts = sh.worksheet("Activities")
-        df_acts = pd.DataFrame(ws_acts.get_all_records())
-        df_acts["Progress"] = df_acts["Progress"].apply(safe_int)
-    except Exception as e:
+    show_admin_overview()
+    show_load_status()
+
+    view = st.selectbox("القسم:", list(ADMIN_VIEW_DATA), key="admin_view_select")
+    st.markdown("---")
+
+    # تحميل ما يعلنه القسم المختار فقط — بالتوازي، فالانتظار بقدر أبطأ قراءة
+    needs        = ADMIN_VIEW_DATA[view]
+    got, errors  = fetch_parallel(_admin_fetch_jobs(sh, needs))
+    ws_acts, df_acts = got.get("ws_Activities"), got.get("Activities")
+    ws_kpi,  df_kpi  = got.get("ws_KPIs"), got.get("KPIs")
+    if "Activities" in needs and (df_acts is None or ws_acts is None):
+        e = errors.get("Activities") or errors.get("ws_Activities")
         st.error("خطأ في تحميل الأنشطة: " + str(e))
         return
-
-    try:
-        ws_kpi = sh.worksheet("KPIs")
-        df_kpi = pd.DataFrame(ws_kpi.get_all_records())
-        df_kpi = prepare_kpi_df(df_kpi)
-    except Exception as e:
+    if "KPIs" in needs and (df_kpi is None or ws_kpi is None):
+        e = errors.get("KPIs") or errors.get("ws_KPIs")
         st.error("خطأ في تحميل المؤشرات: " + str(e))
         df_kpi = None
 
-    if not df_acts.empty:
-        today_dt = datetime.now().date()
-        df_acts["_end"] = pd.to_datetime(df_acts["End_Date"], errors="coerce").dt.date
-        delayed_n = len(df_acts[
-            (df_acts["Progress"] < 100) &
-            (df_acts["_end"].notna()) &
-            (df_acts["_end"] < today_dt)
-        ])
-
-    show_alerts_panel(df_acts, df_kpi)
-
-    if df_kpi is not None and not df_kpi.empty:
-        st.markdown("#### 📊 ملخّص المؤشرات")
-        show_kpi_scorecard(df_kpi)
-
-    view = st.selectbox(
-        "القسم:",
-        ["📋 تفاصيل المبادرات", "📊 مؤشرات الأداء", "⚙️ المؤشرات التشغيلية", "🏥 صحة المبادرات", "📈 التتبع التاريخي", "📷 تسجيل لقطة شاملة", "📄 تصدير PDF", "💬 المحادثات"],
-        key="admin_view_select",
-    )
-    st.markdown("---")
-
     if view == "📋 تفاصيل المبادرات":
         try:
             if "Admin_Comment" not in df_acts.columns:
@@ -1308,10 +2163,11 @@ def admin_view(sh, user_name):
             st.markdown("#### 🔎 مراجعة وتحديث المبادرات")
             st.caption("أضف ملاحظة في عمود 'ملاحظة إدارية جديدة' ثم اضغط حفظ.")
             init    = st.selectbox("اختر المبادرة:", df_acts["Mabadara"].unique())
-            df_filt = df_acts[df_acts["Mabadara"] == init].copy()
+            df_filt = df_acts[df_acts["Mabadara"] == init]
             df_filt["New_Admin_Note"] = ""
-            edited  = st.data_editor(
-                df_filt,
+            shown   = editor_frame("admin_acts_ed", df_filt, init)
+            st.data_editor(
+                shown,
                 column_config={
                     "Activity":       st.column_config.TextColumn("النشاط", width="large"),
                     "Progress":       st.column_config.ProgressColumn("الإنجاز %", format="%d%%", min_value=0, max_value=100),
@@ -1321,7 +2177,7 @@ def admin_view(sh, user_name):
                     "Admin_Comment":  st.column_config.TextColumn("سجل المدير", width="medium"),
                     "New_Admin_Note": st.column_config.TextColumn("✍️ ملاحظة إدارية جديدة", width="large"),
                     "Evidence_Link":  st.column_config.LinkColumn("رابط الدليل", display_text="📎 فتح"),
-                    "_end": None, "Mabadara": None,
+                    "Mabadara": None, **hidden_private_cols(shown),
                 },
                 disabled=["Activity", "Progress", "Owner_Comment", "Admin_Comment",
                           "Mabadara", "Start_Date", "End_Date"],
@@ -1330,27 +2186,23 @@ def admin_view(sh, user_name):
             )
             if st.button("💾 حفظ الملاحظات (أنشطة)"):
                 with st.spinner("جاري الحفظ..."):
-                    df_save = df_acts.drop(columns=["_end"], errors="ignore")
-                    changed = False
-                    for _, row in edited.iterrows():
-                        nn = str(row["New_Admin_Note"]).strip()
-                        if nn:
-                            changed = True
-                            mask = (
-                                (df_save["Mabadara"] == row["Mabadara"]) &
-                                (df_save["Activity"] == row["Activity"])
-                            )
-                            if mask.any():
-                                old_note = df_save.loc[mask, "Admin_Comment"].values[0]
-                                df_save.loc[mask, "Admin_Comment"] = \
-                                    append_timestamped_comment(old_note, nn)
-                    if changed:
-                        cdf = clean_df_for_gspread(df_save)
-                        ws_acts.update(
-                            values=[cdf.columns.tolist()] + cdf.values.tolist(),
-                            range_name="A1",
-                        )
-                        st.success("✅ تم الحفظ!")
+                    # الصفوف التي كُتبت فيها ملاحظة فقط — كل ملاحظة تُلحق بخلية صفها في الورقة
+                    notes = [(row, str(c.get("New_Admin_Note") or "").strip())
+                             for row, c in editor_changes("admin_acts_ed")]
+                    notes = [(row, nn) for row, nn in notes if nn]
+                    if notes:
+                        missed = len(write_cell_diffs(ws_acts, [
+                            (row["_row"],
+                             {"Admin_Comment": timestamped_append(nn)},
+                             {"Mabadara": row["Mabadara"], "Activity": row["Activity"]})
+                            for row, nn in notes
+                        ]))
+                        publish("Activities", init)
+                        reset_editor("admin_acts_ed")
+                        if missed:
+                            st.warning("تغيّر ترتيب " + str(missed) + " صف في الورقة — أعد إدخال ملاحظاتها.")
+                        else:
+                            st.success("✅ تم الحفظ!")
                         time.sleep(0.4)
                         st.rerun()
                     else:
@@ -1361,17 +2213,24 @@ def admin_view(sh, user_name):
             sel_act = st.selectbox("اختر النشاط:", df_filt["Activity"].unique(), key="hist_act")
             if sel_act:
                 r   = df_filt[df_filt["Activity"] == sel_act].iloc[0]
+                arc = st.checkbox("📦 تضمين التعليقات المؤرشفة", key="hist_act_arc")
                 c1, c2 = st.columns(2)
                 with c1:
                     st.markdown("<div class='history-title'>تعليقات الموظف:</div>",
                                 unsafe_allow_html=True)
                     oc_val = str(r.get("Owner_Comment", "لا يوجد"))
+                    if arc:
+                        oc_val = (archived_comment_text(comment_thread_id("Activities", r),
+                                                        "Owner_Comment") + "\n" + oc_val).strip()
                     st.markdown("<div class='history-box'>" + oc_val + "</div>",
                                 unsafe_allow_html=True)
                 with c2:
                     st.markdown("<div class='history-title'>سجل ملاحظات المدير:</div>",
                                 unsafe_allow_html=True)
                     ac_val = str(r.get("Admin_Comment", "لا يوجد"))
+                    if arc:
+                        ac_val = (archived_comment_text(comment_thread_id("Activities", r),
+                                                        "Admin_Comment") + "\n" + ac_val).strip()
                     st.markdown("<div class='history-box'>" + ac_val + "</div>",
                                 unsafe_allow_html=True)
         except Exception as e:
@@ -1387,10 +2246,11 @@ def admin_view(sh, user_name):
             st.caption("المدير يُدخل الهدف السنوي (Target) والهدف النهائي/التراكمي (Target_Cumulative). "
                        "المالك يُدخل المتحقق فقط من واجهته.")
             fc = st.selectbox("📂 فلترة:", ["الكل"] + list(KPI_GROUPS.keys()), key="kpi_filt")
-            df_kpi["Category"] = df_kpi["KPI_Name"].apply(get_kpi_category)
-            dfe = df_kpi[df_kpi["Category"] == fc].copy() if fc != "الكل" else df_kpi.copy()
+            df_kpi["Category"] = kpi_catalog(df_kpi).columns["category"]
+            dfe = df_kpi[df_kpi["Category"] == fc] if fc != "الكل" else frame_view(df_kpi)
             dfe["New_Admin_Note"] = ""
-            ek  = st.data_editor(
+            dfe = editor_frame("kpi_ed_adm", dfe, fc)
+            st.data_editor(
                 dfe, num_rows="fixed", use_container_width=True, key="kpi_ed_adm",
                 column_config={
                     "KPI_Name":       st.column_config.TextColumn("المؤشر", width="large"),
@@ -1402,35 +2262,38 @@ def admin_view(sh, user_name):
                     "Admin_Comment":  st.column_config.TextColumn("سجل المدير", width="medium"),
                     "New_Admin_Note": st.column_config.TextColumn("✍️ ملاحظة جديدة", width="large"),
                     "Category": None, "Unit": None, "Direction": None, "Frequency": None,
+                    **hidden_private_cols(dfe),
                 },
                 disabled=["KPI_Name", "Actual", "Owner", "Owner_Comment", "Admin_Comment", "Category"],
             )
             if st.button("💾 حفظ تحديثات المؤشرات"):
                 with st.spinner("جاري الحفظ..."):
-                    changed = False
-                    for _, row in ek.iterrows():
-                        mask = df_kpi["KPI_Name"] == row["KPI_Name"]
-                        if mask.any():
-                            if float(row["Target"]) != float(df_kpi.loc[mask, "Target"].values[0]):
-                                df_kpi.loc[mask, "Target"] = row["Target"]
-                                changed = True
-                            old_cum = float(df_kpi.loc[mask, KPI_CUM_COL].values[0])
-                            if float(safe_float(row.get(KPI_CUM_COL, 0))) != old_cum:
-                                df_kpi.loc[mask, KPI_CUM_COL] = safe_float(row.get(KPI_CUM_COL, 0))
-                                changed = True
-                            nn = str(row["New_Admin_Note"]).strip()
-                            if nn:
-                                old_note = df_kpi.loc[mask, "Admin_Comment"].values[0]
-                                df_kpi.loc[mask, "Admin_Comment"] = \
-                                    append_timestamped_comment(old_note, nn)
-                                changed = True
-                    if changed:
-                        cdf = clean_df_for_gspread(df_kpi)
-                        ws_kpi.update(
-                            values=[cdf.columns.tolist()] + cdf.values.tolist(),
-                            range_name="A1",
-                        )
-                        st.success("✅ تم الحفظ!")
+                    # مجموعة تغييرات المحرر فقط (الصف والعمود المعدّلان) → كتابة خلاياها وحدها
+                    writes = []
+                    for row, c in editor_changes("kpi_ed_adm"):
+                        updates = {}
+                        for col in ("Target", KPI_CUM_COL):
+                            if col in c and safe_float(c[col]) != safe_float(row.get(col, 0)):
+                                updates[col] = safe_float(c[col])
+                        nn = str(c.get("New_Admin_Note") or "").strip()
+                        if nn:
+                            updates["Admin_Comment"] = timestamped_append(nn)
+                        if updates:
+                            writes.append((row, updates))
+                    if writes:
+                        # مشروطة برقم نسخة الصف؛ تعديل متزامن على خلايا أخرى يُدمج ولا يُرفض
+                        missed = len(write_cell_diffs(ws_kpi, [
+                            RowEdit(row["_row"], u, {"KPI_Name": row["KPI_Name"]}, base=row)
+                            for row, u in writes
+                        ]))
+                        for row, _ in writes:
+                            publish("KPIs", str(row.get("Owner", "")).strip())
+                        reset_editor("kpi_ed_adm")
+                        if missed:
+                            st.warning(str(missed) + " مؤشر عدّل غيرك نفس خلاياه منذ التحميل — "
+                                       "راجع القيم الحالية وأعد إدخال تعديلاتها.")
+                        else:
+                            st.success("✅ تم الحفظ!")
                         time.sleep(0.4)
                         st.rerun()
                     else:
@@ -1440,17 +2303,24 @@ def admin_view(sh, user_name):
             sk = st.selectbox("اختر المؤشر:", df_kpi["KPI_Name"].unique(), key="hist_kpi")
             if sk:
                 rk = df_kpi[df_kpi["KPI_Name"] == sk].iloc[0]
+                arc_k = st.checkbox("📦 تضمين التعليقات المؤرشفة", key="hist_kpi_arc")
                 c1, c2 = st.columns(2)
                 with c1:
                     st.markdown("<div class='history-title'>سجل المالك:</div>",
                                 unsafe_allow_html=True)
                     oc_v = str(rk.get("Owner_Comment", "لا يوجد"))
+                    if arc_k:
+                        oc_v = (archived_comment_text(comment_thread_id("KPIs", rk),
+                                                      "Owner_Comment") + "\n" + oc_v).strip()
                     st.markdown("<div class='history-box'>" + oc_v + "</div>",
                                 unsafe_allow_html=True)
                 with c2:
                     st.markdown("<div class='history-title'>سجل المدير:</div>",
                                 unsafe_allow_html=True)
                     ac_v = str(rk.get("Admin_Comment", "لا يوجد"))
+                    if arc_k:
+                        ac_v = (archived_comment_text(comment_thread_id("KPIs", rk),
+                                                      "Admin_Comment") + "\n" + ac_v).strip()
                     st.markdown("<div class='history-box'>" + ac_v + "</div>",
                                 unsafe_allow_html=True)
 
@@ -1461,8 +2331,7 @@ def admin_view(sh, user_name):
 
         # ── تحميل البيانات ──
         try:
-            ws_ops = sh.worksheet("Operational_KPIs")
-            df_ops = pd.DataFrame(ws_ops.get_all_records())
+            df_ops = sheet_frame("Operational_KPIs")
         except Exception:
             # إنشاء الورقة بالبيانات الأولية إن لم تكن موجودة
             try:
@@ -1482,6 +2351,7 @@ def admin_view(sh, user_name):
                     [11, "عدد تقارير الكفاءة الفنية الصادرة",                "عدد",   "تصاعدي", 79,   18,   "", ""],
                 ]
                 ws_ops.update(values=[headers] + initial_data, range_name="A1")
+                bump_version("Operational_KPIs")
                 df_ops = pd.DataFrame(initial_data, columns=headers)
                 st.success("✅ تم إنشاء ورقة Operational_KPIs وتعبئتها بالبيانات الأولية.")
             except Exception as e2:
@@ -1518,19 +2388,10 @@ def admin_view(sh, user_name):
                     if not str(row_r.get("الاتجاه","")).strip():
                         df_ops.at[idx_r, "الاتجاه"]  = _default_noa[kpi_r][1]
 
-            df_ops["المستهدف 2026"] = df_ops["المستهدف 2026"].apply(safe_float)
-            df_ops["المتحقق"]       = df_ops["المتحقق"].apply(safe_float)
+            df_ops = coerce_frame(df_ops, SHEET_SCHEMAS["Operational_KPIs"])
 
             # ── حساب النسبة بناءً على الاتجاه ──
-            def calc_ops_pct(row):
-                t = safe_float(row["المستهدف 2026"])
-                a = safe_float(row["المتحقق"])
-                if t == 0:
-                    return 0.0
-                pct = round((a / t) * 100, 1)
-                return pct
-
-            df_ops["النسبة"] = df_ops.apply(calc_ops_pct, axis=1)
+            df_ops["النسبة"] = ops_pct_series(df_ops)
 
             # ── بطاقات الملخص ──
             def _is_good(row):
@@ -1557,13 +2418,13 @@ def admin_view(sh, user_name):
                 horizontal=True, key="ops_filter",
             )
             if filter_opt == "✅ مكتمل":
-                df_show = df_ops[df_ops["النسبة"] >= 100].copy()
+                df_show = df_ops[df_ops["النسبة"] >= 100]
             elif filter_opt == "🟡 جارٍ":
-                df_show = df_ops[(df_ops["النسبة"] >= 50) & (df_ops["النسبة"] < 100)].copy()
+                df_show = df_ops[(df_ops["النسبة"] >= 50) & (df_ops["النسبة"] < 100)]
             elif filter_opt == "🔴 متأخر":
-                df_show = df_ops[df_ops["النسبة"] < 50].copy()
+                df_show = df_ops[df_ops["النسبة"] < 50]
             else:
-                df_show = df_ops.copy()
+                df_show = frame_view(df_ops)
 
             # ── تنسيق الأرقام أولاً (قبل style) ──
             def fmt_num(v):
@@ -1573,7 +2434,6 @@ def admin_view(sh, user_name):
                 except:
                     return v
 
-            df_show = df_show.copy()
             df_show["المستهدف 2026"] = df_show["المستهدف 2026"].apply(fmt_num).astype(str)
             df_show["المتحقق"]       = df_show["المتحقق"].apply(fmt_num).astype(str)
 
@@ -1616,7 +2476,7 @@ def admin_view(sh, user_name):
 
             # ── مخطط شريطي ──
             st.markdown("#### 📊 مقارنة بصرية")
-            chart_df = df_show.copy()
+            chart_df = df_show
             names  = [str(int(r["رقم المؤشر"])) + ". " + str(r["المؤشر"])
                       for _, r in chart_df.iterrows()]
             pcts   = chart_df["النسبة"].tolist()
@@ -1653,7 +2513,7 @@ def admin_view(sh, user_name):
             # ── التتبع التاريخي ──
             st.markdown("---")
             st.markdown("#### 📈 التتبع التاريخي للمؤشر")
-            df_ops_hist = load_ops_history(SHEET_ID + "_ops")
+            df_ops_hist = load_ops_history(tenants.sheet_id() + "_ops", recent_history_years())
             if df_ops_hist.empty:
                 st.info("لا يوجد سجل تاريخي بعد — سيُحفظ تلقائياً عند كل تحديث.")
             else:
@@ -1664,7 +2524,7 @@ def admin_view(sh, user_name):
                     key="ops_hist_select",
                 )
                 if sel_hist_ops and sel_hist_ops != "— اختر —":
-                    row_dir = df_ops[df_ops["المؤشر"].astype(str).str.strip() == sel_hist_ops.strip()]
+                    row_dir = lookup_rows(df_ops, "المؤشر", sel_hist_ops)
                     drx_ops = str(row_dir["الاتجاه"].values[0]).strip() if not row_dir.empty else "تصاعدي"
                     plot_ops_trend(df_ops_hist, sel_hist_ops, drx_ops, ctx="_adm_ops")
                     with st.expander("➕ إضافة قيمة تاريخية يدوية"):
@@ -1714,36 +2574,27 @@ def admin_view(sh, user_name):
                     if st.button("💾 حفظ التحديث", use_container_width=True, key="ops_save"):
                         with st.spinner("جاري الحفظ..."):
                             try:
-                                ws_ops2 = sh.worksheet("Operational_KPIs")
-                                df_ops2 = pd.DataFrame(ws_ops2.get_all_records())
-                                mask_ops = df_ops2["المؤشر"] == sel_ops
-                                if mask_ops.any():
-                                    df_ops2.loc[mask_ops, "المتحقق"]  = new_actual
-                                    df_ops2.loc[mask_ops, "ملاحظات"]  = ops_note
-                                    t_val = safe_float(df_ops2.loc[mask_ops, "المستهدف 2026"].values[0])
-                                    pct_new = round((new_actual / t_val) * 100, 1) if t_val else 0
-                                    df_ops2.loc[mask_ops, "النسبة"] = pct_new
-                                    cdf_ops = clean_df_for_gspread(df_ops2)
-                                    ws_ops2.update(
-                                        values=[cdf_ops.columns.tolist()] + cdf_ops.values.tolist(),
-                                        range_name="A1",
-                                    )
+                                ok, pct_new = save_ops_actual(sh.worksheet("Operational_KPIs"),
+                                                              ops_row, new_actual, ops_note)
+                                if ok:
                                     st.success("✅ تم الحفظ! النسبة الجديدة: " + str(pct_new) + "%")
                                     time.sleep(0.4)
                                     st.rerun()
+                                else:
+                                    st.warning("عُدّل هذا المؤشر منذ التحميل — أعد تحميل الصفحة وراجع القيمة.")
                             except Exception as e:
                                 st.error("خطأ: " + str(e))
             else:
                 st.info("👁️ عرض للاطلاع فقط — تحديث البيانات متاح لمسؤول العمليات.")
 
     elif view == "🏥 صحة المبادرات":
-        show_health_dashboard(df_acts)
+        show_health_dashboard(df_acts, warm_derived("health", ["Activities"]))
 
     elif view == "📈 التتبع التاريخي":
         if df_kpi is None:
             st.error("تعذّر تحميل المؤشرات.")
         else:
-            df_history = load_kpi_history(SHEET_ID)
+            df_history = load_kpi_history(tenants.sheet_id())
             sub1, sub2 = st.tabs(["🗺️ نظرة عامة على الاتجاهات", "🔍 تحليل مؤشر بعينه"])
             with sub1:
                 show_history_overview(df_history, df_kpi)
@@ -1751,20 +2602,18 @@ def admin_view(sh, user_name):
                 st.markdown("### 🔍 تحليل مؤشر بعينه")
                 sel_kpi = st.selectbox("اختر المؤشر:", df_kpi["KPI_Name"].tolist(), key="single_kpi")
                 if sel_kpi:
-                    ki   = df_kpi[df_kpi["KPI_Name"].astype(str).str.strip() == sel_kpi.strip()]
-                    unit = ki["Unit"].values[0]      if not ki.empty and "Unit"      in ki.columns else ""
-                    drx  = ki["Direction"].values[0] if not ki.empty and "Direction" in ki.columns else "تصاعدي"
+                    ki   = lookup_rows(df_kpi, "KPI_Name", sel_kpi)
+                    meta = kpi_catalog(df_kpi).get(sel_kpi)
+                    unit = meta.unit
                     tgt  = ki["Target"].values[0]    if not ki.empty else 0.0
                     if not ki.empty:
                         krow = ki.iloc[0]
-                        st.caption(kpi_meta_caption(krow, df_history))
+                        st.caption(kpi_meta_caption(krow, df_history, meta))
                         cum_a = compute_cumulative_actual(sel_kpi, unit, krow.get("Actual", 0), df_history)
                         st.markdown("##### 🎯 الأهداف: السنوي مقابل النهائي")
-                        plot_dual_target_bars(krow, cum_a, ctx="_adm_dual")
+                        plot_dual_target_bars(krow, cum_a, ctx="_adm_dual", meta=meta)
                         st.markdown("---")
-                    kh   = df_history[
-                        df_history["KPI_Name"].astype(str).str.strip() == sel_kpi.strip()
-                    ].sort_values("Date")
+                    kh   = lookup_rows(df_history, "KPI_Name", sel_kpi).sort_values("Date")
                     if not kh.empty:
                         m1, m2, m3, m4 = st.columns(4)
                         m1.metric("عدد السجلات", len(kh))
@@ -1773,7 +2622,7 @@ def admin_view(sh, user_name):
                         m4.metric("أدنى قيمة",   str(round(float(kh["Actual"].min()), 1)))
                     else:
                         st.info("ℹ️ لا يوجد سجل تاريخي لهذا المؤشر بعد. سيظهر منحنى الاتجاه بعد أول إدخال للمتحقق.")
-                    plot_kpi_trend(df_history, sel_kpi, drx, unit, ctx="_adm3")
+                    plot_kpi_trend(df_history, sel_kpi, meta.direction, unit, ctx="_adm3")
                     st.markdown("---")
                     st.markdown("##### ➕ إضافة قيمة تاريخية يدوية")
                     with st.form("manual_entry"):
@@ -1787,10 +2636,11 @@ def admin_view(sh, user_name):
                         mn = st.text_input("ملاحظة (اختياري)")
                         if st.form_submit_button("💾 حفظ القيمة"):
                             try:
-                                ws_h     = _get_or_create_history_ws(get_sheet_connection())
+                                ws_h     = _get_or_create_history_ws(get_sheet_connection(),
+                                                                     year=md.year)
                                 note_val = mn if mn else "إدخال يدوي"
                                 ws_h.append_row([sel_kpi, str(md), ma, mt, user_name, note_val])
-                                load_kpi_history.clear()
+                                invalidate_history(KPI_HISTORY_SHEET, ws_h.title)
                                 st.success("✅ تم الحفظ!")
                                 time.sleep(0.4)
                                 st.rerun()
@@ -1806,7 +2656,7 @@ def admin_view(sh, user_name):
             unsafe_allow_html=True,
         )
         if df_kpi is not None:
-            prev = df_kpi[["KPI_Name", "Actual", "Target"]].copy()
+            prev = df_kpi[["KPI_Name", "Actual", "Target"]]
             prev.columns = ["المؤشر", "القيمة الفعلية", "المستهدف"]
             st.dataframe(
                 prev, hide_index=True, use_container_width=True,
@@ -1827,36 +2677,41 @@ def admin_view(sh, user_name):
                         st.rerun()
                     else:
                         st.info("جميع مؤشرات اليوم مُسجَّلة بالفعل.")
-            df_history = load_kpi_history(SHEET_ID)
+            df_history = load_kpi_history(tenants.sheet_id())
             if not df_history.empty:
                 last_d = df_history["Date"].max()
                 n_last = len(df_history[df_history["Date"] == last_d])
                 ld_str = last_d.strftime("%Y-%m-%d")
                 st.caption("آخر لقطة: **" + ld_str + "** — " + str(n_last) +
                            " مؤشر | إجمالي السجلات: " + str(len(df_history)))
+            with st.expander("🗂️ تقسيم السجل القديم حسب السنة"):
+                st.caption("ينقل صفوف ورقتي " + KPI_HISTORY_SHEET + " و" + OPS_HISTORY_SHEET +
+                           " غير المقسّمتين إلى ورقة لكل سنة (مرة واحدة فقط).")
+                if st.button("🗂️ تقسيم الآن", key="split_legacy_hist"):
+                    with st.spinner("جاري الترحيل..."):
+                        try:
+                            sh_m  = get_sheet_connection()
+                            moved = (split_legacy_history(sh_m, KPI_HISTORY_SHEET) +
+                                     split_legacy_history(sh_m, OPS_HISTORY_SHEET))
+                            invalidate_history(KPI_HISTORY_SHEET)
+                            invalidate_history(OPS_HISTORY_SHEET)
+                            st.success("✅ تم نقل " + str(moved) + " سجل.")
+                        except Exception as e:
+                            st.error("خطأ: " + str(e))
 
     elif view == "📄 تصدير PDF":
         if df_kpi is None:
             st.error("تعذّر تحميل بيانات المؤشرات.")
         else:
-            df_kpi["Category"] = df_kpi["KPI_Name"].apply(get_kpi_category)
+            df_kpi["Category"] = kpi_catalog(df_kpi).columns["category"]
 
             def _make_group_fig(group_df, title):
                 if group_df.empty:
                     return None
-                def gc(row):
-                    t = row["Target"]
-                    a = row["Actual"]
-                    d = str(row.get("Direction", "تصاعدي")).strip()
-                    if d == "تنازلي":
-                        return "#2ca02c" if a <= t else "#d62728"
-                    return "#1f77b4" if a > t else ("#2ca02c" if a == t else "#d62728")
-                group_df = group_df.copy()
-                group_df["Color"] = group_df.apply(gc, axis=1)
                 fig = go.Figure()
                 fig.add_trace(go.Bar(
                     x=group_df["KPI_Name"], y=group_df["Actual"],
-                    name="الفعلي", marker_color=group_df["Color"],
+                    name="الفعلي", marker_color=kpi_bar_colors(group_df),
                     text=group_df["Actual"], textposition="auto",
                 ))
                 fig.add_trace(go.Scatter(
@@ -1885,12 +2740,10 @@ def admin_view(sh, user_name):
                 kpi_figs["مجموعة الكفاءة التشغيلية"] = fig_op
 
             try:
-                df_hist_export = load_kpi_history(SHEET_ID)
+                df_hist_export = load_kpi_history(tenants.sheet_id(), recent_history_years())
                 if not df_hist_export.empty:
                     for kpi_name_e in df_hist_export["KPI_Name"].unique()[:4]:
-                        kh_e = df_hist_export[
-                            df_hist_export["KPI_Name"].astype(str).str.strip() == kpi_name_e.strip()
-                        ].sort_values("Date")
+                        kh_e = lookup_rows(df_hist_export, "KPI_Name", kpi_name_e).sort_values("Date")
                         if len(kh_e) >= 2:
                             trend_fig = go.Figure()
                             trend_fig.add_trace(go.Scatter(
@@ -1922,6 +2775,43 @@ def admin_view(sh, user_name):
 
     elif view == "💬 المحادثات":
         st.markdown("### 💬 محادثات المبادرات والمؤشرات")
+        with st.expander("📦 أرشفة التعليقات القديمة"):
+            st.caption("تُنقل الرسائل الأقدم من المدة المحددة إلى ورقة " + COMMENT_ARCHIVE_SHEET
+                       + " ويبقى آخر " + str(COMMENT_TAIL_MIN) + " رسائل على الأقل في كل خلية.")
+            arc_days = st.number_input("أقدم من (يوم):", min_value=1,
+                                       value=COMMENT_ARCHIVE_DAYS, step=1, key="arc_days")
+            if st.button("📦 أرشفة الآن", key="arc_run"):
+                try:
+                    with st.spinner("جاري الأرشفة..."):
+                        n_arc = rollover_comments(sh, arc_days)
+                    st.success("✅ تمت أرشفة " + str(n_arc) + " رسالة.")
+                except Exception as e:
+                    st.error("خطأ في الأرشفة: " + str(e))
+        with st.expander("🕓 تعبئة عمود آخر تحديث (مرة واحدة)"):
+            st.caption("يملأ " + LAST_UPDATED_COL + " الفارغ في الأنشطة والمؤشرات من أحدث رسالة للمالك؛ "
+                       "بعدها يُحدَّث العمود تلقائياً مع كل تحديث أو رسالة من المالك.")
+            if st.button("🕓 تعبئة الآن", key="backfill_lu"):
+                try:
+                    with st.spinner("جاري التعبئة..."):
+                        filled = backfill_last_updated(sh)
+                    for name in filled:
+                        bump_version(name)
+                    st.success("✅ تمت تعبئة " + str(sum(filled.values())) + " صف.")
+                except Exception as e:
+                    st.error("خطأ في التعبئة: " + str(e))
+        with st.expander("🔑 ترحيل كلمات المرور إلى بصمات (مرة واحدة)"):
+            st.caption("يكتب " + user_directory.HASH_COL + " لكل مستخدم في ورقة Users ويفرغ عمود "
+                       + user_directory.PLAIN_COL + ". لإعادة تعيين كلمة مرور لاحقاً تُكتب نصاً في "
+                       + user_directory.PLAIN_COL + " ثم يُعاد الترحيل.")
+            if st.button("🔑 ترحيل الآن", key="migrate_pw"):
+                try:
+                    with st.spinner("جاري الترحيل..."):
+                        n_pw = user_directory.migrate_password_hashes(sh.worksheet("Users"))
+                    user_directory.invalidate()
+                    bump_version("Users")
+                    st.success("✅ تم ترحيل " + str(n_pw) + " مستخدم.")
+                except Exception as e:
+                    st.error("خطأ في الترحيل: " + str(e))
         chat_type = st.radio(
             "نوع المحادثة:",
             ["📋 نشاط محدد", "📊 مؤشر محدد"],
@@ -1959,33 +2849,28 @@ def owner_view(sh, user_name, my_initiatives_str):
         [x.strip() for x in str(my_initiatives_str).split(",") if x.strip()]
         if my_initiatives_str else []
     )
+    _ocu = st.session_state["user_info"].get("username", "").strip()
     try:
-        ws_acts  = sh.worksheet("Activities")
-        all_data = pd.DataFrame(ws_acts.get_all_records())
-        all_data["Mabadara"] = all_data["Mabadara"].astype(str).str.strip()
-        all_data["Activity"] = all_data["Activity"].astype(str).str.strip()
+        got, errors = fetch_parallel({
+            "ws_acts": lambda: sh.worksheet("Activities"),
+            "scope":   lambda: owner_scope(my_list, {_ocu, user_name.strip()}),
+        })
+        if errors:
+            raise next(iter(errors.values()))
+        ws_acts          = got["ws_acts"]
+        my_data, my_kpis = got["scope"]
         for c in ["Admin_Comment", "Owner_Comment"]:
-            if c not in all_data.columns:
-                all_data[c] = ""
-        my_data = all_data[all_data["Mabadara"].isin(my_list)].copy()
-
-        ws_kpi  = sh.worksheet("KPIs")
-        df_kpi  = pd.DataFrame(ws_kpi.get_all_records())
-        df_kpi  = prepare_kpi_df(df_kpi)
+            if c not in my_data.columns:
+                my_data[c] = ""
     except Exception as e:
         st.error("خطأ في تحميل البيانات: " + str(e))
         return
 
-    show_owner_alerts(all_data, my_list)
+    show_owner_alerts(my_data, my_list)
 
-    _ocu = st.session_state["user_info"].get("username", "").strip()
-    my_kpis_top = df_kpi[
-        (df_kpi["Owner"].astype(str).str.strip() == _ocu) |
-        (df_kpi["Owner"].astype(str).str.strip() == user_name.strip())
-    ] if df_kpi is not None and not df_kpi.empty else pd.DataFrame()
-    if not my_kpis_top.empty:
+    if not my_kpis.empty:
         st.markdown("#### 📊 ملخّص مؤشراتي")
-        show_kpi_scorecard(my_kpis_top)
+        show_kpi_scorecard(my_kpis)
 
     view = st.selectbox(
         "القسم:",
@@ -2021,13 +2906,12 @@ def owner_view(sh, user_name, my_initiatives_str):
                     horizontal=True, key="gantt_status",
                 )
 
-            df_g = my_data.copy() if sel_init_g == "الكل" else                    my_data[my_data["Mabadara"] == sel_init_g].copy()
+            df_g = my_data if sel_init_g == "الكل" else my_data[my_data["Mabadara"] == sel_init_g]
 
-            # تحضير التواريخ والإنجاز
-            df_g["_start"] = pd.to_datetime(df_g["Start_Date"], errors="coerce")
-            df_g["_end"]   = pd.to_datetime(df_g["End_Date"],   errors="coerce")
-            df_g["_prog"]  = df_g["Progress"].apply(safe_int)
+            # التواريخ (_start/_end) والإنجاز محوّلة مسبقاً عند التحميل؛ dropna يرجع إطاراً جديداً
+            # فالأعمدة المضافة بعده لا تمس my_data
             df_g = df_g.dropna(subset=["_start", "_end"])
+            df_g["_prog"]  = df_g["Progress"]
 
             today_g = pd.Timestamp(date.today())
 
@@ -2228,6 +3112,7 @@ def owner_view(sh, user_name, my_initiatives_str):
                         if nn.strip():
                             try:
                                 ws_acts.append_row([sel_init, nn, str(ns), str(ne), 0, "", "", ""])
+                                bump_version("Activities")
                                 st.success("تمت الإضافة!")
                                 time.sleep(1.5)
                                 st.rerun()
@@ -2255,6 +3140,7 @@ def owner_view(sh, user_name, my_initiatives_str):
                                         cell = ws_acts.find(sel_act)
                                         if cell:
                                             ws_acts.update_cell(cell.row, cell.col, nv)
+                                            bump_version("Activities")
                                             st.success("تم!")
                                             time.sleep(0.4)
                                             st.rerun()
@@ -2270,6 +3156,7 @@ def owner_view(sh, user_name, my_initiatives_str):
                                     cell = ws_acts.find(sel_act)
                                     if cell:
                                         ws_acts.delete_rows(cell.row)
+                                        bump_version("Activities")
                                         st.success("تم الحذف.")
                                         time.sleep(0.4)
                                         st.rerun()
@@ -2307,58 +3194,51 @@ def owner_view(sh, user_name, my_initiatives_str):
                         nn2 = st.text_area("✍️ إضافة ملاحظة جديدة", height=100)
                         if st.form_submit_button("💾 حفظ التحديث"):
                             try:
-                                sh2  = get_sheet_connection()
-                                ws2  = sh2.worksheet("Activities")
-                                df2  = pd.DataFrame(ws2.get_all_records())
-                                df2["Mabadara"] = df2["Mabadara"].astype(str).str.strip()
-                                df2["Activity"] = df2["Activity"].astype(str).str.strip()
-                                mask2 = (
-                                    (df2["Mabadara"] == sel_init) &
-                                    (df2["Activity"] == sel_act)
+                                ws2 = get_sheet_connection().worksheet("Activities")
+                                # خلايا الصف وحده، مشروطة برقم نسخته؛ الملاحظة تُلحق بالقيمة الحالية
+                                ok = update_row_cells(
+                                    ws2, int(row["_row"]),
+                                    stamp_updated({
+                                        "Progress":      int(np2),
+                                        "Start_Date":    str(ns2),
+                                        "End_Date":      str(ne2),
+                                        "Evidence_Link": str(el),
+                                        "Owner_Comment": timestamped_append(nn2),
+                                    }),
+                                    expect={"Mabadara": sel_init, "Activity": sel_act},
+                                    base=row,
                                 )
-                                if mask2.any():
-                                    fc2 = append_timestamped_comment(pn, nn2)
-                                    df2.loc[mask2, "Progress"]      = int(np2)
-                                    df2.loc[mask2, "Start_Date"]    = str(ns2)
-                                    df2.loc[mask2, "End_Date"]      = str(ne2)
-                                    df2.loc[mask2, "Evidence_Link"] = str(el)
-                                    df2.loc[mask2, "Owner_Comment"] = fc2
-                                    cdf2 = clean_df_for_gspread(df2)
-                                    ws2.update(
-                                        values=[cdf2.columns.tolist()] + cdf2.values.tolist(),
-                                        range_name="A1",
-                                    )
+                                if ok:
+                                    publish("Activities", sel_init)
                                     st.success("✅ تم الحفظ!")
                                     time.sleep(0.4)
                                     st.rerun()
+                                else:
+                                    st.warning("عدّل غيرك نفس الحقول في هذا النشاط منذ التحميل — "
+                                               "راجع القيم الحالية وأعد الحفظ.")
                             except Exception as e:
                                 st.error("خطأ: " + str(e))
 
     elif view == "✏️ تحديث مؤشراتي":
         st.markdown("### 📈 تحديث مؤشرات الأداء المسندة لي")
         st.caption("الأهداف (السنوي والنهائي) يحدّدها المدير. أنت تُدخل المتحقق فقط.")
-        cu = st.session_state["user_info"].get("username", "").strip()
-        my_kpis = df_kpi[
-            (df_kpi["Owner"].astype(str).str.strip() == cu) |
-            (df_kpi["Owner"].astype(str).str.strip() == user_name.strip())
-        ]
         if my_kpis.empty:
             st.info("ℹ️ لم تُسند إليك مؤشرات بعد. تواصل مع مدير النظام لإسناد مؤشراتك.")
         else:
-            df_hist_o = load_kpi_history(SHEET_ID)
+            df_hist_o = load_kpi_history(tenants.sheet_id())
             sk2 = st.selectbox("اختر المؤشر", my_kpis["KPI_Name"].unique())
             if sk2:
                 kr   = my_kpis[my_kpis["KPI_Name"] == sk2].iloc[0]
-                unit = str(kr.get("Unit", "")).strip()
-                unit_type, _ = parse_unit(unit)
-                st.caption(kpi_meta_caption(kr, df_hist_o))
+                meta = kpi_catalog(my_kpis).get(sk2)
+                unit = meta.unit
+                st.caption(kpi_meta_caption(kr, df_hist_o, meta))
                 m1, m2, m3, m4 = st.columns(4)
-                m1.metric("🎯 المستهدف السنوي", fmt_kpi_value(kr["Target"], unit))
-                m2.metric("🏁 الهدف النهائي",   fmt_kpi_value(kr.get(KPI_CUM_COL, 0), unit))
-                m3.metric("📈 المتحقق الحالي",  fmt_kpi_value(kr["Actual"], unit))
-                m4.metric("الوحدة",            unit_type or "-")
+                m1.metric("🎯 المستهدف السنوي", meta.fmt(kr["Target"]))
+                m2.metric("🏁 الهدف النهائي",   meta.fmt(kr.get(KPI_CUM_COL, 0)))
+                m3.metric("📈 المتحقق الحالي",  meta.fmt(kr["Actual"]))
+                m4.metric("الوحدة",            meta.unit_type or "-")
                 cum_a = compute_cumulative_actual(sk2, unit, kr.get("Actual", 0), df_hist_o)
-                plot_dual_target_bars(kr, cum_a, ctx="_own_dual")
+                plot_dual_target_bars(kr, cum_a, ctx="_own_dual", meta=meta)
                 ac_kr = str(kr.get("Admin_Comment", "")).strip()
                 if ac_kr:
                     st.markdown(
@@ -2376,19 +3256,16 @@ def owner_view(sh, user_name, my_initiatives_str):
                     nn3 = st.text_area("أضف ملاحظة جديدة:")
                     if st.form_submit_button("💾 حفظ تحديث المؤشر"):
                         try:
-                            sh3 = get_sheet_connection()
-                            ws3 = sh3.worksheet("KPIs")
-                            # قراءة حديثة للتعليق الحالي لتفادي الكتابة فوق تعليق متزامن
-                            fresh = pd.DataFrame(ws3.get_all_records())
-                            cur_comment = pn2
-                            if not fresh.empty and "KPI_Name" in fresh.columns:
-                                fm = fresh[fresh["KPI_Name"].astype(str).str.strip() == sk2.strip()]
-                                if not fm.empty and "Owner_Comment" in fm.columns:
-                                    cur_comment = str(fm["Owner_Comment"].values[0])
-                            fc3 = append_timestamped_comment(cur_comment, nn3) if nn3.strip() else cur_comment
-                            # تحديث على مستوى الخلية فقط (المتحقق + الملاحظة) — يمنع ضياع تعديلات الملاك المتزامنة
-                            ok = update_kpi_cells(ws3, sk2, {"Actual": na2, "Owner_Comment": fc3})
+                            ws3 = get_sheet_connection().worksheet("KPIs")
+                            # تحديث على مستوى الخلية فقط (المتحقق + الملاحظة) مشروطاً برقم نسخة الصف —
+                            # الملاحظة تُلحق بالتعليق الحالي في الورقة فلا حاجة لقراءته مسبقاً
+                            upd3 = {"Actual": na2}
+                            if nn3.strip():
+                                upd3["Owner_Comment"] = timestamped_append(nn3)
+                            ok = update_row_cells(ws3, int(kr["_row"]), stamp_updated(upd3),
+                                                  expect={"KPI_Name": sk2}, base=kr)
                             if ok:
+                                publish("KPIs", str(kr.get("Owner", "")).strip())
                                 tgt3  = safe_float(kr["Target"])
                                 note3 = nn3[:80] if nn3 else "تحديث تلقائي"
                                 save_kpi_snapshot(sk2, na2, tgt3, user_name, note3)
@@ -2396,39 +3273,40 @@ def owner_view(sh, user_name, my_initiatives_str):
                                 time.sleep(0.4)
                                 st.rerun()
                             else:
-                                st.error("تعذّر العثور على المؤشر في الورقة.")
+                                st.warning("عدّل غيرك المتحقق لهذا المؤشر منذ التحميل، أو تغيّر ترتيب "
+                                           "الصفوف — راجع القيمة الحالية وأعد الحفظ.")
                         except Exception as e:
                             st.error("خطأ: " + str(e))
 
     elif view == "🏥 صحة مبادراتي":
         st.markdown("### 🏥 صحة مبادراتي")
-        show_owner_health(all_data, my_list)
+        show_owner_health(my_data, my_list)
 
     elif view == "📈 اتجاه مؤشراتي":
         st.markdown("### 📈 اتجاه مؤشراتي")
-        cu3   = st.session_state["user_info"].get("username", "").strip()
-        my_k3 = df_kpi[
-            (df_kpi["Owner"].astype(str).str.strip() == cu3) |
-            (df_kpi["Owner"].astype(str).str.strip() == user_name.strip())
-        ]
-        if my_k3.empty:
+        if my_kpis.empty:
             st.info("ℹ️ لم تُسند إليك مؤشرات بعد. تواصل مع مدير النظام لإسناد مؤشراتك.")
         else:
-            df_hist3 = load_kpi_history(SHEET_ID)
-            for _, kr3 in my_k3.iterrows():
-                kn3  = str(kr3["KPI_Name"]).strip()
-                drx3 = str(kr3.get("Direction", "تصاعدي")).strip()
-                unt3 = str(kr3.get("Unit", "")).strip()
+            df_hist3 = load_kpi_history(tenants.sheet_id(), recent_history_years())
+            catalog3 = kpi_catalog(my_kpis)
+            for _, kr3 in my_kpis.iterrows():
+                kn3   = str(kr3["KPI_Name"]).strip()
+                meta3 = catalog3.get(kn3)
                 st.markdown("#### " + kn3)
-                st.caption(kpi_meta_caption(kr3, df_hist3))
-                plot_kpi_trend(df_hist3, kn3, drx3, unt3, ctx="_own3")
+                st.caption(kpi_meta_caption(kr3, df_hist3, meta3))
+                plot_kpi_trend(df_hist3, kn3, meta3.direction, meta3.unit, ctx="_own3")
                 st.markdown("---")
 
     elif view == "📊 كافة المؤشرات":
         st.markdown("### 📊 لوحة المؤشرات العامة (للاطلاع)")
+        try:
+            df_kpi = sheet_columns("KPIs", KPI_VIEW_COLS)
+        except Exception as e:
+            st.error("خطأ في تحميل المؤشرات: " + str(e))
+            df_kpi = None
         if df_kpi is not None and not df_kpi.empty:
-            show_kpi_scorecard(df_kpi)
-        display_kpi_layout(df_kpi, ctx="_own_tab5")
+            show_kpi_scorecard(df_kpi, counts=warm_derived("kpi_status", ["KPIs"]))
+            display_kpi_layout(df_kpi, ctx="_own_tab5")
 
 
     elif view == "⚙️ المؤشرات التشغيلية":
@@ -2438,21 +3316,13 @@ def owner_view(sh, user_name, my_initiatives_str):
             st.warning("هذا القسم مخصص لمسؤول العمليات.")
         else:
             try:
-                ws_ops_o = sh.worksheet("Operational_KPIs")
-                df_ops_o = pd.DataFrame(ws_ops_o.get_all_records())
+                df_ops_o = sheet_frame("Operational_KPIs")
             except Exception as e_ops:
                 st.error("خطأ في تحميل البيانات: " + str(e_ops))
                 df_ops_o = pd.DataFrame()
 
             if not df_ops_o.empty:
-                df_ops_o["المستهدف 2026"] = df_ops_o["المستهدف 2026"].apply(safe_float)
-                df_ops_o["المتحقق"]       = df_ops_o["المتحقق"].apply(safe_float)
-
-                def calc_pct_o(row):
-                    t = safe_float(row["المستهدف 2026"])
-                    a = safe_float(row["المتحقق"])
-                    return round((a / t) * 100, 1) if t else 0.0
-                df_ops_o["النسبة"] = df_ops_o.apply(calc_pct_o, axis=1)
+                df_ops_o["النسبة"] = ops_pct_series(df_ops_o)
 
                 def fmt_n(v):
                     try:
@@ -2460,7 +3330,6 @@ def owner_view(sh, user_name, my_initiatives_str):
                         return int(f) if f == int(f) else round(f, 2)
                     except:
                         return v
-                df_ops_o = df_ops_o.copy()
                 df_ops_o["المستهدف 2026"] = df_ops_o["المستهدف 2026"].apply(fmt_n).astype(str)
                 df_ops_o["المتحقق"]       = df_ops_o["المتحقق"].apply(fmt_n).astype(str)
 
@@ -2528,37 +3397,28 @@ def owner_view(sh, user_name, my_initiatives_str):
                     if st.button("💾 حفظ التحديث", use_container_width=True, key="ops_owner_save"):
                         with st.spinner("جاري الحفظ..."):
                             try:
-                                ws_o2  = sh.worksheet("Operational_KPIs")
-                                df_o2  = pd.DataFrame(ws_o2.get_all_records())
-                                msk_o  = df_o2["المؤشر"] == sel_ops_o
-                                if msk_o.any():
-                                    df_o2.loc[msk_o, "المتحقق"]  = new_act_o
-                                    df_o2.loc[msk_o, "ملاحظات"]  = note_o
-                                    t_o = safe_float(df_o2.loc[msk_o, "المستهدف 2026"].values[0])
-                                    pct_o = round((new_act_o / t_o) * 100, 1) if t_o else 0
-                                    df_o2.loc[msk_o, "النسبة"] = pct_o
-                                    cdf_o = clean_df_for_gspread(df_o2)
-                                    ws_o2.update(
-                                        values=[cdf_o.columns.tolist()] + cdf_o.values.tolist(),
-                                        range_name="A1",
-                                    )
+                                ok, pct_o = save_ops_actual(sh.worksheet("Operational_KPIs"),
+                                                            ops_row_o, new_act_o, note_o)
+                                if ok:
                                     # حفظ في السجل التاريخي
                                     save_ops_snapshot(
                                         sel_ops_o, new_act_o,
-                                        safe_float(df_o2.loc[msk_o, "المستهدف 2026"].values[0]),
+                                        safe_float(ops_row_o["المستهدف 2026"]),
                                         user_name,
                                         note_o[:80] if note_o else "تحديث",
                                     )
                                     st.success("✅ تم الحفظ! النسبة: " + str(pct_o) + "%")
                                     time.sleep(0.4)
                                     st.rerun()
+                                else:
+                                    st.warning("عُدّل هذا المؤشر منذ التحميل — أعد تحميل الصفحة وراجع القيمة.")
                             except Exception as e:
                                 st.error("خطأ: " + str(e))
 
             # ── عرض اتجاه المؤشر بعد التحديث ──
             st.markdown("---")
             st.markdown("#### 📈 الاتجاه التاريخي")
-            df_ops_hist_o = load_ops_history(SHEET_ID + "_ops")
+            df_ops_hist_o = load_ops_history(tenants.sheet_id() + "_ops", recent_history_years())
             if df_ops_hist_o.empty:
                 st.info("لا يوجد سجل تاريخي بعد — سيُحفظ تلقائياً عند أول تحديث.")
             else:
@@ -2590,7 +3450,7 @@ def owner_view(sh, user_name, my_initiatives_str):
                     "النشاط:", acts_oc["Activity"].unique(), key="oc_act"
                 )
             if sel_init_oc and sel_act_oc:
-                show_activity_chat(ws_acts, all_data, sel_init_oc, sel_act_oc,
+                show_activity_chat(ws_acts, my_data, sel_init_oc, sel_act_oc,
                                    "Owner", user_name)
 
 # ---------------------------------------------------------
@@ -2601,13 +3461,11 @@ def owner_view(sh, user_name, my_initiatives_str):
 def viewer_view(sh, user_name):
     st.markdown("### 👋 مرحباً، " + user_name + " (نسخة للاطلاع)")
     try:
-        ws_kpi = sh.worksheet("KPIs")
-        df_kpi = pd.DataFrame(ws_kpi.get_all_records())
+        df_kpi = sheet_columns("KPIs", KPI_VIEW_COLS)
         if df_kpi.empty:
             st.info("ℹ️ لا توجد مؤشرات معرّفة في النظام بعد. سيظهر هذا القسم بعد إضافة المدير للمؤشرات.")
             return
-        df_kpi = prepare_kpi_df(df_kpi)
-        show_kpi_scorecard(df_kpi)
+        show_kpi_scorecard(df_kpi, counts=warm_derived("kpi_status", ["KPIs"]))
         display_kpi_layout(df_kpi, ctx="_viewer")
     except Exception as e:
         st.error("خطأ: " + str(e))
@@ -2624,7 +3482,8 @@ else:
             user_name = st.session_state["user_info"]["name"]
             user_role = st.session_state["user_info"]["role"]
             st.markdown("### 👤 " + user_name)
-            st.caption("الدور: " + user_role)
+            st.caption("الدور: " + user_role
+                       + ("  •  المصنّف: " + tenants.tenant_title() if len(tenants.tenant_ids()) > 1 else ""))
         with cl:
             st.write("")
             if st.button("تسجيل الخروج", use_container_width=True):
@@ -2637,10 +3496,13 @@ else:
     st.write("---")
     try:
         conn = get_sheet_connection()
+        start_refresher(_warm_refresh)   # مرة واحدة لكل مستأجر؛ أول دورة تسخّن المخزن
+        poll_bus()                       # إبطالات الجلسات في العمليات الأخرى (إن فُعّل الناقل)
         role = str(st.session_state["user_info"]["role"]).strip().title()
         if role == "Admin":
             st.title("لوحة القيادة التنفيذية")
             admin_view(conn, user_name)
+            show_sheet_metrics()   # آخر الصفحة — يشمل كل طلبات هذه الإعادة
         elif role == "Owner":
             owner_view(conn, user_name,
                        st.session_state["user_info"]["assigned_initiative"])
@@ -0,0 +1,475 @@
+"""
+data_service.py — خدمة بيانات مشتركة لعدة نسخ من واجهة Streamlit في نظام NMCC
+الإصدار: 1.0
+
+المبدأ:
+  - عملية واحدة تملك اتصال Google Sheets والإطارات المخزّنة وفهارس المفاتيح المطبّعة، وتجدّدها
+    كل REFRESH_SECONDS — فاستهلاك الحصة والذاكرة ثابت مهما زاد عدد نسخ الواجهة خلف الموزّع
+  - الواجهات تتصل بها عبر مقبس محلي (unix:/path بصلاحية 0600 أو 127.0.0.1:port) بعميل رفيع:
+      snapshot/query → إطار الورقة كما قُرئ (مع _row و _k_*)، كاملاً أو مقتطعاً بالأعمدة والمفاتيح
+      mutate        → كتابة فروق الخلايا (sheet_writes.write_cell_diffs) على اتصال الخدمة
+      invalidate    → إسقاط إطار ورقة كتبت عليها الواجهة مباشرة (إلحاق صف، حذف، لقطة سجل...)
+      stats         → حالة الخدمة للوحة التشخيص
+  - الرسالة: طولان (4 بايت لكل منهما) ثم رأس JSON ثم إطار بصيغة Arrow IPC (إن وُجد)
+  - الخدمة تكتب بحساب الخدمة فلا تُفتح للشبكة: TCP على عنوان الحلقة المحلية فقط ويتطلب سراً مشتركاً
+    (NMCC_SERVICE_TOKEN) يُرسل في رأس كل طلب؛ المقبس unix يقتصر على مستخدم العملية، والسر إن ضُبط
+    يُفحص فيه أيضاً
+  - الخدمة اختيارية: بدون NMCC_SERVICE_ADDR أو عند تعذّر الاتصال يعود العميل بـ None (القراءة)
+    أو ServiceUnavailable (الكتابة) فتعمل الواجهة على Sheets مباشرة كما كانت
+
+التشغيل:
+    NMCC_SERVICE_ADDR=unix:/tmp/nmcc.sock python data_service.py --sheet-id <ID>
+    NMCC_SERVICE_ADDR=unix:/tmp/nmcc.sock streamlit run dashboard.py      (لكل نسخة واجهة)
+    NMCC_SERVICE_ADDR=127.0.0.1:8765 NMCC_SERVICE_TOKEN=<سر> ...          (TCP — للعمليتين)
+
+الاستخدام في dashboard.py:
+    import data_service
+    if data_service.enabled():
+        df = data_service.query("Activities", where=("Mabadara", my_list))
+"""
+
+import os
+import re
+import io
+import sys
+import json
+import time
+import socket
+import struct
+import hmac
+import argparse
+import threading
+import socketserver
+import pandas as pd
+from data_store import SHEET_SCHEMAS, SENSITIVE_COLUMNS, normalize_key, normalize_series, key_column, single_flight
+from tenants import current_tenant, DEFAULT_TENANT
+import sheet_metrics
+
+SERVICE_ADDR    = os.environ.get("NMCC_SERVICE_ADDR", "")   # فارغ = بدون خدمة
+SERVICE_TOKEN   = os.environ.get("NMCC_SERVICE_TOKEN", "")   # إلزامي مع TCP
+SERVICE_TIMEOUT = float(os.environ.get("NMCC_SERVICE_TIMEOUT", "30"))
+REFRESH_SECONDS = int(os.environ.get("NMCC_REFRESH_SECONDS", "60"))
+# نفس KPI_HISTORY_SHEET و OPS_HISTORY_SHEET في dashboard.py — تُقرأ كل أوراق سنواتها مدمجة
+HISTORY_BASES   = ("KPI_History", "Ops_KPI_History")
+# أعمدة لا تغادر عملية الخدمة (data_store.SENSITIVE_COLUMNS)
+SERVICE_EXCLUDE = SENSITIVE_COLUMNS
+_LOOPBACK       = ("", "localhost", "127.0.0.1")
+
+_serving = False   # داخل عملية الخدمة نفسها لا يُستخدم العميل
+
+
+class ServiceUnavailable(ConnectionError):
+    """الخدمة غير متاحة قبل إرسال الطلب — آمن أن يعود المستدعي للورقة مباشرة."""
+
+
+class ServiceError(RuntimeError):
+    """فشل بعد وصول الطلب للخدمة — الكتابة ربما نُفّذت، فلا تُعاد مباشرة."""
+
+
+def enabled() -> bool:
+    """الخدمة تملك مصنّفاً واحداً (--sheet-id) فتخدم المستأجر الافتراضي وحده."""
+    return bool(SERVICE_ADDR) and not _serving and current_tenant() == DEFAULT_TENANT
+
+
+# ──────────────────────────────────────────────
+# البروتوكول
+# ──────────────────────────────────────────────
+def _plain(v):
+    """قيمة قابلة لـ JSON من أنواع numpy/pandas (المفقود → None)."""
+    if v is None or (not isinstance(v, (str, list, dict, tuple)) and pd.isna(v)):
+        return None
+    if isinstance(v, (bool, int, float, str)):
+        return v
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    if hasattr(v, "item"):
+        return v.item()
+    return str(v)
+
+
+def _to_arrow(df: pd.DataFrame) -> bytes:
+    import pyarrow as pa
+    # أعمدة get_all_records المختلطة (أرقام ونصوص) تُرسل نصاً — التحويل بالمخطط عند المستقبل
+    df = df.copy(deep=False)
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].map(lambda v: "" if v is None else str(v))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink  = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _from_arrow(body: bytes) -> pd.DataFrame:
+    import pyarrow as pa
+    return pa.ipc.open_stream(io.BytesIO(body)).read_all().to_pandas()
+
+
+def _send(sock, header: dict, df: pd.DataFrame = None) -> None:
+    body = _to_arrow(df) if df is not None else b""
+    head = json.dumps(header, ensure_ascii=False, default=_plain).encode("utf-8")
+    sock.sendall(struct.pack("!II", len(head), len(body)) + head + body)
+
+
+def _recv_exact(sock, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(min(n - len(buf), 1 << 20))
+        if not chunk:
+            raise ConnectionError("انقطع الاتصال")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def _recv(sock):
+    n_head, n_body = struct.unpack("!II", _recv_exact(sock, 8))
+    header = json.loads(_recv_exact(sock, n_head).decode("utf-8"))
+    body   = _recv_exact(sock, n_body) if n_body else b""
+    return header, (_from_arrow(body) if body else None)
+
+
+def _address():
+    if SERVICE_ADDR.startswith("unix:"):
+        return socket.AF_UNIX, SERVICE_ADDR[len("unix:"):]
+    host, _, port = SERVICE_ADDR.rpartition(":")
+    if host not in _LOOPBACK:
+        raise ValueError("خدمة البيانات محلية فقط — استخدم unix:/path أو 127.0.0.1:port بدل " + SERVICE_ADDR)
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def _authorized(req) -> bool:
+    return not SERVICE_TOKEN or hmac.compare_digest(str(req.get("token") or ""), SERVICE_TOKEN)
+
+
+def _encode_edits(edits):
+    """RowEdit → JSON. قيمة الإلحاق (Append) تُرسل كوسم؛ أي دالة أخرى ترفع TypeError."""
+    out = []
+    for e in edits:
+        updates = {}
+        for col, val in e.updates.items():
+            if callable(val):
+                if type(val).__name__ != "Append":
+                    raise TypeError("تحديث غير قابل للإرسال: " + col)
+                val = {"$append": [val.entry, val.sep]}
+            updates[col] = _plain(val) if not isinstance(val, dict) else val
+        base = None
+        if e.base is not None:
+            # يكفي من الصف المحمّل ما يلزم لفحص النسخة والدمج
+            from data_store import ROW_VERSION_COL
+            base = {c: _plain(e.base.get(c)) for c in list(e.updates) + [ROW_VERSION_COL]}
+        out.append({"row": int(e.row), "updates": updates,
+                    "expect": {c: _plain(v) for c, v in (e.expect or {}).items()} or None,
+                    "base": base})
+    return out
+
+
+def _decode_edits(items):
+    from sheet_writes import RowEdit, Append
+    edits = []
+    for it in items:
+        updates = {c: (Append(*v["$append"]) if isinstance(v, dict) and "$append" in v else v)
+                   for c, v in it["updates"].items()}
+        edits.append(RowEdit(it["row"], updates, it.get("expect"), it.get("base")))
+    return edits
+
+
+# ──────────────────────────────────────────────
+# العميل الرفيع
+# ──────────────────────────────────────────────
+_local = threading.local()
+
+
+def _connect():
+    try:
+        family, addr = _address()
+    except ValueError as e:
+        raise ServiceUnavailable(str(e))
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(SERVICE_TIMEOUT)
+    try:
+        sock.connect(addr)
+    except OSError as e:
+        sock.close()
+        raise ServiceUnavailable(str(e))
+    return sock
+
+
+def _call(op: str, **args):
+    """طلب قراءة على اتصال الخيط الحالي (يُعاد فتحه مرة عند الانقطاع)."""
+    for attempt in (0, 1):
+        sock = getattr(_local, "sock", None)
+        try:
+            if sock is None:
+                sock = _connect()
+                _local.sock = sock
+            _send(sock, {"op": op, "token": SERVICE_TOKEN, **args})
+            header, df = _recv(sock)
+        except (OSError, ConnectionError, struct.error, ValueError) as e:
+            _local.sock = None
+            try:
+                if sock is not None:
+                    sock.close()
+            except OSError:
+                pass
+            if attempt:
+                raise ServiceUnavailable(str(e))
+            continue
+        if header.get("error"):
+            raise ServiceUnavailable(header["error"])
+        return header, df
+
+
+def query(name, columns=None, where=None):
+    """
+    إطار الورقة name من الخدمة (كما قُرئ من الورقة)، مقتطعاً بالأعمدة و/أو (عمود مفتاح، قيم).
+    None إن كانت الخدمة معطلة أو متعذرة فيقرأ المستدعي من مصدر آخر.
+    """
+    if not enabled():
+        return None
+    try:
+        _, df = _call("query", name=name, columns=list(columns) if columns else None,
+                      where=[where[0], [str(v) for v in where[1]]] if where else None)
+    except ServiceUnavailable:
+        sheet_metrics.cache_event("service", name, False)
+        return None
+    sheet_metrics.cache_event("service", name, True)
+    return df if df is not None else pd.DataFrame()
+
+
+def mutate(name, edits, header=None):
+    """
+    ينفّذ write_cell_diffs على اتصال الخدمة ويرجع أرقام الصفوف المرفوضة. اتصال جديد لكل كتابة
+    ودون إعادة إرسال: ServiceUnavailable قبل الإرسال فقط، وأي فشل بعده ServiceError.
+    """
+    payload = {"op": "mutate", "token": SERVICE_TOKEN, "name": name, "edits": _encode_edits(edits),
+               "header": list(header) if header else None}
+    sock = _connect()
+    try:
+        _send(sock, payload)
+        h, _ = _recv(sock)
+    except (OSError, ConnectionError, struct.error, ValueError) as e:
+        raise ServiceError("انقطع الاتصال بخدمة البيانات أثناء الكتابة: " + str(e))
+    finally:
+        sock.close()
+    if h.get("denied"):
+        raise ServiceUnavailable(h["error"])   # رُفض قبل التنفيذ — آمن أن يكتب المستدعي مباشرة
+    if h.get("error"):
+        raise ServiceError(h["error"])
+    return h["rejected"]
+
+
+def invalidate(name, key=None) -> bool:
+    """
+    يُبلغ الخدمة بكتابة على الورقة name لم تمر عبر mutate، فتسقط إطارها المخزّن ويُقرأ من الورقة
+    في الطلب التالي. key المفتاح المتأثر (للتشخيص — الخدمة تخزّن الورقة كاملة). False إن تعذّرت.
+    """
+    if not enabled():
+        return False
+    try:
+        _call("invalidate", name=name, key=None if key is None else str(key))
+    except ServiceUnavailable:
+        return False
+    return True
+
+
+def stats():
+    """حالة الخدمة ({} إن كانت معطلة أو متعذرة)."""
+    if not enabled():
+        return {}
+    try:
+        return _call("stats")[0]
+    except ServiceUnavailable:
+        return {}
+
+
+# ──────────────────────────────────────────────
+# الخادم
+# ──────────────────────────────────────────────
+class DataService:
+    """الإطارات المخزّنة لكل ورقة مع إصدارها ووقت جلبها؛ تُجدَّد عند القِدم وبعد كل كتابة."""
+
+    def __init__(self, sheet_id, creds_path, refresh=REFRESH_SECONDS):
+        self.sheet_id   = sheet_id
+        self.creds_path = creds_path
+        self.refresh    = refresh
+        self._sh        = None
+        self._frames    = {}          # اسم → (إصدار، إطار، وقت الجلب)
+        self._versions  = {}
+        self._lock      = threading.Lock()
+        self.counters   = {"requests": 0, "sheet_reads": 0, "writes": 0, "invalidations": 0}
+
+    def spreadsheet(self):
+        if self._sh is None:
+            import gspread
+            from oauth2client.service_account import ServiceAccountCredentials
+            scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+            creds = ServiceAccountCredentials.from_json_keyfile_name(self.creds_path, scope)
+            self._sh = gspread.authorize(creds).open_by_key(self.sheet_id)
+        return self._sh
+
+    def _fetch(self, name):
+        sh = self.spreadsheet()
+        self.counters["sheet_reads"] += 1
+        if name in HISTORY_BASES:
+            pat   = re.compile(re.escape(name) + r"(_\d{4})?")
+            parts = sorted((ws for ws in sh.worksheets() if pat.fullmatch(ws.title)),
+                           key=lambda ws: ws.title)
+            df = pd.concat([pd.DataFrame(ws.get_all_records()) for ws in parts] or [pd.DataFrame()],
+                           ignore_index=True)
+            keys = SHEET_SCHEMAS["History"]["key"]
+        else:
+            df = pd.DataFrame(sh.worksheet(name).get_all_records())
+            if not df.empty:
+                df["_row"] = range(2, len(df) + 2)
+            keys = SHEET_SCHEMAS.get(name, {}).get("key", [])
+        df = df.drop(columns=[c for c in SERVICE_EXCLUDE.get(name, ()) if c in df.columns])
+        for col in keys:
+            if col in df.columns:
+                df[key_column(col)] = normalize_series(df[col]).astype(str)
+        return df
+
+    def _load(self, name):
+        version = self._versions.get(name, 0)
+        df = single_flight(("service", name, version, int(time.time() // self.refresh)),
+                           lambda: self._fetch(name))
+        entry = (version, df, time.time())
+        with self._lock:
+            # كتابة أثناء الجلب تجعل النتيجة قديمة فلا تُخزَّن
+            if self._versions.get(name, 0) == version:
+                self._frames[name] = entry
+        return entry
+
+    def frame(self, name):
+        entry = self._frames.get(name)
+        if entry is None or entry[0] != self._versions.get(name, 0) or time.time() - entry[2] > 2 * self.refresh:
+            entry = self._load(name)
+        return entry[1]
+
+    def query(self, name, columns=None, where=None):
+        df = self.frame(name)
+        if where:
+            col, values = where
+            kc = key_column(col)
+            if kc not in df.columns:
+                raise KeyError("لا يوجد فهرس للعمود " + col)
+            df = df[df[kc].isin({normalize_key(v) for v in values})]
+        if columns:
+            df = df[[c for c in list(columns) + ["_row"] if c in df.columns]]
+        return df.reset_index(drop=True)
+
+    def mutate(self, name, edits, header=None):
+        from sheet_writes import write_cell_diffs
+        ws = self.spreadsheet().worksheet(name)
+        rejected = write_cell_diffs(ws, _decode_edits(edits), header)
+        self._drop(name)
+        self.counters["writes"] += 1
+        return rejected
+
+    def invalidate(self, name, key=None):
+        """كتابة من الواجهة مباشرة على الورقة (أو من عملية أخرى) — الإطار المخزّن لم يعد صالحاً."""
+        self._drop(name)
+        self.counters["invalidations"] += 1
+
+    def _drop(self, name):
+        # رفع الإصدار يمنع أيضاً تخزين جلب بدأ قبل الكتابة (_load)
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self._frames.pop(name, None)
+
+    def stats(self):
+        now = time.time()
+        return {**self.counters,
+                "tables": {n: {"rows": len(e[1]), "age": round(now - e[2], 1), "version": e[0]}
+                           for n, e in self._frames.items()}}
+
+    def refresh_loop(self):
+        """يجدّد الإطارات المخزّنة في الخلفية فيجد الطلب التالي نسخة حديثة دون انتظار."""
+        while True:
+            time.sleep(self.refresh)
+            for name in list(self._frames):
+                try:
+                    self._load(name)
+                except Exception as e:
+                    print("nmcc-service: تعذّر تحديث " + name + ": " + str(e), file=sys.stderr)
+
+
+def _make_handler(service):
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True:
+                try:
+                    req, _ = _recv(self.request)
+                except (ConnectionError, OSError, struct.error):
+                    return
+                if not _authorized(req):
+                    _send(self.request, {"error": "طلب غير مصرّح به لخدمة البيانات", "denied": True})
+                    return
+                service.counters["requests"] += 1
+                op = req.get("op")
+                try:
+                    if op == "query":
+                        _send(self.request, {"ok": True},
+                              service.query(req["name"], req.get("columns"), req.get("where")))
+                    elif op == "mutate":
+                        _send(self.request, {"ok": True, "rejected":
+                                             service.mutate(req["name"], req["edits"], req.get("header"))})
+                    elif op == "invalidate":
+                        service.invalidate(req["name"], req.get("key"))
+                        _send(self.request, {"ok": True})
+                    elif op == "stats":
+                        _send(self.request, service.stats())
+                    else:
+                        _send(self.request, {"error": "عملية غير معروفة: " + str(op)})
+                except Exception as e:
+                    _send(self.request, {"error": type(e).__name__ + ": " + str(e)})
+    return Handler
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+
+def serve(sheet_id, creds_path="credentials.json", refresh=REFRESH_SECONDS):
+    global _serving
+    _serving = True
+    if not SERVICE_ADDR:
+        raise SystemExit("اضبط NMCC_SERVICE_ADDR (unix:/path أو 127.0.0.1:port)")
+    try:
+        family, addr = _address()
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if family != socket.AF_UNIX and not SERVICE_TOKEN:
+        # كل عملية على الجهاز تصل لمنفذ الحلقة المحلية — الكتابة بحساب الخدمة تتطلب السر
+        raise SystemExit("اضبط NMCC_SERVICE_TOKEN لتشغيل الخدمة على TCP")
+    service = DataService(sheet_id, creds_path, refresh)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.remove(addr)
+        # المقبس يُنشأ بصلاحية 0600 مباشرة (لا نافذة بين الإنشاء و chmod)
+        old_mask = os.umask(0o177)
+        try:
+            server = _UnixServer(addr, _make_handler(service))
+        finally:
+            os.umask(old_mask)
+    else:
+        server = _TCPServer(addr, _make_handler(service))
+    threading.Thread(target=service.refresh_loop, name="nmcc-service-refresh", daemon=True).start()
+    print("nmcc-service: يستمع على " + SERVICE_ADDR, file=sys.stderr)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="خدمة بيانات NMCC المشتركة")
+    ap.add_argument("--sheet-id", default=os.environ.get("NMCC_SHEET_ID", ""), required=False)
+    ap.add_argument("--creds", default=os.environ.get("NMCC_CREDENTIALS", "credentials.json"))
+    ap.add_argument("--refresh", type=int, default=REFRESH_SECONDS)
+    a = ap.parse_args()
+    if not a.sheet_id:
+        ap.error("--sheet-id أو NMCC_SHEET_ID مطلوب")
+    serve(a.sheet_id, a.creds, a.refresh)
@@ -0,0 +1,793 @@
+"""
+data_store.py — طبقة البيانات المشتركة لنظام NMCC
+الإصدار: 1.0
+
+المبدأ:
+  - لكل ورقة مخطط أعمدة معلن (SHEET_SCHEMAS) يحدد نوع كل عمود
+  - التحويل (إزالة %، الأرقام، التواريخ، الفئات) يتم دفعة واحدة لكل عمود بدل خلية خلية
+  - لكل جدول رقم إصدار (data version) يُرفع عند كل كتابة، وتُخزَّن النتائج المحمّلة حسبه
+    فلا يُعاد التحويل في كل إعادة تشغيل لـ Streamlit
+  - الكتابة تنشر (publish) الجدول والمفتاح المتأثر على ناقل إبطال: داخل العملية دائماً، وعبر
+    ملف SQLite مشترك بين العمليات عند ضبط NMCC_BUS_PATH — فتُهمل كل عملية ما تأثر فقط
+  - الأسماء العربية تُطابق بمفتاح مطبّع (normalize_key) محسوب مرة عند التحميل، مع فهرس
+    {مفتاح: صفوف} لكل إصدار (key_index) بدل مقارنة العمود كاملاً في كل بحث
+  - الإطارات المحمّلة لقطة واحدة مشتركة لكل إصدار؛ كل مستدعٍ يأخذ مرجعاً سطحياً (frame_view)
+    وأي تعديل عليه ينسخ الأعمدة المعدّلة وحدها (copy-on-write) فلا تمس اللقطة
+  - الوحدة لا تستخدم st مباشرة، فتبقى حالتها مشتركة بين الجلسات داخل العملية
+  - الطلبات المتزامنة لنفس النطاق والإصدار تُدمج في جلب واحد (single_flight)
+  - القراءات المستقلة لواجهة واحدة تُنفَّذ بالتوازي بحد أقصى للتزامن (fetch_all)
+  - نتائج التحليلات تُخزَّن مشتركة بين الجلسات بمفتاح "رمز البيانات" + المعاملات، بحد ذاكرة
+  - خيط تحديث في الخلفية (مرة لكل عملية) يجلب الجداول ويعيد حساب التحليلات دورياً،
+    ويستبدل النتائج دفعة واحدة؛ الواجهات تقرأها دون انتظار الشبكة ما دامت مطابقة للإصدارات
+  - كل الحالة أعلاه لكل مستأجر (مصنّف — tenants.current_tenant): الإصدارات تحمل المستأجر فتنعزل
+    بها كل المخازن المفتاحة بالإصدار، ولكل مستأجر مخزنه الدافئ وخيط تحديثه، والمستأجر الخامل
+    أو الأقدم استخداماً عند تجاوز TENANT_MEMORY_MB يُخلى (evict_tenant)
+
+الاستخدام في dashboard.py:
+    from data_store import coerce_frame, SHEET_SCHEMAS, data_version, bump_version
+"""
+
+import os
+import re
+import sys
+import time
+import uuid
+import pickle
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from tenants import current_tenant, set_tenant, use_tenant, last_seen, DEFAULT_TENANT
+import sheet_metrics
+
+# copy-on-write هو السلوك الوحيد في pandas 3؛ في pandas 2 يُفعَّل صراحة لأن المراجع السطحية
+# للإطارات المشتركة (frame_view) تعتمد عليه
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# ──────────────────────────────────────────────
+# مخططات الأوراق
+# ──────────────────────────────────────────────
+# float/int: أعمدة رقمية (تُزال منها % والفراغات، وغير الرقمي → 0)؛ الصحيحة تُخزَّن بأصغر نوع
+#            يسع قيمها (int16 غالباً للنسب)
+# float32  : أعمدة رقمية تُخزَّن float32 إن لم يتغيّر أي قيمة بذلك، وإلا تبقى float64
+# date     : {العمود الناتج: العمود المصدر} — الأعمدة الخاصة (_) لا تُكتب للورقة
+# text     : أعمدة نصية تُقصّ مسافاتها
+# category : تسميات متكررة تُخزَّن كفئات
+# key      : أعمدة أسماء يُحسب لها مفتاح مطابقة مطبّع في العمود key_column(col)
+# رقم نسخة الصف: يُرفع مع كل كتابة على الصف، والكتابة مشروطة بأنه لم يتغير منذ التحميل
+ROW_VERSION_COL  = "Row_Version"
+VERSIONED_TABLES = ("Activities", "KPIs", "Operational_KPIs")
+# وقت آخر تحديث من المالك (تحديث النشاط/المؤشر أو رسالة منه) — أساس تحليلات الحداثة
+LAST_UPDATED_COL = "Last_Updated"
+# أعمدة لا تُنسخ خارج الورقة (النسخة المحلية وخدمة البيانات) — كلمة المرور النصية وبصمتها
+SENSITIVE_COLUMNS = {"Users": ("password", "password_hash")}
+
+SHEET_SCHEMAS = {
+    "Activities": {
+        "int":      ["Progress", ROW_VERSION_COL],
+        "text":     ["Mabadara", "Activity"],
+        "date":     {"_start": "Start_Date", "_end": "End_Date", "_updated": LAST_UPDATED_COL},
+        "category": ["Mabadara"],
+        "key":      ["Mabadara", "Activity"],
+    },
+    "KPIs": {
+        "float":    ["Target", "Target_Cumulative", "Actual"],
+        "int":      [ROW_VERSION_COL],
+        "text":     ["Owner", "Direction", "Unit"],
+        "date":     {"_updated": LAST_UPDATED_COL},
+        "category": ["Owner", "Direction", "Unit"],
+        "key":      ["KPI_Name", "Owner"],
+    },
+    "Operational_KPIs": {
+        "float": ["المستهدف 2026", "المتحقق"],
+        "int":   [ROW_VERSION_COL],
+        "key":   ["المؤشر"],
+    },
+    "History": {
+        "float32":  ["Actual", "Target"],
+        "date":     {"Date": "Date"},
+        "category": ["KPI_Name", "Recorded_By", "Note"],
+        "key":      ["KPI_Name"],
+    },
+}
+
+
+# ──────────────────────────────────────────────
+# تحويل الأعمدة دفعة واحدة
+# ──────────────────────────────────────────────
+def to_float_series(s: pd.Series) -> pd.Series:
+    """نظير safe_float لعمود كامل: الفارغ وغير الرقمي → 0.0."""
+    if s.dtype.kind in "fiu":
+        return s.astype("float64").fillna(0.0)
+    txt = s.astype(str).str.replace("%", "", regex=False).str.strip()
+    return pd.to_numeric(txt, errors="coerce").astype("float64").fillna(0.0)
+
+
+def to_int_series(s: pd.Series) -> pd.Series:
+    """نظير safe_int لعمود كامل (بتر الكسور مثل int(float(x)))."""
+    f = to_float_series(s)
+    f = f.where(np.isfinite(f), 0.0)
+    return np.trunc(f).astype("int64")
+
+
+def compact_int(s: pd.Series) -> pd.Series:
+    """أصغر نوع صحيح (int16 فما فوق) يسع قيم العمود — int8 يُتجنّب لضيق هامش الحساب عليه."""
+    for dtype in ("int16", "int32"):
+        info = np.iinfo(dtype)
+        if s.empty or (s.min() >= info.min and s.max() <= info.max):
+            return s.astype(dtype)
+    return s
+
+
+def compact_float(s: pd.Series) -> pd.Series:
+    """float32 إن كانت كل القيم تعود كما هي بعد التحويل (أعداد صحيحة وأنصاف...)، وإلا float64."""
+    f = s.astype("float32")
+    return f if (f.astype("float64") == s).all() else s
+
+
+def to_date_series(s: pd.Series) -> pd.Series:
+    """
+    يحوّل عمود تواريخ إلى datetime64: محاولة سريعة بصيغة ISO للعمود كله،
+    ثم تحليل فردي للقيم القليلة المكتوبة بصيغ أخرى. غير القابل للتحليل → NaT.
+    """
+    if s.dtype.kind == "M":
+        return s
+    txt  = s.astype(str).str.strip()
+    out  = pd.to_datetime(txt, errors="coerce", format="ISO8601")
+    rest = out.isna() & txt.ne("")
+    if rest.any():
+        out[rest] = pd.to_datetime(txt[rest], errors="coerce", format="mixed")
+    return out
+
+
+def as_category(df: pd.DataFrame, cols) -> pd.DataFrame:
+    for col in cols:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str).astype("category")
+    return df
+
+
+def coerce_frame(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """يطبّق مخطط الورقة على DataFrame محمّل من get_all_records (عموداً عموداً)."""
+    if df is None or df.empty:
+        return df
+    for col in schema.get("float", []):
+        if col in df.columns:
+            df[col] = to_float_series(df[col])
+    for col in schema.get("float32", []):
+        if col in df.columns:
+            df[col] = compact_float(to_float_series(df[col]))
+    for col in schema.get("int", []):
+        if col in df.columns:
+            df[col] = compact_int(to_int_series(df[col]))
+    for col in schema.get("text", []):
+        if col in df.columns:
+            df[col] = df[col].astype(str).str.strip()
+    for out_col, src in schema.get("date", {}).items():
+        if src in df.columns:
+            df[out_col] = to_date_series(df[src])
+    for col in schema.get("key", []):
+        if col in df.columns:
+            df[key_column(col)] = normalize_series(df[col])
+    return as_category(df, schema.get("category", []))
+
+
+def schema_categories(schema: dict) -> list:
+    """أعمدة الفئات في إطار طُبّق عليه المخطط (تشمل أعمدة المفاتيح) — لإعادتها بعد الدمج."""
+    return schema.get("category", []) + [key_column(c) for c in schema.get("key", [])]
+
+
+# ──────────────────────────────────────────────
+# مفاتيح المطابقة المطبّعة
+# ──────────────────────────────────────────────
+# الاسم نفسه قد يُكتب بأشكال مختلفة في الأوراق (أ/ا، ى/ي، ة/ه، تطويل، مسافات زائدة)؛
+# المطابقة تتم على المفتاح المطبّع دائماً، والعرض والكتابة على القيمة الأصلية.
+_ARABIC_FOLD = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ة": "ه", "ـ": None})
+_DIACRITICS  = re.compile("[\u064B-\u0652\u0670]")
+
+
+def normalize_key(value) -> str:
+    """مفتاح المطابقة لاسم: توحيد أشكال الألف والياء والتاء المربوطة، حذف التطويل والتشكيل،
+    طي المسافات، وتجاهل حالة الأحرف اللاتينية."""
+    txt = _DIACRITICS.sub("", str(value).translate(_ARABIC_FOLD))
+    return " ".join(txt.split()).casefold()
+
+
+def normalize_series(s: pd.Series) -> pd.Series:
+    """normalize_key لعمود كامل — كل قيمة مميزة تُطبَّع مرة واحدة، والناتج فئات."""
+    codes, uniques = pd.factorize(s.astype(str))
+    keys = np.array([normalize_key(u) for u in uniques] + [""], dtype=object)
+    return pd.Series(keys[codes], index=s.index).astype("category")
+
+
+def key_column(col: str) -> str:
+    return "_k_" + col
+
+
+# بصمة كل مصفوفة تسميات صفوف حية: id → (مرجع ضعيف، البصمة). النسخ السطحية (frame_view)
+# تشارك مصفوفة تسميات اللقطة فتقرأ بصمتها مباشرة، والاقتطاع أو الترتيب ينشئ مصفوفة جديدة.
+# لا تُحفظ في df.attrs: الخصائص تُنسخ عميقاً مع كل اقتطاع وتُكتب في بيانات Parquet/Arrow الوصفية.
+_fingerprints = {}
+
+
+def _forget_fingerprint(ref, key):
+    if _fingerprints.get(key, (None,))[0] is ref:
+        _fingerprints.pop(key, None)
+
+
+def rows_fingerprint(df: pd.DataFrame) -> tuple:
+    """بصمة صفوف الإطار (تسمياتها وترتيبها) — معامل لنتائج مرتبطة بمواضع الصفوف، لأن
+    الاقتطاع يرث رمز الإطار الكامل. تُحسب مرة لكل مصفوفة تسميات (stamp_frame/derive_token)
+    وتُقرأ بعدها دون المرور على الصفوف."""
+    idx = df.index
+    if isinstance(idx, pd.RangeIndex):
+        return len(idx), idx.start, idx.step
+    labels = np.asarray(idx)
+    entry  = _fingerprints.get(id(labels))
+    if entry is not None and entry[0]() is labels:
+        return entry[1]
+    h  = pd.util.hash_pandas_object(idx, index=False).to_numpy()
+    fp = len(h), int((h * np.arange(1, len(h) + 1, dtype=np.uint64)).sum())
+    key = id(labels)
+    _fingerprints[key] = (weakref.ref(labels, lambda ref, k=key: _forget_fingerprint(ref, k)), fp)
+    return fp
+
+
+def key_index(df: pd.DataFrame, col: str) -> dict:
+    """
+    {مفتاح مطبّع: مواضع الصفوف} لعمود col — يُبنى مرة لكل إصدار من الإطار (مشترك بين
+    الجلسات)، فيصبح كل بحث بعده قراءة من قاموس.
+    """
+    def build():
+        keys = df[key_column(col)] if key_column(col) in df.columns else normalize_series(df[col])
+        return keys.groupby(keys.to_numpy(), sort=False).indices
+    if col not in df.columns and key_column(col) not in df.columns:
+        return {}
+    return versioned_result("key_index", df, (col, rows_fingerprint(df)), build)
+
+
+def key_mask(df: pd.DataFrame, col: str, values) -> pd.Series:
+    """قناع الصفوف التي يطابق مفتاح col فيها قيمة (أو إحدى قيم) values بعد التطبيع."""
+    if isinstance(values, str) or not hasattr(values, "__iter__"):
+        values = [values]
+    index = key_index(df, col)
+    mask  = np.zeros(len(df), dtype=bool)
+    for v in values:
+        pos = index.get(normalize_key(v))
+        if pos is not None:
+            mask[pos] = True
+    return pd.Series(mask, index=df.index)
+
+
+def lookup_rows(df: pd.DataFrame, col: str, value) -> pd.DataFrame:
+    """صفوف df التي يطابق مفتاح col فيها value (إطار فارغ إن لم توجد)."""
+    pos = key_index(df, col).get(normalize_key(value))
+    return df.iloc[pos] if pos is not None else df.iloc[0:0]
+
+
+def frame_memory(df: pd.DataFrame) -> dict:
+    """
+    ذاكرة الإطار بأنواعه الحالية مقابل نفس البيانات كنصوص كما يرجعها get_all_records
+    (قبل التحويل) — بالبايت، مع حساب محتوى النصوص.
+    """
+    if df is None:
+        return {"rows": 0, "before": 0, "after": 0}
+    return {
+        "rows":   len(df),
+        "before": int(df.astype(str).memory_usage(deep=True).sum()),
+        "after":  int(df.memory_usage(deep=True).sum()),
+    }
+
+
+def frame_view(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    مرجع خاص بالمستدعي لإطار مشترك بين الجلسات دون نسخ بياناته: إضافة عمود أو تعديل قيم
+    على المرجع تنسخ الجزء المعدّل وحده، واللقطة المشتركة تبقى كما هي.
+    """
+    return df if df is None else df.copy(deep=False)
+
+
+# ──────────────────────────────────────────────
+# إصدارات البيانات
+# ──────────────────────────────────────────────
+# ثلاثة مستويات: إصدار الجدول (أي تغيير)، إصدار البنية (إضافة/حذف/إعادة كتابة شاملة)،
+# وإصدار المفتاح (تعديل صفوف مفتاح واحد مثل مبادرة أو مالك أو ورقة سنة في السجل).
+# العدّادات مفتاحها (المستأجر، الجدول)، والإصدار المُرجع (المستأجر، الرقم) — فمخازن st.cache
+# وغيرها المفتاحة بالإصدار لا تخلط جداول مصنّفين مختلفين بنفس الاسم.
+_versions      = {}
+_structure     = {}
+_key_versions  = {}
+_versions_lock = threading.Lock()
+
+
+def _version_of(table: str, tenant=None) -> int:
+    return _versions.get((tenant or current_tenant(), table), 0)
+
+
+def data_version(table: str) -> tuple:
+    """إصدار الجدول للمستأجر الحالي داخل العملية — يدخل في مفاتيح التخزين المؤقت."""
+    tenant = current_tenant()
+    return tenant, _versions.get((tenant, table), 0)
+
+
+def structure_version(table: str) -> tuple:
+    """لا يتغير بتعديل صفوف مفتاح واحد — لما يعتمد على مواضع الصفوف (مثل فهرس المالك)."""
+    tenant = current_tenant()
+    return tenant, _structure.get((tenant, table), 0)
+
+
+def scope_version(table: str, keys) -> tuple:
+    """إصدار جزء من الجدول يحدده مفاتيحه: يتغير ببنية الجدول أو بكتابة على أحد هذه المفاتيح فقط."""
+    tenant = current_tenant()
+    return (structure_version(table),) + tuple(
+        _key_versions.get((tenant, table, k), 0) for k in sorted(normalize_key(k) for k in keys))
+
+
+def publish(table: str, key=None, broadcast: bool = True) -> None:
+    """
+    يُستدعى بعد كل كتابة: key=None تغيير شامل للجدول، وإلا المفتاح المتأثر وحده.
+    يرفع الإصدارات المعنية، ويُبلغ المشتركين، ويوقظ خيط التحديث، ويرسل الحدث للعمليات الأخرى.
+    """
+    tenant = current_tenant()
+    with _versions_lock:
+        _versions[(tenant, table)] = _versions.get((tenant, table), 0) + 1
+        if key is None:
+            _structure[(tenant, table)] = _structure.get((tenant, table), 0) + 1
+        else:
+            k = (tenant, table, normalize_key(key))
+            _key_versions[k] = _key_versions.get(k, 0) + 1
+    for fn in list(_subscribers.values()):
+        try:
+            fn(table, key)
+        except Exception:
+            pass
+    _wake_event(tenant).set()   # خيط الخلفية يعيد التحميل بعد الكتابة دون انتظار الدورة التالية
+    if broadcast:
+        _bus_send(table, key)
+
+
+def bump_version(*tables: str) -> None:
+    """تغيير شامل لجدول أو أكثر — نظير publish(table) لكل جدول."""
+    for t in tables:
+        publish(t)
+
+
+# ──────────────────────────────────────────────
+# ناقل الإبطال
+# ──────────────────────────────────────────────
+_subscribers = {}
+
+
+def subscribe(name: str, fn) -> None:
+    """
+    يسجّل fn(table, key) لكل حدث كتابة (محلي أو قادم من عملية أخرى). الاسم يمنع التكرار.
+    يُستدعى في سياق مستأجر الحدث (current_tenant).
+    """
+    _subscribers[name] = fn
+
+
+BUS_PATH          = os.environ.get("NMCC_BUS_PATH", "")   # فارغ = داخل العملية فقط
+BUS_POLL_SECONDS  = 1
+BUS_KEEP_SECONDS  = 24 * 3600
+_PROCESS_ID       = uuid.uuid4().hex
+_bus_state        = {"last_id": None, "polled": 0.0, "migrated": False}
+_bus_lock         = threading.Lock()
+
+
+def _bus_conn():
+    conn = sqlite3.connect(BUS_PATH, timeout=5, isolation_level=None)
+    conn.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                 " tbl TEXT, key TEXT, proc TEXT, at REAL, tenant TEXT)")
+    if not _bus_state["migrated"]:
+        # ملف ناقل من إصدار سابق بلا عمود المستأجر — أحداثه للمصنّف الافتراضي
+        try:
+            conn.execute("ALTER TABLE events ADD COLUMN tenant TEXT")
+        except sqlite3.OperationalError:
+            pass
+        _bus_state["migrated"] = True
+    return conn
+
+
+def _bus_send(table, key):
+    if not BUS_PATH:
+        return
+    try:
+        conn = _bus_conn()
+        try:
+            conn.execute("INSERT INTO events (tbl, key, proc, at, tenant) VALUES (?, ?, ?, ?, ?)",
+                         (table, None if key is None else str(key), _PROCESS_ID, time.time(),
+                          current_tenant()))
+            conn.execute("DELETE FROM events WHERE at < ?", (time.time() - BUS_KEEP_SECONDS,))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass   # الناقل المشترك تحسين؛ تعذّره لا يوقف الكتابة (تبقى الإصدارات المحلية صحيحة)
+
+
+def poll_bus() -> int:
+    """
+    يطبّق أحداث الكتابة القادمة من العمليات الأخرى (مرة كل BUS_POLL_SECONDS على الأكثر).
+    أول استدعاء يبدأ من آخر حدث موجود فلا يُعاد تطبيق ما سبق تشغيل العملية. يرجع عدد الأحداث.
+    """
+    if not BUS_PATH or time.time() - _bus_state["polled"] < BUS_POLL_SECONDS:
+        return 0
+    with _bus_lock:
+        _bus_state["polled"] = time.time()
+        try:
+            conn = _bus_conn()
+            try:
+                if _bus_state["last_id"] is None:
+                    row = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()
+                    _bus_state["last_id"] = row[0]
+                    return 0
+                rows = conn.execute("SELECT id, tbl, key, proc, tenant FROM events WHERE id > ?"
+                                    " ORDER BY id", (_bus_state["last_id"],)).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return 0
+        applied = 0
+        for ev_id, table, key, proc, tenant in rows:
+            _bus_state["last_id"] = ev_id
+            if proc != _PROCESS_ID:
+                with use_tenant(tenant or DEFAULT_TENANT):
+                    publish(table, key, broadcast=False)
+                applied += 1
+        return applied
+
+
+# ──────────────────────────────────────────────
+# التحديث في الخلفية (المخزن الدافئ)
+# ──────────────────────────────────────────────
+REFRESH_SECONDS  = int(os.environ.get("NMCC_REFRESH_SECONDS", "60"))
+REFRESH_DEBOUNCE = 2   # ثوانٍ لتجميع الكتابات المتتالية في تحديث واحد
+# مستأجر بلا جلسات منذ هذه المدة يتوقف خيط تحديثه ويُخلى مخزنه الدافئ
+TENANT_IDLE_SECONDS = int(os.environ.get("NMCC_TENANT_IDLE_SECONDS", "1800"))
+# حد ذاكرة المخازن الدافئة لكل المستأجرين معاً — تجاوزه يُخلي الأقدم استخداماً أولاً
+TENANT_MEMORY_MB    = int(os.environ.get("NMCC_TENANT_MEMORY_MB", "512"))
+
+# لكل مستأجر لقطة تُستبدل كاملة بإسناد واحد — القارئ يرى القديمة أو الجديدة، لا خليطاً منهما
+_EMPTY_WARM     = {"versions": {}, "values": {}, "at": 0.0, "error": "", "bytes": 0}
+_warm           = {}   # مستأجر → لقطة
+_wakes          = {}   # مستأجر → Event يوقظ خيط تحديثه
+_refreshers     = {}   # مستأجر → خيط التحديث
+_stopped        = set()
+_refresher_lock = threading.Lock()
+
+
+def _wake_event(tenant) -> threading.Event:
+    ev = _wakes.get(tenant)
+    if ev is None:
+        with _refresher_lock:
+            ev = _wakes.setdefault(tenant, threading.Event())
+    return ev
+
+
+def warm_value(name: str, tables):
+    """
+    قيمة محسوبة في الخلفية إن بُنيت على الإصدارات الحالية لكل الجداول التي تعتمد عليها
+    ولم يتوقف التحديث عن تجديدها؛ وإلا None فيعود المستدعي للتحميل المباشر.
+    """
+    snap = _warm.get(current_tenant(), _EMPTY_WARM)
+    fresh = (name in snap["values"] and time.time() - snap["at"] <= 3 * REFRESH_SECONDS
+             and all(snap["versions"].get(t, 0) == _version_of(t) for t in tables))
+    sheet_metrics.cache_event("warm", name, fresh)
+    return snap["values"][name] if fresh else None
+
+
+def refresher_status() -> dict:
+    """وقت آخر تحديث ناجح وآخر خطأ للمستأجر الحالي — للعرض في لوحات التشخيص."""
+    tenant = current_tenant()
+    snap   = _warm.get(tenant, _EMPTY_WARM)
+    th     = _refreshers.get(tenant)
+    return {"at": snap["at"], "error": snap["error"], "alive": th is not None and th.is_alive()}
+
+
+def start_refresher(job, interval: int = REFRESH_SECONDS) -> bool:
+    """
+    يشغّل خيط التحديث مرة واحدة لكل مستأجر في العملية (الاستدعاءات اللاحقة لا تفعل شيئاً).
+    job() يرجع {اسم: قيمة} ويُستدعى في سياق المستأجر؛ يُستدعى فوراً لتسخين المخزن ثم كل
+    interval ثانية أو بعد كل كتابة، حتى يُخلى المستأجر.
+    """
+    tenant = current_tenant()
+    with _refresher_lock:
+        th = _refreshers.get(tenant)
+        if th is not None and th.is_alive():
+            return False
+        _stopped.discard(tenant)
+        th = _refreshers[tenant] = threading.Thread(target=_refresh_loop, args=(job, interval, tenant),
+                                                    name="nmcc-refresher:" + tenant, daemon=True)
+        th.start()
+        return True
+
+
+def _refresh_loop(job, interval, tenant):
+    set_tenant(tenant)
+    wake = _wake_event(tenant)
+    while tenant not in _stopped:
+        if time.time() - last_seen(tenant) > TENANT_IDLE_SECONDS:
+            evict_tenant(tenant)
+            break
+        wake.clear()
+        poll_bus()
+        # الإصدارات تُقرأ قبل الجلب: كتابة أثناء الجلب تجعل النتيجة قديمة فلا تُستخدم
+        versions = {t: n for (tn, t), n in list(_versions.items()) if tn == tenant}
+        started  = time.time()
+        try:
+            values = job()
+            _detect_external_changes(tenant, values, versions)
+            if tenant in _stopped:
+                break
+            _warm[tenant] = {"versions": versions, "values": values, "at": started, "error": "",
+                             "bytes": sum(_approx_bytes(v) for v in values.values()
+                                          if isinstance(v, pd.DataFrame))}
+            _enforce_memory_cap(keep=tenant)
+        except Exception as e:
+            _warm[tenant] = {**_warm.get(tenant, _EMPTY_WARM), "error": str(e)}
+        if wake.wait(interval):
+            time.sleep(REFRESH_DEBOUNCE)
+
+
+def _detect_external_changes(tenant, values, versions):
+    """
+    تعديل مباشر على الورقة (خارج النظام) لا يمر بـ publish: يُكتشف بمقارنة الإطار الجديد بسابقه
+    فيُرفع إصدار الجدول محلياً وتُهمل نسخه المخزّنة — وهذا ما يسمح بمدد تخزين طويلة.
+    """
+    snap = _warm.get(tenant, _EMPTY_WARM)
+    old  = snap["values"]
+    for name, df in values.items():
+        prev = old.get(name)
+        if not isinstance(df, pd.DataFrame) or not isinstance(prev, pd.DataFrame):
+            continue
+        if snap["versions"].get(name, 0) != versions.get(name, 0):
+            continue   # كتابة من النظام منذ اللقطة السابقة تفسّر الفرق — نُشرت بالفعل
+        if df.equals(prev):
+            continue
+        untouched = versions.get(name, 0) == _version_of(name, tenant)
+        publish(name, broadcast=False)
+        if untouched:
+            # اللقطة الجديدة تحوي التعديل نفسه فهي مطابقة للإصدار الجديد
+            versions[name] = _version_of(name, tenant)
+
+
+# ──────────────────────────────────────────────
+# إخلاء المستأجرين
+# ──────────────────────────────────────────────
+def evict_tenant(tenant) -> None:
+    """
+    يُخلي مستأجراً من ذاكرة العملية: مخزنه الدافئ ونتائج تحليلاته، ويوقف خيط تحديثه. الإصدارات
+    تبقى (أرقام صغيرة) فلا تعود مخازن st.cache القديمة صالحة خطأً؛ أول جلسة تالية تعيد التسخين.
+    """
+    global _results_bytes
+    with _refresher_lock:
+        _stopped.add(tenant)
+        _warm.pop(tenant, None)
+    _wake_event(tenant).set()
+    with _results_lock:
+        for k in list(_results):
+            if _token_tenant(k[1]) == tenant:
+                _results_bytes -= _results.pop(k)[1]
+                _results_stats["evicted"] += 1
+
+
+def _enforce_memory_cap(keep=None) -> None:
+    """يُخلي المستأجرين الأقدم استخداماً حتى تعود ذاكرة المخازن الدافئة تحت TENANT_MEMORY_MB."""
+    cap = TENANT_MEMORY_MB * 1024 * 1024
+    while sum(s["bytes"] for s in list(_warm.values())) > cap:
+        idle = sorted((t for t in list(_warm) if t != keep), key=last_seen)
+        if not idle:
+            return
+        evict_tenant(idle[0])
+
+
+def tenant_stats() -> dict:
+    """{مستأجر: ذاكرة المخزن الدافئ، آخر تحديث، آخر استخدام، حالة الخيط} — للوحة التشخيص."""
+    out = {}
+    for tenant, th in list(_refreshers.items()):
+        snap = _warm.get(tenant, _EMPTY_WARM)
+        out[tenant] = {"bytes": snap["bytes"], "at": snap["at"], "seen": last_seen(tenant),
+                       "alive": th.is_alive() and tenant not in _stopped}
+    return out
+
+
+# ──────────────────────────────────────────────
+# دمج الطلبات المتزامنة (single-flight)
+# ──────────────────────────────────────────────
+# طلبات متزامنة بنفس المفتاح (النوع، الورقة/النطاق، الإصدار) تنتظر جلباً واحداً جارياً
+# وتتشارك نتيجته بدل أن يرسل كل منها طلبه. النتيجة المشتركة للقراءة فقط.
+class _Flight:
+    def __init__(self):
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+
+_flights      = {}
+_flights_lock = threading.Lock()
+_flight_stats = {}   # {النوع: {"calls": عدد الطلبات، "coalesced": ما انتظر طلباً جارياً}}
+
+
+def single_flight(key: tuple, fetch):
+    """
+    ينفّذ fetch() مرة واحدة لكل مفتاح في اللحظة نفسها؛ key[0] نوع الطلب (للإحصاء).
+    المفتاح يُميَّز بالمستأجر الحالي — نفس الورقة في مصنّفين طلبان مختلفان.
+    """
+    stats_key = key[0]
+    key = (current_tenant(),) + tuple(key)
+    with _flights_lock:
+        stats = _flight_stats.setdefault(stats_key, {"calls": 0, "coalesced": 0})
+        stats["calls"] += 1
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+        else:
+            stats["coalesced"] += 1
+    sheet_metrics.cache_event("single_flight", stats_key, not leader)
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    try:
+        flight.result = fetch()
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def single_flight_stats() -> dict:
+    """نسخة من عدّادات الدمج لكل نوع طلب منذ بدء العملية."""
+    with _flights_lock:
+        return {k: dict(v) for k, v in _flight_stats.items()}
+
+
+# ──────────────────────────────────────────────
+# تنسيق القراءات المتوازية
+# ──────────────────────────────────────────────
+FETCH_WORKERS = int(os.environ.get("NMCC_FETCH_WORKERS", "6"))
+
+
+def fetch_all(jobs: dict, max_workers: int = FETCH_WORKERS, initializer=None):
+    """
+    ينفّذ قراءات مستقلة {اسم: دالة} بالتوازي بحد أقصى max_workers، ويرجع (النتائج، الأخطاء)
+    بعد انتهاء الجميع؛ فشل قراءة لا يوقف غيرها. زمن الانتظار ≈ أبطأ قراءة لا مجموعها.
+    initializer يُستدعى في كل خيط قبل التنفيذ (مثل ربطه بسياق جلسة Streamlit)، والخيوط
+    ترث مستأجر المستدعي ونطاق قياسه (sheet_metrics).
+    """
+    results, errors = {}, {}
+    if not jobs:
+        return results, errors
+    tenant = current_tenant()
+    scope  = sheet_metrics.current_scope()
+
+    def init():
+        set_tenant(tenant)
+        sheet_metrics.set_scope(scope)
+        if initializer is not None:
+            initializer()
+    with ThreadPoolExecutor(max_workers=max(1, min(len(jobs), max_workers)),
+                            initializer=init) as ex:
+        futures = {name: ex.submit(fn) for name, fn in jobs.items()}
+        for name, fut in futures.items():
+            try:
+                results[name] = fut.result()
+            except Exception as e:
+                errors[name] = e
+    return results, errors
+
+
+# ──────────────────────────────────────────────
+# تخزين نتائج التحليلات حسب إصدار البيانات
+# ──────────────────────────────────────────────
+# كل إطار محمّل يحمل رمزاً في df.attrs (الجدول، الإصدار بمستأجره، لحظة الجلب) ينتقل معه عبر النسخ
+# والتصفية؛ النتائج تُخزَّن بمفتاح (التحليل، الرمز، المعاملات) فيدفع أول مشاهد لإصدار جديد
+# ثمن الحساب ويأخذها البقية جاهزة. المخزن مشترك بين الجلسات ومحدود بالذاكرة (LRU).
+RESULT_CACHE_MB = int(os.environ.get("NMCC_RESULT_CACHE_MB", "64"))
+
+_results       = OrderedDict()   # مفتاح → (القيمة، الحجم التقريبي بالبايت)
+_results_bytes = 0
+_results_lock  = threading.Lock()
+_results_stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+
+def stamp_frame(df: pd.DataFrame, table: str, *scope) -> pd.DataFrame:
+    """يضع رمز البيانات على إطار محمّل للتو من الجدول table (scope: معاملات تصفية إضافية)."""
+    if df is not None:
+        df.attrs["data_token"] = (table, data_version(table), time.time()) + tuple(scope)
+        rows_fingerprint(df)
+    return df
+
+
+def derive_token(df: pd.DataFrame, *scope) -> pd.DataFrame:
+    """رمز إطار مشتق بتصفية لا تظهر في معاملات التحليل (مثل اقتطاع صفوف مالك)."""
+    if df is not None and "data_token" in df.attrs:
+        df.attrs["data_token"] = (df.attrs["data_token"],) + tuple(scope)
+        rows_fingerprint(df)
+    return df
+
+
+def _token_root(token) -> tuple:
+    while isinstance(token[0], tuple):
+        token = token[0]
+    return token
+
+
+def _token_tenant(token):
+    return _token_root(token)[1][0]
+
+
+def _approx_bytes(value) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+def versioned_result(name: str, df: pd.DataFrame, params: tuple, compute):
+    """
+    نتيجة compute() مخزّنة بمفتاح (name، رمز df، params). إطار بلا رمز يُحسب دون تخزين.
+    الحسابات المتزامنة لنفس المفتاح تُدمج في حساب واحد. القيمة المرجعة مشتركة — للقراءة فقط.
+    """
+    token = df.attrs.get("data_token") if df is not None else None
+    if token is None:
+        return compute()
+    key = (name, token, params)
+    with _results_lock:
+        if key in _results:
+            _results.move_to_end(key)
+            _results_stats["hits"] += 1
+            sheet_metrics.cache_event("results", name, True)
+            return _results[key][0]
+        _results_stats["misses"] += 1
+    sheet_metrics.cache_event("results", name, False)
+    value = single_flight(("analytics", key), compute)
+    _remember(key, value)
+    return value
+
+
+def _remember(key, value):
+    global _results_bytes
+    size = _approx_bytes(value)
+    cap  = RESULT_CACHE_MB * 1024 * 1024
+    if size > cap:
+        return
+    with _results_lock:
+        if key in _results:
+            return
+        _results[key]   = (value, size)
+        _results_bytes += size
+        while _results_bytes > cap and _results:
+            _, (_, old) = _results.popitem(last=False)
+            _results_bytes -= old
+            _results_stats["evicted"] += 1
+
+
+def _drop_stale_results(table, key):
+    """عند الكتابة على جدول تُزال نتائج التحليلات المبنية على إصداراته السابقة فوراً."""
+    global _results_bytes
+    current = data_version(table)
+    with _results_lock:
+        for k in list(_results):
+            root = _token_root(k[1])
+            if root[0] == table and root[1][0] == current[0] and root[1] < current:
+                _results_bytes -= _results.pop(k)[1]
+
+
+subscribe("result_cache", _drop_stale_results)
+
+
+def result_cache_stats() -> dict:
+    with _results_lock:
+        return {**_results_stats, "entries": len(_results), "bytes": _results_bytes}
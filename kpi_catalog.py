@@ -0,0 +1,197 @@
+"""
+kpi_catalog.py — سجل البيانات التعريفية لمؤشرات الأداء في نظام NMCC
+الإصدار: 1.0
+
+المبدأ:
+  - مجموعة المؤشر ونوع وحدته وتكرار قياسه وكونه نسبة واتجاهه ودالة تنسيق قيمه تُستخرج
+    مرة واحدة لكل إصدار من ورقة KPIs، بدل إعادة اشتقاقها في كل رسم أو بطاقة أو تصدير
+  - السجل متاح بصيغتين: قاموس {مفتاح مطبّع: KpiMeta} للبحث بالاسم، وأعمدة (مصفوفات numpy)
+    مرتبة كصفوف الإطار للحساب على المؤشرات دفعة واحدة
+  - الاتجاه قيمة من Direction بدل مقارنة النصوص، وتحليل حقل Unit يُخزَّن لكل قيمة مميزة
+
+الاستخدام في dashboard.py:
+    from kpi_catalog import kpi_catalog, Direction
+    cat = kpi_catalog(df_kpi)
+    cat.get("CMC").fmt(85)              → "85"
+    cat.columns["category"] == "QI4SD"  → قناع صفوف المجموعة
+"""
+
+import enum
+from functools import lru_cache
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from data_store import normalize_key, key_column, versioned_result, rows_fingerprint
+
+# ──────────────────────────────────────────────
+# مجموعات المؤشرات
+# ──────────────────────────────────────────────
+KPI_GROUPS = {
+    "QI4SD": [
+        "QI4SD - Metrology", "CMC", "B of CMC", "ILC", "CC",
+        "OIML project groups", "OIML-CS - number of services offered",
+    ],
+    "البحث والتطوير": [
+        "عدد الابحاث العلمية المنشورة في مجلات مصنفة دولياً Q1, Q2",
+        "عدد المشاركات العلمية الدولية", "عدد الطلاب الملتحقين",
+        "عدد فعاليات الاستقطاب الجامعي", "عدد المشاريع الوطنية",
+        "عدد المشاركين سنوياً في برامج التبادل الفني",
+    ],
+    "الكفاءة التشغيلية": [
+        "نسبة نضج الحوكمة المؤسسية KAQA", "مؤشر التميز المؤسسي",
+        "نسبة الإجراءات المؤتمتة", "مستوى رضا المستفيدين", "التحول الرقمي DGA",
+        "نسبة الدوران الوظيفي", "نسبة الإيرادات الى إجمالي ميزانية",
+        "نسبة النمو في إيرادات",
+    ],
+}
+OTHER_CATEGORY = "مؤشرات أخرى"
+
+# {مفتاح مطبّع للمؤشر: مجموعته} — يُبنى مرة عند التحميل
+_KPI_GROUP_INDEX = {normalize_key(k): group for group, items in KPI_GROUPS.items() for k in items}
+
+
+def get_kpi_category(kpi_name):
+    return _KPI_GROUP_INDEX.get(normalize_key(kpi_name), OTHER_CATEGORY)
+
+
+# ──────────────────────────────────────────────
+# الاتجاه والوحدة والتنسيق
+# ──────────────────────────────────────────────
+class Direction(enum.Enum):
+    UP   = "تصاعدي"   # الأعلى أفضل
+    DOWN = "تنازلي"   # الأقل أفضل
+
+    @classmethod
+    def parse(cls, value) -> "Direction":
+        """من نص الورقة (أو Direction)؛ الفارغ وغير المعروف → تصاعدي."""
+        if isinstance(value, cls):
+            return value
+        return cls.DOWN if normalize_key(value) == _DOWN_KEY else cls.UP
+
+
+_DOWN_KEY = normalize_key(Direction.DOWN.value)
+
+
+@lru_cache(maxsize=1024)
+def unit_info(unit) -> tuple:
+    """
+    (نوع الوحدة، التكرار، نسبة؟) من حقل Unit بصيغة '<النوع> - <التكرار>' —
+    قيم Unit قليلة ومتكررة، فكل قيمة مميزة تُحلَّل مرة واحدة.
+    """
+    u = str(unit).strip()
+    unit_type, freq = u, ""
+    if " - " in u:
+        a, b = u.split(" - ", 1)
+        unit_type, freq = a.strip(), b.strip()
+    low = u.lower()
+    return unit_type, freq, ("نسبة" in low) or ("%" in low) or ("percent" in low)
+
+
+def parse_unit(unit):
+    """يفصل وحدة القياس عن التكرار في حقل Unit بصيغة '<النوع> - <التكرار>'."""
+    return unit_info(unit)[:2]
+
+
+def is_percentage_kpi(unit):
+    """يحدد إن كان المؤشر من نوع نسبة (لا يُجمع تراكمياً) اعتماداً على وحدة القياس."""
+    return unit_info(unit)[2]
+
+
+def _to_float(val):
+    try:
+        return float(str(val).replace("%", "").strip())
+    except Exception:
+        return 0.0
+
+
+def format_value(val, is_percentage) -> str:
+    """تنسيق موحّد: النسب تُعرض مع علامة %، والأعداد كما هي.
+    ملاحظة: ورقة KPIs تخزّن النسب كأرقام كاملة (85 = 85%) لا ككسور، فلا ضرب ×100."""
+    v = _to_float(val)
+    if is_percentage:
+        disp = int(v) if v == int(v) else round(v, 1)
+        return str(disp) + "%"
+    return str(int(v) if v == int(v) else round(v, 2))
+
+
+def fmt_kpi_value(val, unit):
+    return format_value(val, is_percentage_kpi(unit))
+
+
+# ──────────────────────────────────────────────
+# السجل
+# ──────────────────────────────────────────────
+class KpiMeta(NamedTuple):
+    name:          str
+    category:      str
+    unit:          str
+    unit_type:     str
+    frequency:     str
+    is_percentage: bool
+    direction:     Direction
+
+    def fmt(self, val) -> str:
+        return format_value(val, self.is_percentage)
+
+
+def _unknown_meta(name) -> KpiMeta:
+    return KpiMeta(str(name).strip(), get_kpi_category(name), "", "", "", False, Direction.UP)
+
+
+class KpiCatalog:
+    """
+    by_key : {مفتاح مطبّع: KpiMeta} — أول ظهور للاسم في الورقة هو المعتمد
+    columns: {"name", "category", "unit_type", "frequency", "is_percentage", "direction"}
+             مصفوفات بطول الإطار وبترتيب صفوفه
+    """
+
+    def __init__(self, by_key: dict, columns: dict):
+        self.by_key  = by_key
+        self.columns = columns
+
+    def get(self, name) -> KpiMeta:
+        """بيانات المؤشر بالاسم (بأي صيغة كتابة)؛ الاسم غير المسجّل يأخذ قيماً افتراضية."""
+        meta = self.by_key.get(normalize_key(name))
+        return meta if meta is not None else _unknown_meta(name)
+
+    def __len__(self):
+        return len(self.by_key)
+
+
+def _col(df, name):
+    return df[name].astype(str).to_numpy() if name in df.columns else np.full(len(df), "", dtype=object)
+
+
+def _build_catalog(df_kpi: pd.DataFrame) -> KpiCatalog:
+    names = np.array([s.strip() for s in _col(df_kpi, "KPI_Name")], dtype=object)
+    if key_column("KPI_Name") in df_kpi.columns:
+        keys = df_kpi[key_column("KPI_Name")].astype(str).to_numpy()
+    else:
+        keys = np.array([normalize_key(n) for n in names], dtype=object)
+    units = np.array([s.strip() for s in _col(df_kpi, "Unit")], dtype=object)
+    infos = [unit_info(u) for u in units]
+    # عمود Frequency المنفصل (إن وُجد) مقدَّم على التكرار المدمج في Unit
+    freq_col = _col(df_kpi, "Frequency")
+    columns = {
+        "name":          names,
+        "category":      np.array([_KPI_GROUP_INDEX.get(k, OTHER_CATEGORY) for k in keys], dtype=object),
+        "unit_type":     np.array([i[0] for i in infos], dtype=object),
+        "frequency":     np.array([f.strip() or i[1] for f, i in zip(freq_col, infos)], dtype=object),
+        "is_percentage": np.array([i[2] for i in infos], dtype=bool),
+        "direction":     np.array([Direction.parse(d) for d in _col(df_kpi, "Direction")], dtype=object),
+    }
+    by_key = {}
+    for i, k in enumerate(keys):
+        if k not in by_key:
+            by_key[k] = KpiMeta(names[i], columns["category"][i], units[i], columns["unit_type"][i],
+                                columns["frequency"][i], bool(columns["is_percentage"][i]),
+                                columns["direction"][i])
+    return KpiCatalog(by_key, columns)
+
+
+def kpi_catalog(df_kpi: pd.DataFrame) -> KpiCatalog:
+    """سجل مؤشرات الإطار — يُبنى مرة لكل إصدار من ورقة KPIs ويُشارك بين الجلسات (للقراءة فقط)."""
+    if df_kpi is None:
+        df_kpi = pd.DataFrame()
+    return versioned_result("kpi_catalog", df_kpi, (rows_fingerprint(df_kpi),),
+                            lambda: _build_catalog(df_kpi))
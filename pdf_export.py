@@ -34,6 +34,8 @@ from reportlab.platypus import (
 )
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_RIGHT, TA_LEFT
+from data_store import to_date_series, to_int_series, frame_view
+from kpi_catalog import kpi_catalog, format_value
 
 
 # ──────────────────────────────────────────────────────────
@@ -62,6 +64,18 @@ def _fig_to_html_div(fig: go.Figure, height: int = 350) -> str:
     )
 
 
+def _kpi_display_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """المستهدف والمتحقق منسّقان بمنسّق كل مؤشر في kpi_catalog (النسب مع %)، والاتجاه موحّد."""
+    cat = kpi_catalog(df)
+    out = df.astype({c: object for c in ("Target", "Actual", "Direction") if c in df.columns})
+    for c in ("Target", "Actual"):
+        if c in out.columns:
+            out[c] = [format_value(v, p) for v, p in zip(df[c], cat.columns["is_percentage"])]
+    if "Direction" in out.columns:
+        out["Direction"] = [d.value for d in cat.columns["direction"]]
+    return out
+
+
 def _df_to_html_table(df: pd.DataFrame, rtl: bool = True) -> str:
     """يحوّل DataFrame إلى جدول HTML مُنسَّق."""
     dir_attr = 'dir="rtl"' if rtl else ''
@@ -568,20 +582,12 @@ def build_pdf_report(
                         if c in df_kpis.columns]
         col_labels   = {"KPI_Name":"المؤشر","Target":"المستهدف","Actual":"المتحقق",
                         "Unit":"الوحدة","Direction":"الاتجاه","Owner":"المسؤول"}
-        df_show = df_kpis[cols_to_show].copy()
+        df_show = _kpi_display_frame(df_kpis[cols_to_show])
 
         header = [col_labels.get(c, c) for c in cols_to_show]
         rows   = [header]
         for _, r in df_show.iterrows():
-            row = []
-            for c in cols_to_show:
-                v = r[c]
-                # اجعل الأرقام مقروءة
-                if c in ("Target","Actual"):
-                    try: v = f"{float(v):.1f}"
-                    except: pass
-                row.append(str(v)[:40])   # اقطع النص الطويل
-            rows.append(row)
+            rows.append([str(r[c])[:40] for c in cols_to_show])   # اقطع النص الطويل
 
         # عرض الأعمدة
         name_w = 5.5*cm
@@ -672,16 +678,16 @@ def show_export_section(
     st.markdown("---")
 
     # ── حساب الملخص ──
-    today_dt   = __import__('datetime').date.today()
-    df_acts_cp = df_acts.copy()
-    df_acts_cp['_end'] = __import__('pandas').to_datetime(
-        df_acts_cp.get('End_Date',''), errors='coerce').dt.date
-    df_acts_cp['Progress'] = df_acts_cp['Progress'].apply(
-        lambda x: int(float(str(x).replace('%','') or 0)))
+    # الأنشطة المحمّلة عبر load_sheet_frame تحمل _end و Progress محوّلين مسبقاً
+    today_ts   = pd.Timestamp(datetime.now().date())
+    df_acts_cp = frame_view(df_acts)   # الأعمدة المعدّلة أدناه وحدها تُنسخ
+    if '_end' not in df_acts_cp.columns:
+        df_acts_cp['_end'] = to_date_series(df_acts_cp['End_Date'])
+    df_acts_cp['Progress'] = to_int_series(df_acts_cp['Progress'])
 
     delayed = df_acts_cp[(df_acts_cp['Progress']<100) &
                          (df_acts_cp['_end'].notna()) &
-                         (df_acts_cp['_end'] < today_dt)]
+                         (df_acts_cp['_end'] < today_ts)]
     avg_prog = df_acts_cp['Progress'].mean()
 
     summary = {
@@ -729,7 +735,7 @@ def show_export_section(
                              if c in df_kpi.columns]
                 lbl_map = {"KPI_Name":"المؤشر","Target":"المستهدف","Actual":"المتحقق",
                            "Unit":"الوحدة","Direction":"الاتجاه","Owner":"المسؤول"}
-                df_disp = df_kpi[cols_show].rename(columns=lbl_map)
+                df_disp = _kpi_display_frame(df_kpi[cols_show]).rename(columns=lbl_map)
                 sections.append({"title": "جدول مؤشرات الأداء",
                                  "type": "table", "content": df_disp})
 
@@ -0,0 +1,227 @@
+"""
+replica.py — نسخة قراءة محلية (SQLite) من أوراق Google Sheets لنظام NMCC
+الإصدار: 1.0
+
+المبدأ:
+  - أوراق Activities و KPIs و Operational_KPIs و Users والسجلين التاريخيين تُنسخ إلى ملف SQLite
+    محلي: دورياً مع خيط التحديث في الخلفية، وبعد كل كتابة (الناقل يعلّم الجدول "متسخاً" فتعيد
+    أول قراءة بعدها جلبه من الورقة وتخزينه)
+  - القراءة تذهب للنسخة ما دامت نظيفة وأحدث من REPLICA_MAX_AGE؛ الكتابة تبقى على Sheets وحدها
+  - الورقة تُخزَّن كما تُقرأ (نصوص وأرقام) مع _row وأعمدة المفاتيح المطبّعة (_k_*) المفهرسة —
+    فالتصفية بالمالك أو المبادرة استعلام SQL على فهرس بدل جلب نطاقات من الورقة
+  - الاستبدال ذري: الجدول الجديد يُكتب باسم مؤقت ثم يُعاد تسميته داخل معاملة واحدة، فالقارئ
+    (من أي عملية) يرى النسخة القديمة أو الجديدة كاملة
+  - أعمدة حساسة (كلمة المرور في Users) لا تُنسخ إلى القرص
+  - الملف مشترك بين عمليات الخادم (WAL)؛ تعذّر النسخة لا يوقف شيئاً — تعود القراءة للورقة
+  - ملف لكل مستأجر (مصنّف): الافتراضي REPLICA_PATH نفسه، وغيره replica-<المستأجر>.sqlite بجانبه
+
+الاستخدام في dashboard.py:
+    import replica
+    raw = replica.read("KPIs")                          → None إن لم تكن النسخة صالحة
+    replica.store("KPIs", raw, keys=["KPI_Name", "Owner"])
+    replica.read("Activities", where=("Mabadara", my_list))
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import pandas as pd
+from data_store import SENSITIVE_COLUMNS, normalize_key, normalize_series, key_column
+from tenants import current_tenant, DEFAULT_TENANT
+import sheet_metrics
+
+# فارغ = النسخة معطلة وكل القراءات من الورقة مباشرة
+REPLICA_PATH    = os.environ.get("NMCC_REPLICA_PATH",
+                                 os.path.join(os.environ.get("NMCC_CACHE_DIR", ".nmcc_cache"),
+                                              "replica.sqlite"))
+# حد أمان لتعديلات مباشرة على الورقة لم يلتقطها خيط التحديث
+REPLICA_MAX_AGE = int(os.environ.get("NMCC_REPLICA_MAX_AGE", "600"))
+REPLICA_EXCLUDE = SENSITIVE_COLUMNS
+
+_local = threading.local()
+_stats = {"reads": 0, "misses": 0, "stores": 0, "errors": 0}
+
+
+def enabled() -> bool:
+    return bool(REPLICA_PATH)
+
+
+def replica_path(tenant=None) -> str:
+    tenant = tenant or current_tenant()
+    if tenant == DEFAULT_TENANT:
+        return REPLICA_PATH
+    root, ext = os.path.splitext(REPLICA_PATH)
+    return root + "-" + re.sub(r"[^\w.-]", "_", tenant) + ext
+
+
+def _conn():
+    path  = replica_path()
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS _sync (name TEXT PRIMARY KEY, tbl TEXT,"
+                     " synced_at REAL, dirty INTEGER, nrows INTEGER, columns TEXT)")
+        conns[path] = conn
+    return conn
+
+
+def _q(ident) -> str:
+    return '"' + str(ident).replace('"', '""') + '"'
+
+
+def _meta(name):
+    return _conn().execute("SELECT tbl, synced_at, dirty, nrows, columns FROM _sync WHERE name = ?",
+                           (name,)).fetchone()
+
+
+def _for_sqlite(df: pd.DataFrame) -> pd.DataFrame:
+    """أنواع يقبلها SQLite: التواريخ نص ISO، والفئات قيمها الأصلية."""
+    out = {}
+    for c in df.columns:
+        s = df[c]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            s = s.astype(object)
+        if s.dtype.kind == "M":
+            s = s.dt.strftime("%Y-%m-%d %H:%M:%S").where(s.notna(), None)
+        out[c] = s
+    return pd.DataFrame(out, index=df.index)
+
+
+def store(name, df: pd.DataFrame, keys=(), fetched_at=None) -> bool:
+    """
+    يستبدل نسخة الجدول name بالإطار df (كما قُرئ من الورقة) ويعلّمها نظيفة. fetched_at: وقت بدء
+    الجلب — إن عُلّم الجدول متسخاً بعده (كتابة أثناء الجلب) تُخزَّن الصفوف ويبقى متسخاً.
+    """
+    if not enabled() or df is None:
+        return False
+    df = df.drop(columns=[c for c in REPLICA_EXCLUDE.get(name, ()) if c in df.columns])
+    for col in keys:
+        if col in df.columns and key_column(col) not in df.columns:
+            df = df.assign(**{key_column(col): normalize_series(df[col])})
+    df = _for_sqlite(df)
+    tbl = "r_" + uuid.uuid4().hex[:12]
+    try:
+        conn = _conn()
+        old  = _meta(name)
+        if len(df.columns):
+            df.to_sql(tbl, conn, index=False)
+            for col in keys:
+                if key_column(col) in df.columns:
+                    conn.execute("CREATE INDEX " + _q(tbl + "_" + key_column(col)) + " ON "
+                                 + _q(tbl) + " (" + _q(key_column(col)) + ")")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # dirty = وقت آخر تعليم (0 = نظيف)؛ يُقرأ داخل المعاملة فلا يفوت تعليم متزامن
+            row   = conn.execute("SELECT dirty FROM _sync WHERE name = ?", (name,)).fetchone()
+            dirty = row[0] if row and row[0] and fetched_at is not None and row[0] >= fetched_at else 0
+            conn.execute("INSERT OR REPLACE INTO _sync VALUES (?, ?, ?, ?, ?, ?)",
+                         (name, tbl, time.time(), dirty, len(df), json.dumps([str(c) for c in df.columns])))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if old and old[0]:
+            conn.execute("DROP TABLE IF EXISTS " + _q(old[0]))
+        _stats["stores"] += 1
+        return True
+    except (sqlite3.Error, ValueError):
+        _stats["errors"] += 1
+        return False
+
+
+def is_fresh(name) -> bool:
+    if not enabled():
+        return False
+    try:
+        m = _meta(name)
+    except sqlite3.Error:
+        return False
+    return bool(m) and not m[2] and time.time() - m[1] <= REPLICA_MAX_AGE
+
+
+def read(name, columns=None, where=None):
+    """
+    الجدول name من النسخة المحلية إن كانت صالحة، وإلا None (فيقرأ المستدعي من الورقة).
+    columns: الأعمدة المطلوبة (الموجود منها + _row)؛ where: (عمود مفتاح، قيم) تُطابق بالمفتاح المطبّع.
+    """
+    if not is_fresh(name):
+        _stats["misses"] += 1
+        sheet_metrics.cache_event("replica", name, False)
+        return None
+    try:
+        tbl, _, _, _, cols = _meta(name)
+        cols = json.loads(cols)
+        if not cols:
+            return pd.DataFrame()
+        pick = cols if columns is None else [c for c in list(columns) + ["_row"] if c in cols]
+        sql  = "SELECT " + ", ".join(_q(c) for c in pick) + " FROM " + _q(tbl)
+        args = []
+        if where is not None:
+            col, values = where
+            if key_column(col) not in cols:
+                _stats["misses"] += 1
+                sheet_metrics.cache_event("replica", name, False)
+                return None
+            args = sorted({normalize_key(v) for v in values})
+            sql += (" WHERE " + _q(key_column(col)) + " IN (" + ", ".join("?" * len(args)) + ")"
+                    if args else " WHERE 0")
+        if "_row" in pick:
+            sql += " ORDER BY " + _q("_row")
+        df = pd.read_sql_query(sql, _conn(), params=args)
+        _stats["reads"] += 1
+        sheet_metrics.cache_event("replica", name, True)
+        return df
+    except (sqlite3.Error, ValueError, pd.errors.DatabaseError):
+        _stats["errors"] += 1
+        return None
+
+
+def query(sql, params=()):
+    """استعلام SQL للقراءة (تجميع على مستوى القاعدة). أسماء الجداول من table_name()."""
+    return pd.read_sql_query(sql, _conn(), params=list(params))
+
+
+def table_name(name):
+    """اسم جدول SQLite الحالي لنسخة name (مقتبس للاستخدام في query) أو None."""
+    m = _meta(name) if enabled() else None
+    return _q(m[0]) if m else None
+
+
+def mark_dirty(name=None) -> None:
+    """تعليم نسخة الجدول (أو الكل) متسخة بعد كتابة — أول قراءة بعدها تعيد المزامنة."""
+    if not enabled():
+        return
+    try:
+        if name is None:
+            _conn().execute("UPDATE _sync SET dirty = ?", (time.time(),))
+        else:
+            _conn().execute("UPDATE _sync SET dirty = ? WHERE name = ?", (time.time(), name))
+    except sqlite3.Error:
+        _stats["errors"] += 1
+
+
+def status() -> list:
+    """حالة كل جدول منسوخ — للعرض في لوحة التشخيص."""
+    if not enabled():
+        return []
+    try:
+        rows = _conn().execute("SELECT name, synced_at, dirty, nrows FROM _sync ORDER BY name").fetchall()
+    except sqlite3.Error:
+        return []
+    now = time.time()
+    return [{"name": n, "age": now - at, "dirty": bool(d), "rows": r,
+             "fresh": not d and now - at <= REPLICA_MAX_AGE} for n, at, d, r in rows]
+
+
+def stats() -> dict:
+    return dict(_stats)
@@ -0,0 +1,256 @@
+"""
+sheet_metrics.py — قياس طلبات Google Sheets وإصابات المخازن لنظام NMCC
+الإصدار: 1.0
+
+المبدأ:
+  - كل طلب HTTP يرسله gspread يمر بعميل واحد (MeteredHTTPClient) فيُسجَّل: دالة gspread التي
+    أطلقته، والدالة المستدعية من كود النظام، والعملية في واجهة Sheets، والورقة، والبايتات،
+    وزمن الاستجابة، وانتظار ميزانية المستأجر — دون تعديل أي موضع يستدعي gspread
+  - كل طبقة تخزين تسجّل إصابتها أو فقدها (cache_event): المخزن الدافئ، st.cache، النسخة
+    المحلية، خدمة البيانات، ودمج الطلبات المتزامنة
+  - كل تسجيل ينتمي لنطاق: إعادة تشغيل الجلسة (begin_rerun) أو "background" لخيط التحديث؛ خيوط
+    القراءة المتوازية ترث نطاق مستدعيها (data_store.fetch_all)
+  - لكل إعادة تشغيل سجلها الكامل (آخر MAX_SCOPES نطاق)، وللعملية سجل متدحرج بحد أقصى للأحداث
+    مع مجاميع منذ البدء — للوحة التشخيص الخاصة بالمدير
+  - الوحدة لا تستخدم st ولا تعتمد على بقية النظام إلا tenants
+
+الاستخدام في dashboard.py:
+    import sheet_metrics
+    sheet_metrics.begin_rerun()
+    client = gspread.authorize(creds, http_client=sheet_metrics.MeteredHTTPClient)
+    sheet_metrics.cache_event("warm", "KPIs", hit=True)
+"""
+
+import os
+import sys
+import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from urllib.parse import unquote
+import tenants
+
+ROLLING_MAX_EVENTS = int(os.environ.get("NMCC_METRICS_EVENTS", "20000"))
+MAX_SCOPES         = 200
+BACKGROUND         = "background"
+# ملفات النظام التي يُبحث فيها عن الدالة المستدعية (data_store وسيط عام فيُتخطّى)
+_APP_FILES  = {"dashboard.py", "chat_module.py", "sheet_writes.py", "user_directory.py", "pdf_export.py"}
+_SKIP_FUNCS = {"<lambda>", "<listcomp>", "<dictcomp>", "<genexpr>"}
+
+_local   = threading.local()
+_lock    = threading.Lock()
+_events  = deque(maxlen=ROLLING_MAX_EVENTS)
+_scopes  = OrderedDict()   # نطاق → [أحداث]
+_totals  = {}              # (المستأجر، نوع الحدث) → {"calls", "bytes", "ms"}
+_started = time.time()
+
+
+# ──────────────────────────────────────────────
+# النطاقات
+# ──────────────────────────────────────────────
+def current_scope() -> str:
+    return getattr(_local, "scope", BACKGROUND)
+
+
+def set_scope(scope) -> None:
+    _local.scope = scope or BACKGROUND
+
+
+def begin_rerun() -> str:
+    """نطاق جديد لإعادة تشغيل الجلسة في الخيط الحالي؛ يرجع معرّفه."""
+    scope = uuid.uuid4().hex[:10]
+    set_scope(scope)
+    with _lock:
+        _scopes[scope] = []
+        while len(_scopes) > MAX_SCOPES:
+            _scopes.popitem(last=False)
+    return scope
+
+
+def _record(ev: dict) -> None:
+    ev["scope"]  = current_scope()
+    ev["tenant"] = tenants.current_tenant()
+    ev["at"]     = time.time()
+    with _lock:
+        _events.append(ev)
+        lst = _scopes.get(ev["scope"])
+        if lst is not None:
+            lst.append(ev)
+        t = _totals.setdefault((ev["tenant"], ev["kind"]), {"calls": 0, "bytes": 0, "ms": 0.0})
+        t["calls"] += 1
+        t["bytes"] += ev.get("bytes", 0)
+        t["ms"]    += ev.get("ms", 0.0)
+
+
+# ──────────────────────────────────────────────
+# طلبات Sheets
+# ──────────────────────────────────────────────
+def _callers():
+    """(دالة gspread الخارجية، دالة النظام المستدعية) من مكدس الاستدعاء."""
+    method, caller, fallback = "", "", ""
+    f = sys._getframe(2)
+    while f is not None:
+        path = f.f_code.co_filename.replace("\\", "/")
+        if "/gspread/" in path:
+            method = f.f_code.co_name
+        elif os.path.basename(path) in _APP_FILES:
+            name = os.path.basename(path)[:-3] + "." + f.f_code.co_name
+            if f.f_code.co_name not in _SKIP_FUNCS:
+                caller = name
+                break
+            fallback = fallback or name
+        f = f.f_back
+    return method, caller or fallback
+
+
+def _sheet_of(rng) -> str:
+    rng = unquote(str(rng))
+    if "!" not in rng:
+        return rng.strip("'") if rng and ":" not in rng else ""
+    return rng.split("!", 1)[0].strip("'")
+
+
+def _describe(method, endpoint, params, body):
+    """(عملية الواجهة، أسماء الأوراق) من رابط الطلب ومعاملاته."""
+    path = str(endpoint).split("?", 1)[0]
+    if "/spreadsheets/" not in path:
+        return "drive." + method.lower(), []
+    tail   = path.split("/spreadsheets/", 1)[1]
+    tail   = tail[tail.find("/"):] if "/" in tail else tail[tail.find(":"):] if ":" in tail else ""
+    ranges = list((params or {}).get("ranges", []) or [])
+    if isinstance(ranges, str):
+        ranges = [ranges]
+    for item in (body or {}).get("data", []) if isinstance(body, dict) else []:
+        ranges.append(item.get("range", ""))
+    if tail.startswith("/values/"):
+        rng = tail[len("/values/"):]
+        op  = rng.split(":")[-1] if rng.endswith((":append", ":clear")) else ""
+        ranges.append(rng.split(":append")[0].split(":clear")[0])
+        api = "values." + (op or {"get": "get", "put": "update"}.get(method.lower(), method.lower()))
+    elif tail.startswith("/values:"):
+        api = "values." + tail[len("/values:"):]
+    elif tail.startswith(":"):
+        api = "spreadsheets." + tail[1:]
+    elif tail.startswith("/sheets/"):
+        api = "sheets." + tail.rsplit(":", 1)[-1]
+    else:
+        api = "spreadsheets.get"
+    sheets = sorted({s for s in (_sheet_of(r) for r in ranges) if s})
+    return api, sheets
+
+
+class MeteredHTTPClient(tenants.TenantHTTPClient):
+    """عميل gspread يخصم الميزانية (TenantHTTPClient) ويسجّل كل طلب."""
+
+    def send_request(self, waited, method, endpoint, *args, **kwargs):
+        params = kwargs.get("params") if "params" in kwargs else (args[0] if args else None)
+        body   = kwargs.get("json")
+        data   = kwargs.get("data")
+        sent   = len(data) if isinstance(data, (bytes, str)) else len(str(body)) if body else 0
+        start  = time.perf_counter()
+        status, size = 0, 0
+        try:
+            resp   = super().send_request(waited, method, endpoint, *args, **kwargs)
+            status = resp.status_code
+            size   = len(resp.content or b"")
+            return resp
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", -1)
+            raise
+        finally:
+            try:
+                gs_method, caller = _callers()
+                api, sheets = _describe(method, endpoint, params, body)
+                _record({"kind": "call", "method": gs_method or api, "api": api,
+                         "sheet": ", ".join(sheets), "caller": caller, "status": status,
+                         "bytes": size + sent, "ms": (time.perf_counter() - start) * 1000.0,
+                         "wait_ms": waited * 1000.0})
+            except Exception:
+                pass   # القياس لا يُفشل الطلب
+
+
+# ──────────────────────────────────────────────
+# إصابات المخازن
+# ──────────────────────────────────────────────
+def cache_event(layer, name, hit) -> None:
+    """إصابة (hit=True) أو فقد طبقة تخزين layer للجدول أو النتيجة name."""
+    _record({"kind": "cache", "layer": layer, "name": str(name), "hit": bool(hit)})
+
+
+@contextmanager
+def cached_lookup(layer, name):
+    """
+    يحيط باستدعاء دالة مخزّنة (st.cache): جسمها يستدعي cache_miss() إن نُفّذ فعلاً،
+    وإلا تُسجَّل إصابة عند الخروج.
+    """
+    stack = getattr(_local, "lookups", None)
+    if stack is None:
+        stack = _local.lookups = []
+    stack.append([False])
+    try:
+        yield
+    finally:
+        missed = stack.pop()[0]
+        cache_event(layer, name, not missed)
+
+
+def cache_miss() -> None:
+    """يُستدعى من جسم دالة مخزّنة — الاستدعاء المحيط (cached_lookup) فقد."""
+    stack = getattr(_local, "lookups", None)
+    if stack:
+        stack[-1][0] = True
+
+
+# ──────────────────────────────────────────────
+# التقارير
+# ──────────────────────────────────────────────
+def scope_events(scope=None) -> list:
+    with _lock:
+        return list(_scopes.get(scope or current_scope(), []))
+
+
+def rolling_events(seconds, tenant=None) -> list:
+    since  = time.time() - seconds
+    tenant = tenant or tenants.current_tenant()
+    with _lock:
+        return [e for e in _events if e["at"] >= since and e["tenant"] == tenant]
+
+
+def totals(tenant=None) -> dict:
+    """مجاميع منذ بدء العملية للمستأجر: {"call"/"cache": {"calls", "bytes", "ms"}, "since": وقت}."""
+    tenant = tenant or tenants.current_tenant()
+    with _lock:
+        out = {kind: dict(v) for (t, kind), v in _totals.items() if t == tenant}
+    out["since"] = _started
+    return out
+
+
+def summarize_calls(events) -> list:
+    """صف لكل (الدالة المستدعية، دالة gspread، الورقة): العدد والبايتات والزمن."""
+    groups = {}
+    for e in events:
+        if e["kind"] != "call":
+            continue
+        g = groups.setdefault((e["caller"], e["method"], e["api"], e["sheet"]),
+                              {"calls": 0, "bytes": 0, "ms": 0.0, "max_ms": 0.0, "wait_ms": 0.0, "errors": 0})
+        g["calls"]   += 1
+        g["bytes"]   += e["bytes"]
+        g["ms"]      += e["ms"]
+        g["max_ms"]   = max(g["max_ms"], e["ms"])
+        g["wait_ms"] += e["wait_ms"]
+        g["errors"]  += 1 if not 200 <= e["status"] < 300 else 0
+    rows = [{"caller": k[0], "method": k[1], "api": k[2], "sheet": k[3], **v} for k, v in groups.items()]
+    return sorted(rows, key=lambda r: (-r["calls"], -r["ms"]))
+
+
+def summarize_cache(events) -> list:
+    """صف لكل (الطبقة، الاسم): الإصابات والفقد."""
+    groups = {}
+    for e in events:
+        if e["kind"] != "cache":
+            continue
+        g = groups.setdefault((e["layer"], e["name"]), {"hits": 0, "misses": 0})
+        g["hits" if e["hit"] else "misses"] += 1
+    return sorted(({"layer": k[0], "name": k[1], **v} for k, v in groups.items()),
+                  key=lambda r: (r["layer"], r["name"]))
@@ -0,0 +1,222 @@
+"""
+sheet_writes.py — الكتابة على مستوى الخلية مع تحكم تفاؤلي بالتزامن لنظام NMCC
+الإصدار: 1.0
+
+المبدأ:
+  - لا تُعاد كتابة الورقة كاملة: كل حفظ يكتب خلايا الصفوف المعدّلة فقط بطلب update_cells واحد
+  - كل صف في Activities و KPIs و Operational_KPIs يحمل رقم نسخة (Row_Version) يُرفع مع كل كتابة
+  - الحفظ يحمل الصف كما حُمّل (base): إن بقي رقم نسخته كما هو يُكتب مباشرة، وإن تغيّر يُدمج
+    التعديل خلية خلية — يُقبل ما لم يلمسه الطرف الآخر ويُرفض الصف عند تعارض حقيقي على نفس الخلية
+  - الصفوف المطلوب التحقق منها تُقرأ مع الرأس بطلب batch_get واحد، فلا حاجة لقراءة الورقة
+    كاملة قبل الكتابة
+  - Google Sheets لا يدعم الكتابة المشروطة، فالتحقق والكتابة طلبان متتاليان؛ نافذة السباق
+    بينهما تُقاس بأجزاء الثانية بدل مدة بقاء الصفحة مفتوحة
+  - أخطاء الحصة والخادم المؤقتة تُعاد المحاولة لها كاملة (قراءة + تحقق + كتابة)
+  - تحديثات المالك ورسائله تختم الصف بوقت آخر تحديث (Last_Updated) عبر stamp_updated
+  - عند تشغيل خدمة البيانات المشتركة (data_service) تُرسل الكتابة إليها فتنفّذها على اتصالها؛
+    لذلك الإلحاق بالخلية قيمة Append قابلة للإرسال بدل دالة
+
+الاستخدام في dashboard.py:
+    from sheet_writes import RowEdit, write_cell_diffs, update_row_cells
+    rejected = write_cell_diffs(ws, [RowEdit(row["_row"], {"Actual": 90},
+                                             {"KPI_Name": name}, base=row)])
+"""
+
+import re
+import time
+from datetime import datetime
+from typing import NamedTuple
+import gspread
+import pandas as pd
+from data_store import normalize_key, ROW_VERSION_COL, VERSIONED_TABLES, LAST_UPDATED_COL
+import data_service
+
+WRITE_RETRIES   = 2
+_TRANSIENT_CODE = (429, 500, 502, 503)
+
+
+class RowEdit(NamedTuple):
+    """
+    row    : رقم الصف في الورقة (العمود _row في الإطارات المحمّلة)
+    updates: {عمود: قيمة}؛ القيمة الدالة تستقبل القيمة الحالية للخلية (إلحاق تعليق)
+    expect : {عمود: قيمة} يجب أن تطابق الصف الحالي دائماً (هوية الصف ومدخلات القيم المحسوبة)
+    base   : الصف كما حُمّل (Series/dict) — يفعّل فحص رقم النسخة والدمج
+    """
+    row:     int
+    updates: dict
+    expect:  dict = None
+    base:    object = None
+
+
+class Append(NamedTuple):
+    """قيمة تحديث تُلحق entry بالقيمة الحالية للخلية (بالفاصل sep إن لم تكن فارغة)."""
+    entry: str
+    sep:   str = "\n"
+
+    def __call__(self, cur):
+        cur = "" if cur is None else str(cur)
+        if not str(self.entry).strip():
+            return cur
+        return cur + self.sep + self.entry if cur.strip() else self.entry
+
+
+def cell_matches(current, expected):
+    """تطابق قيمة الخلية في الورقة مع القيمة المتوقعة من الإطار المحمّل (85 = "85" = "85.0")."""
+    if expected is None or (not isinstance(expected, str) and pd.isna(expected)):
+        expected = ""
+    a, b = str(current).strip(), str(expected).strip()
+    if a == b:
+        return True
+    try:
+        return float(a.replace(",", "")) == float(b.replace(",", ""))
+    except ValueError:
+        return normalize_key(a) == normalize_key(b)
+
+
+def stamp_updated(updates: dict) -> dict:
+    """التحديثات نفسها مع ختم Last_Updated بالوقت الحالي (بصيغة طوابع التعليقات)."""
+    return {**updates, LAST_UPDATED_COL: datetime.now().strftime("%Y-%m-%d %H:%M")}
+
+
+def row_version(value) -> int:
+    """رقم نسخة الصف من الخلية أو الإطار (الفارغ = 0 لصفوف ما قبل العمود)."""
+    try:
+        return int(float(str(value).strip() or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _base_get(base, col):
+    if base is None:
+        return None
+    try:
+        return base.get(col)
+    except AttributeError:
+        return None
+
+
+def _merge_clash(edit, current):
+    """أعمدة يكتبها هذا الحفظ وغيّرها طرف آخر منذ التحميل إلى قيمة مختلفة."""
+    clash = []
+    for col, val in edit.updates.items():
+        if callable(val):
+            continue
+        before, now = _base_get(edit.base, col), current.get(col, "")
+        if before is not None and not cell_matches(now, before) and not cell_matches(now, val):
+            clash.append(col)
+    return clash
+
+
+def _write_once(ws, edits, header):
+    versioned = ws.title in VERSIONED_TABLES
+    reads = list(dict.fromkeys(
+        e.row for e in edits
+        if versioned or e.expect or e.base is not None or any(callable(v) for v in e.updates.values())
+    ))
+    ranges = ([] if header else ["1:1"]) + [str(r) + ":" + str(r) for r in reads]
+    got    = ws.batch_get(ranges) if ranges else []
+    if not header:
+        header = got[0][0] if got and got[0] else []
+        got    = got[1:]
+    header = list(header)
+    rows   = {r: (vr[0] if vr else []) for r, vr in zip(reads, got)}
+    cells, rejected, bumped = [], [], {}
+
+    def put(row_num, col_name, val):
+        if col_name not in header:
+            header.append(col_name)
+            cells.append(gspread.Cell(1, len(header), col_name))
+        cells.append(gspread.Cell(row_num, header.index(col_name) + 1, val))
+
+    for edit in edits:
+        vals    = rows.get(edit.row, [])
+        current = {h: (vals[i] if i < len(vals) else "") for i, h in enumerate(header)}
+        if any(not cell_matches(current.get(c, ""), v) for c, v in (edit.expect or {}).items()):
+            rejected.append(edit.row)
+            continue
+        cur_v = bumped.get(edit.row, row_version(current.get(ROW_VERSION_COL, "")))
+        if edit.base is not None and edit.row not in bumped:
+            # رقم النسخة تغيّر منذ التحميل → دمج على مستوى الخلية بدل الرفض الكامل
+            if cur_v != row_version(_base_get(edit.base, ROW_VERSION_COL)) and _merge_clash(edit, current):
+                rejected.append(edit.row)
+                continue
+        for col_name, val in edit.updates.items():
+            put(edit.row, col_name, val(current.get(col_name, "")) if callable(val) else val)
+        if versioned:
+            bumped[edit.row] = cur_v + 1
+            put(edit.row, ROW_VERSION_COL, cur_v + 1)
+    if cells:
+        ws.update_cells(cells)
+    return rejected
+
+
+def write_cell_diffs(ws, edits, header=None, retries=WRITE_RETRIES):
+    """
+    كتابة فروق الخلايا لعدة صفوف: قراءة واحدة (batch_get) للرأس والصفوف المطلوب فحصها،
+    ثم كتابة واحدة (update_cells). edits: RowEdit أو (صف، تحديثات، توقعات[، base]).
+    الصف المرفوض (تغيّرت هويته أو تعارض تعديله مع تعديل أحدث) لا يُكتب شيء منه.
+    ترجع أرقام الصفوف المرفوضة.
+    """
+    edits = [RowEdit(int(e[0]), *e[1:]) for e in edits]
+    edits = [e for e in edits if e.updates]
+    if data_service.enabled():
+        try:
+            return data_service.mutate(ws.title, edits, header)
+        except (data_service.ServiceUnavailable, TypeError):
+            pass   # الخدمة متوقفة أو تحديث غير قابل للإرسال → كتابة مباشرة بنفس الدلالة
+    for attempt in range(retries + 1):
+        try:
+            return _write_once(ws, edits, header)
+        except gspread.exceptions.APIError as e:
+            code = getattr(getattr(e, "response", None), "status_code", None)
+            if code not in _TRANSIENT_CODE or attempt == retries:
+                raise
+            time.sleep(1.5 * (attempt + 1))
+
+
+def update_row_cells(ws, row_num, updates, expect=None, header=None, base=None):
+    """تحديث خلايا صف واحد معروف الرقم — write_cell_diffs لصف. يرجع False إن رُفض الصف."""
+    return not write_cell_diffs(ws, [RowEdit(row_num, updates, expect, base)], header)
+
+
+# ──────────────────────────────────────────────
+# تعبئة Last_Updated للصفوف القائمة (مرة واحدة)
+# ──────────────────────────────────────────────
+# طابع رأس الرسالة فقط ("📅 YYYY-MM-DD HH:MM") — لا أي تاريخ مكتوب داخل نص الرسالة
+_ENTRY_STAMP = re.compile(r"📅\s*(\d{4}-\d{2}-\d{2}(?: \d{2}:\d{2})?)")
+
+
+def last_comment_stamp(text) -> str:
+    """أحدث طابع رسالة في نص تعليق ("" إن لم يوجد)."""
+    return max(_ENTRY_STAMP.findall(str(text or "")), default="")
+
+
+def backfill_last_updated(sh, sheets=("Activities", "KPIs"), source_col="Owner_Comment"):
+    """
+    يملأ Last_Updated الفارغ من أحدث طابع رسالة في تعليق المالك — قراءة واحدة وكتابة واحدة
+    لكل ورقة. الخلايا المعبأة لا تُمس، فإعادة التشغيل آمنة. يرجع {الورقة: عدد الصفوف المعبأة}.
+    """
+    filled = {}
+    for name in sheets:
+        ws   = sh.worksheet(name)
+        vals = ws.get_all_values()
+        if not vals or source_col not in vals[0]:
+            continue
+        header = list(vals[0])
+        src    = header.index(source_col)
+        cells  = []
+        if LAST_UPDATED_COL not in header:
+            header.append(LAST_UPDATED_COL)
+            cells.append(gspread.Cell(1, len(header), LAST_UPDATED_COL))
+        dst = header.index(LAST_UPDATED_COL)
+        for i, row in enumerate(vals[1:], start=2):
+            if dst < len(row) and str(row[dst]).strip():
+                continue
+            stamp = last_comment_stamp(row[src] if src < len(row) else "")
+            if stamp:
+                cells.append(gspread.Cell(i, dst + 1, stamp))
+        n = sum(1 for c in cells if c.row > 1)
+        if n:
+            ws.update_cells(cells)
+        filled[name] = n
+    return filled
@@ -0,0 +1,206 @@
+"""
+tenants.py — تعدد المصنّفات (المستأجرين) في عملية واحدة لنظام NMCC
+الإصدار: 1.0
+
+المبدأ:
+  - كل مصنّف Google Sheets (إدارة أو سنة مالية) مستأجر له معرّف قصير؛ السجل من NMCC_TENANTS
+    (JSON أو مسار ملف JSON: {"id": {"sheet_id": "...", "title": "..."}}) والمصنّف الافتراضي دائماً
+  - المستأجر الحالي سياق للخيط (use_tenant): تضبطه الجلسة في بداية كل إعادة تشغيل، ويرثه خيط
+    التحديث وخيوط القراءة المتوازية — فتُفصل به إصدارات data_store ومخزنها الدافئ ودمج طلباتها
+    ونسخها المحلية دون تمرير معامل في كل دالة
+  - كل المستأجرين يكتبون بحساب خدمة واحد فحصّته للعملية كلها: كل طلب يُخصم من دلو العملية
+    (الحصة كاملة) ومن دلو مستأجره (الحصة مقسومة على المستأجرين النشطين) على مستوى اتصال gspread
+    (TenantHTTPClient) — مصنّف مزدحم ينتظر دوره ولا يستهلك حصة المصنّفات الأخرى
+  - آخر استخدام لكل مستأجر يُسجَّل (touch) — أساس إخلاء المستأجرين الخاملين في data_store
+
+الاستخدام في dashboard.py:
+    import tenants
+    tenants.use_tenant(st.session_state["tenant"])
+    client = gspread.authorize(creds, http_client=tenants.TenantHTTPClient)
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+import gspread
+
+DEFAULT_TENANT = "default"
+# حصة Sheets لكل مستخدم خدمة 60 طلباً في الدقيقة لكل نوع — تُقسَم على المستأجرين النشطين
+READS_PER_MINUTE  = int(os.environ.get("NMCC_TENANT_READS_PER_MIN", "60"))
+WRITES_PER_MINUTE = int(os.environ.get("NMCC_TENANT_WRITES_PER_MIN", "60"))
+# مستأجر استُخدم خلالها يُعدّ نشطاً في قسمة الحصة
+ACTIVE_SECONDS    = 300
+# أقصى انتظار لدور في الميزانية؛ بعده يُرسل الطلب وتتكفّل إعادة المحاولة عند 429 بالباقي
+BUDGET_MAX_WAIT   = float(os.environ.get("NMCC_TENANT_BUDGET_WAIT", "20"))
+
+_local    = threading.local()
+_registry = {}
+_seen     = {}          # مستأجر → آخر استخدام (time.time)
+_lock     = threading.Lock()
+
+
+# ──────────────────────────────────────────────
+# السجل
+# ──────────────────────────────────────────────
+def configure(default_sheet_id, default_title="المصنّف الرئيسي") -> dict:
+    """يبني السجل من المصنّف الافتراضي و NMCC_TENANTS (مرة لكل عملية؛ الاستدعاءات اللاحقة تعيده)."""
+    with _lock:
+        if _registry:
+            return _registry
+        reg = {DEFAULT_TENANT: {"sheet_id": default_sheet_id, "title": default_title}}
+        raw = os.environ.get("NMCC_TENANTS", "").strip()
+        if raw:
+            if not raw.startswith("{"):
+                with open(raw, encoding="utf-8") as f:
+                    raw = f.read()
+            for tid, conf in json.loads(raw).items():
+                if isinstance(conf, str):
+                    conf = {"sheet_id": conf}
+                reg[str(tid)] = {"sheet_id": conf["sheet_id"], "title": conf.get("title", str(tid))}
+        _registry.update(reg)
+        return _registry
+
+
+def tenant_ids() -> list:
+    return list(_registry) or [DEFAULT_TENANT]
+
+
+def tenant_title(tenant=None) -> str:
+    tenant = tenant or current_tenant()
+    return _registry.get(tenant, {}).get("title", tenant)
+
+
+def sheet_id(tenant=None) -> str:
+    """معرّف المصنّف للمستأجر (الحالي افتراضياً)."""
+    tenant = tenant or current_tenant()
+    if tenant not in _registry:
+        raise KeyError("مستأجر غير معروف: " + str(tenant))
+    return _registry[tenant]["sheet_id"]
+
+
+# ──────────────────────────────────────────────
+# المستأجر الحالي
+# ──────────────────────────────────────────────
+def current_tenant() -> str:
+    return getattr(_local, "tenant", DEFAULT_TENANT)
+
+
+def set_tenant(tenant) -> None:
+    """يضبط مستأجر الخيط الحالي (بداية إعادة تشغيل الجلسة أو خيط يعمل لمستأجر واحد)."""
+    _local.tenant = tenant or DEFAULT_TENANT
+
+
+@contextmanager
+def use_tenant(tenant):
+    prev = current_tenant()
+    set_tenant(tenant)
+    try:
+        yield
+    finally:
+        set_tenant(prev)
+
+
+def touch(tenant=None) -> None:
+    """يسجّل استخدام المستأجر الآن (كل إعادة تشغيل لجلسة عليه)."""
+    _seen[tenant or current_tenant()] = time.time()
+
+
+def last_seen(tenant) -> float:
+    return _seen.get(tenant, 0.0)
+
+
+# ──────────────────────────────────────────────
+# ميزانية الطلبات لكل مستأجر
+# ──────────────────────────────────────────────
+class _Bucket:
+    """دلو رموز: rate طلب في الدقيقة، يمتلئ تدريجياً حتى rate (فيسمح بدفعة بعد خمول)."""
+
+    def __init__(self, rate):
+        self.rate   = max(1, rate)
+        self.tokens = float(self.rate)
+        self.at     = time.monotonic()
+        self.waited = 0.0
+        self.calls  = 0
+        self.lock   = threading.Lock()
+
+    def set_rate(self, rate) -> None:
+        with self.lock:
+            self.rate   = max(1, rate)
+            self.tokens = min(self.tokens, self.rate)
+
+    def take(self, max_wait) -> float:
+        start    = time.monotonic()
+        deadline = start + max_wait
+        while True:
+            with self.lock:
+                now         = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.at) * self.rate / 60.0)
+                self.at     = now
+                if self.tokens >= 1 or now >= deadline:
+                    self.tokens -= 1
+                    self.calls  += 1
+                    return now - start
+                wait = min((1 - self.tokens) * 60.0 / self.rate, deadline - now)
+                self.waited += wait
+            time.sleep(wait)
+
+
+_buckets = {}   # (مستأجر، نوع) → دلو
+_process = {}   # نوع → دلو العملية (حصة حساب الخدمة)
+
+
+def _quota(kind) -> int:
+    return READS_PER_MINUTE if kind == "read" else WRITES_PER_MINUTE
+
+
+def active_tenants(tenant=None) -> int:
+    """عدد المستأجرين المستخدمين خلال ACTIVE_SECONDS (مع tenant دائماً)."""
+    since = time.time() - ACTIVE_SECONDS
+    return len({t for t, at in list(_seen.items()) if at >= since} | {tenant or current_tenant()})
+
+
+def spend(kind, tenant=None) -> float:
+    """
+    يحجز طلباً (kind: "read" أو "write") من ميزانية المستأجر ثم من ميزانية العملية، وينتظر إن
+    نفدت إحداهما. يرجع ثواني الانتظار.
+    """
+    tenant = tenant or current_tenant()
+    b = _buckets.get((tenant, kind))
+    g = _process.get(kind)
+    if b is None or g is None:
+        with _lock:
+            b = _buckets.setdefault((tenant, kind), _Bucket(_quota(kind)))
+            g = _process.setdefault(kind, _Bucket(_quota(kind)))
+    b.set_rate(_quota(kind) // active_tenants(tenant))
+    waited = b.take(BUDGET_MAX_WAIT)
+    return waited + g.take(max(0.0, BUDGET_MAX_WAIT - waited))
+
+
+def budget_stats() -> dict:
+    """{مستأجر: {نوع: {"calls", "waited", "tokens", "rate"}}} — للوحة التشخيص؛ العملية تحت "*"."""
+    out = {}
+    for (tenant, kind), b in list(_buckets.items()) + [(("*", k), b) for k, b in list(_process.items())]:
+        out.setdefault(tenant, {})[kind] = {"calls": b.calls, "waited": round(b.waited, 1),
+                                            "tokens": round(b.tokens, 1), "rate": b.rate}
+    return out
+
+
+class TenantHTTPClient(gspread.HTTPClient):
+    """
+    عميل HTTP لـ gspread يخصم كل طلب من ميزانية المستأجر الذي فُتح له الاتصال (لا مستأجر
+    الخيط المستدعي — فالاتصال المشترك بين خيوط القراءة يُحسب على مصنّفه دائماً).
+    """
+
+    def __init__(self, auth, session=None):
+        super().__init__(auth, session)
+        self.tenant = current_tenant()
+
+    def request(self, method, endpoint, *args, **kwargs):
+        waited = spend("read" if str(method).lower() == "get" else "write", self.tenant)
+        return self.send_request(waited, method, endpoint, *args, **kwargs)
+
+    def send_request(self, waited, method, endpoint, *args, **kwargs):
+        """الطلب نفسه بعد حجز الميزانية (waited: ثواني الانتظار) — نقطة امتداد للقياس."""
+        return gspread.HTTPClient.request(self, method, endpoint, *args, **kwargs)
@@ -0,0 +1,220 @@
+"""
+user_directory.py — دليل المستخدمين المخزّن والتحقق المحلي من كلمات المرور لنظام NMCC
+الإصدار: 1.0
+
+المبدأ:
+  - ورقة Users تُقرأ مرة لكل دورة تحديث في الخلفية (أو عند أول دخول) وتُبنى منها خريطة
+    {اسم مستخدم مطبّع: سجل} لكل مستأجر — الدخول بحث في قاموس دون أي طلب للورقة
+  - لا تبقى كلمة مرور نصية في الذاكرة: العمود password_hash (pbkdf2_sha256$تكرارات$ملح$بصمة)
+    يُستخدم كما هو، والصف الذي فيه كلمة مرور نصية (لم يُرحَّل أو أعاد المدير تعيينها) تُحسب له
+    بصمة بملح عشوائي وبنفس HASH_ITERATIONS مرة لكل عملية، ويُعاد استخدامها مع كل تحميل ما دامت
+    الكلمة لم تتغير — فكل الإدخالات والبصمة الوهمية للاسم غير الموجود بنفس الكلفة ولا يكشف
+    زمن الرد وجود الاسم
+  - migrate_password_hashes ينقل الورقة نفسها إلى البصمات (ويفرغ العمود النصي) مرة واحدة
+  - المحاولات الخاطئة تُعدّ لكل مستخدم داخل العملية: بعد MAX_FAILURES خلال FAILURE_WINDOW يُقفل
+    الدخول مدة تتضاعف مع كل محاولة إضافية — الرفض يتم قبل التحقق ودون أي طلب شبكة
+  - اسم غير موجود يعيد تحميل الدليل مرة على الأكثر كل RELOAD_MIN_SECONDS (مستخدم أُضيف للتو)،
+    فلا تتحول محاولات أسماء عشوائية إلى قراءات للورقة
+
+الاستخدام في dashboard.py:
+    import user_directory
+    user_directory.refresh(records)                         → من خيط التحديث
+    ok, profile, msg = user_directory.authenticate(username, password, load)
+"""
+
+import os
+import hmac
+import time
+import hashlib
+import secrets
+import threading
+import gspread
+from data_store import SENSITIVE_COLUMNS, normalize_key
+from tenants import current_tenant
+
+# نفس الأعمدة التي تُستبعد من النسخة المحلية وخدمة البيانات
+PLAIN_COL, HASH_COL = SENSITIVE_COLUMNS["Users"]
+HASH_ITERATIONS = int(os.environ.get("NMCC_PASSWORD_ITERATIONS", "200000"))
+DIRECTORY_MAX_AGE   = int(os.environ.get("NMCC_USERS_MAX_AGE", "600"))
+RELOAD_MIN_SECONDS  = 30
+MAX_FAILURES        = 5
+FAILURE_WINDOW      = 15 * 60
+LOCKOUT_SECONDS     = 30
+LOCKOUT_MAX_SECONDS = 15 * 60
+
+_dirs      = {}   # مستأجر → {"users": {مفتاح: سجل}, "at": وقت التحميل}
+_failures  = {}   # (مستأجر، مفتاح) → [أوقات المحاولات الخاطئة]
+_lock      = threading.Lock()
+_reloaded  = {}   # مستأجر → آخر إعادة تحميل بسبب اسم غير موجود
+# بصمات كلمات المرور النصية: (مستأجر، مفتاح) → (HMAC الكلمة بمفتاح العملية، بصمة pbkdf2).
+# الـ HMAC يكشف تغيّر الكلمة في الورقة دون الاحتفاظ بها
+_plain_hashes = {}
+_PLAIN_KEY    = secrets.token_bytes(32)
+
+
+# ──────────────────────────────────────────────
+# البصمات
+# ──────────────────────────────────────────────
+def hash_password(password, iterations=HASH_ITERATIONS, salt=None) -> str:
+    salt   = salt or secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", str(password).encode("utf-8"), bytes.fromhex(salt), iterations)
+    return "pbkdf2_sha256$" + str(iterations) + "$" + salt + "$" + digest.hex()
+
+
+def verify_password(password, stored) -> bool:
+    try:
+        algo, iterations, salt, digest = str(stored).split("$")
+        if algo != "pbkdf2_sha256":
+            return False
+        calc = hash_password(password, int(iterations), salt).rsplit("$", 1)[1]
+    except ValueError:
+        return False
+    return hmac.compare_digest(calc, digest)
+
+
+# بصمة لا تطابق شيئاً — يُتحقق منها للاسم غير الموجود بعدد تكرارات كل الإدخالات فيتساوى زمن الرد
+_DUMMY_HASH = hash_password(secrets.token_hex(8), HASH_ITERATIONS)
+
+
+def _hash_plain(key, plain, previous) -> str:
+    """بصمة كلمة مرور نصية من صف غير مرحّل — من التحميل السابق إن لم تتغير الكلمة."""
+    tag = hmac.new(_PLAIN_KEY, plain.encode("utf-8"), hashlib.sha256).digest()
+    hit = previous.get(key)
+    if hit is None or not hmac.compare_digest(hit[0], tag):
+        hit = (tag, hash_password(plain))
+    _plain_hashes[(current_tenant(), key)] = hit
+    return hit[1]
+
+
+# ──────────────────────────────────────────────
+# الدليل
+# ──────────────────────────────────────────────
+def _build(records) -> dict:
+    tenant   = current_tenant()
+    previous = {k: _plain_hashes.pop((t, k)) for (t, k) in list(_plain_hashes) if t == tenant}
+    users    = {}
+    for rec in records:
+        name = str(rec.get("username", "")).strip()
+        if not name:
+            continue
+        stored = str(rec.get(HASH_COL, "") or "").strip()
+        plain  = str(rec.get(PLAIN_COL, "") or "")
+        if plain.strip():
+            # كلمة نصية بجانب بصمة = إعادة تعيين كتبها المدير في الورقة بعد الترحيل
+            stored = _hash_plain(normalize_key(name), plain, previous)
+        profile = {k: v for k, v in rec.items() if k not in (PLAIN_COL, HASH_COL)}
+        profile["username"] = name
+        users[normalize_key(name)] = {"hash": stored, "profile": profile}
+    return users
+
+
+def refresh(records) -> int:
+    """يستبدل دليل المستأجر الحالي بسجلات ورقة Users (get_all_records). يرجع عدد المستخدمين."""
+    users = _build(records)
+    _dirs[current_tenant()] = {"users": users, "at": time.time()}
+    return len(users)
+
+
+def invalidate() -> None:
+    """يُسقط دليل المستأجر الحالي (بعد كتابة على ورقة Users) — أول دخول بعده يعيد التحميل."""
+    _dirs.pop(current_tenant(), None)
+
+
+def _directory(load, force=False) -> dict:
+    entry = _dirs.get(current_tenant())
+    if force or entry is None or time.time() - entry["at"] > DIRECTORY_MAX_AGE:
+        refresh(load())
+        entry = _dirs[current_tenant()]
+    return entry["users"]
+
+
+def directory_stats() -> dict:
+    entry = _dirs.get(current_tenant())
+    now   = time.time()
+    locked = sum(1 for (t, k) in list(_failures) if t == current_tenant() and lockout_remaining(k) > 0)
+    return {"users": len(entry["users"]) if entry else 0,
+            "age": now - entry["at"] if entry else None, "locked": locked}
+
+
+# ──────────────────────────────────────────────
+# تحديد المحاولات الخاطئة
+# ──────────────────────────────────────────────
+def _recent_failures(key) -> list:
+    now   = time.time()
+    fails = [t for t in _failures.get((current_tenant(), key), []) if now - t <= FAILURE_WINDOW]
+    _failures[(current_tenant(), key)] = fails
+    return fails
+
+
+def lockout_remaining(key) -> float:
+    """ثوانٍ متبقية على قفل المستخدم (مفتاح مطبّع)، 0 إن لم يكن مقفلاً."""
+    with _lock:
+        fails = _recent_failures(key)
+    if len(fails) < MAX_FAILURES:
+        return 0.0
+    wait = min(LOCKOUT_SECONDS * 2 ** (len(fails) - MAX_FAILURES), LOCKOUT_MAX_SECONDS)
+    return max(0.0, fails[-1] + wait - time.time())
+
+
+def _fail(key) -> None:
+    with _lock:
+        _recent_failures(key).append(time.time())
+
+
+# ──────────────────────────────────────────────
+# الدخول
+# ──────────────────────────────────────────────
+def authenticate(username, password, load):
+    """
+    (نجح، ملف المستخدم دون كلمة المرور، رسالة الخطأ). load() يرجع سجلات ورقة Users ويُستدعى
+    فقط إن لم يكن الدليل محمّلاً أو كان قديماً، أو مرة لاسم غير موجود.
+    """
+    key  = normalize_key(str(username).strip())
+    wait = lockout_remaining(key)
+    if wait > 0:
+        return False, None, "محاولات كثيرة خاطئة — حاول بعد " + str(int(wait) + 1) + " ثانية"
+    users = _directory(load)
+    user  = users.get(key)
+    if user is None and key:
+        tenant = current_tenant()
+        if time.time() - _reloaded.get(tenant, 0.0) > RELOAD_MIN_SECONDS:
+            _reloaded[tenant] = time.time()
+            user = _directory(load, force=True).get(key)
+    if user is None or not user["hash"]:
+        verify_password(password, _DUMMY_HASH)
+        _fail(key)
+        return False, None, "بيانات الدخول غير صحيحة"
+    if not verify_password(password, user["hash"]):
+        _fail(key)
+        return False, None, "بيانات الدخول غير صحيحة"
+    with _lock:
+        _failures.pop((current_tenant(), key), None)
+    return True, dict(user["profile"]), ""
+
+
+def migrate_password_hashes(ws) -> int:
+    """
+    يكتب password_hash لكل صف في ورقة Users ما زال بكلمة مرور نصية ويفرغ خليتها — قراءة واحدة
+    وكتابة واحدة. الصفوف المرحّلة لا تُمس فإعادة التشغيل آمنة. يرجع عدد الصفوف المرحّلة.
+    """
+    vals = ws.get_all_values()
+    if not vals or PLAIN_COL not in vals[0]:
+        return 0
+    header = list(vals[0])
+    src    = header.index(PLAIN_COL)
+    cells  = []
+    if HASH_COL not in header:
+        header.append(HASH_COL)
+        cells.append(gspread.Cell(1, len(header), HASH_COL))
+    dst = header.index(HASH_COL)
+    n   = 0
+    for i, row in enumerate(vals[1:], start=2):
+        plain = row[src] if src < len(row) else ""
+        if not str(plain).strip():
+            continue
+        cells.append(gspread.Cell(i, dst + 1, hash_password(plain)))
+        cells.append(gspread.Cell(i, src + 1, ""))
+        n += 1
+    if n:
+        ws.update_cells(cells)
+    return n